@@ -0,0 +1,269 @@
+"""In-process load test for the API.
+
+Boots `server.app` against a throwaway database filled by `datagen` at the
+requested scale, then runs concurrent virtual users through weighted storefront,
+checkout and admin scenarios and reports throughput plus p50/p95/p99 per
+route. Product traffic follows the same Zipf popularity as the generated
+orders. Payments use the in-memory fake gateway, installed through the
+`current_payment_gateway` dependency override (`--payment-latency` adds
+simulated provider round-trip time).
+
+    cd backend && python -m benchmarks.load --products 2000 --orders 20000 --users 50 --duration 30
+    cd backend && python -m benchmarks.load --in-memory        # mongomock-motor instead of mongod
+
+`--save run.json` stores the results; `--compare baseline.json` exits
+non-zero when any route's p95 got more than `--tolerance` slower, so it can
+gate a deploy. The database (`DB_NAME` defaults to a fresh `loadtest_*` name)
+is dropped afterwards unless `--keep` is given. Image derivatives the app
+generates go to `--uploads-dir` (by default a temp dir, removed afterwards
+like the database), never to backend/uploads.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+ADDRESS = {"first_name": "Load", "last_name": "Test", "address": "1 Bench St", "city": "Springfield", "zip_code": "62701"}
+
+MIXES = {
+    "storefront": {"browse": 60, "product": 30, "search": 10},
+    "checkout": {"browse": 20, "product": 20, "checkout": 60},
+    "admin": {"admin": 100},
+    "mixed": {"browse": 45, "product": 25, "search": 10, "checkout": 15, "admin": 5},
+}
+
+PRODUCT_SORTS = ["recommended", "price-low", "price-high", "name-az", "name-za"]
+SEARCH_TERMS = ["jacket", "denim", "blossom", "black", "hoodie", "tee", "cream", "retro"]
+
+
+def use_in_memory_mongo():
+    """Point every AsyncIOMotorClient at one shared mongomock-motor client"""
+    try:
+        import mongomock_motor
+    except ImportError:
+        sys.exit("--in-memory needs mongomock-motor: pip install -r requirements-dev.txt")
+    import motor.motor_asyncio
+
+    shared = mongomock_motor.AsyncMongoMockClient()
+    motor.motor_asyncio.AsyncIOMotorClient = lambda *args, **kwargs: shared
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def call(self, client, method: str, route: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except Exception:
+            self.errors[route] += 1
+            return None
+        self.latencies[route].append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            self.errors[route] += 1
+        return response
+
+    def report(self, elapsed: float) -> dict:
+        routes = {}
+        for route, samples in sorted(self.latencies.items()):
+            samples.sort()
+            pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000
+            routes[route] = {
+                "requests": len(samples),
+                "errors": self.errors[route],
+                "rps": round(len(samples) / elapsed, 1),
+                "p50_ms": round(pick(0.50), 2),
+                "p95_ms": round(pick(0.95), 2),
+                "p99_ms": round(pick(0.99), 2),
+                "max_ms": round(samples[-1] * 1000, 2),
+            }
+        total = sum(r["requests"] for r in routes.values())
+        return {"elapsed_s": round(elapsed, 2), "requests": total, "rps": round(total / elapsed, 1), "routes": routes}
+
+
+class Scenarios:
+    def __init__(self, client, recorder: Recorder, catalog, popularity, admin_headers: dict):
+        self.client = client
+        self.r = recorder
+        self.catalog = catalog
+        # Traffic follows the same popularity the orders were generated with
+        self.popularity = popularity
+        self.admin_headers = admin_headers
+
+    def _products(self, count: int) -> list:
+        return list(dict.fromkeys(int(p) for p in self.popularity.sample(count)))
+
+    async def browse(self):
+        c = self.client
+        await self.r.call(c, "GET", "GET /api/categories", "/api/categories")
+        await self.r.call(c, "GET", "GET /api/hero-slides", "/api/hero-slides")
+        params = {"limit": 24, "sort": random.choice(PRODUCT_SORTS), "with_total": random.random() < 0.5}
+        if random.random() < 0.5:
+            params["category"] = random.choice(["retro-series", "tops", "down-jacket", "vescartes"])
+        response = await self.r.call(c, "GET", "GET /api/products", "/api/products", params=params)
+        if response is not None and response.status_code == 200:
+            next_page = response.json().get("next_cursor")
+            if next_page and random.random() < 0.3:
+                await self.r.call(c, "GET", "GET /api/products", "/api/products", params={**params, "cursor": next_page})
+
+    async def product(self):
+        p = self._products(1)[0]
+        await self.r.call(self.client, "GET", "GET /api/products/{slug}", f"/api/products/{self.catalog.slugs[p]}")
+        await self.r.call(self.client, "GET", "GET /api/reviews/product/{id}", f"/api/reviews/product/{self.catalog.ids[p]}")
+
+    async def search(self):
+        await self.r.call(self.client, "GET", "GET /api/products?search", "/api/products",
+                          params={"search": random.choice(SEARCH_TERMS), "limit": 24})
+
+    async def checkout(self):
+        catalog = self.catalog
+        items = [
+            {"product_id": catalog.ids[p], "name": catalog.names[p], "price": catalog.prices[p],
+             "size": catalog.sizes[p][0], "color": catalog.colors[p][0], "quantity": random.randint(1, 2),
+             "image": catalog.images[p]}
+            for p in self._products(random.randint(1, 3))
+        ]
+        response = await self.r.call(self.client, "POST", "POST /api/orders", "/api/orders",
+                                     json={"email": "load@example.com", "shipping_address": ADDRESS, "items": items})
+        if response is None or response.status_code != 200:
+            return
+        response = await self.r.call(self.client, "POST", "POST /api/checkout/create", "/api/checkout/create",
+                                     json={"order_id": response.json()["id"], "origin_url": "http://loadtest"})
+        if response is None or response.status_code != 200:
+            return
+        session_id = response.json()["session_id"]
+        for _ in range(2):
+            await self.r.call(self.client, "GET", "GET /api/checkout/status/{id}", f"/api/checkout/status/{session_id}")
+
+    async def admin(self):
+        c, h = self.client, self.admin_headers
+        await self.r.call(c, "GET", "GET /api/admin/stats", "/api/admin/stats", headers=h)
+        await self.r.call(c, "GET", "GET /api/admin/orders", "/api/admin/orders", params={"limit": 100}, headers=h)
+        await self.r.call(c, "GET", "GET /api/admin/products", "/api/admin/products", params={"limit": 100}, headers=h)
+
+
+async def run(args) -> dict:
+    import httpx
+    import numpy as np
+    import server
+    from datagen import Popularity, generate
+    from payments import FakePaymentGateway
+
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    client = server.client
+    db = server.db
+    print(f"Generating {args.products} products, {args.users_count} users and {args.orders} orders in {db.name}...")
+    seeded = time.perf_counter()
+    catalog = await generate(
+        db, products=args.products, users=args.users_count, orders=args.orders, reviews=args.reviews,
+        seed=args.seed, processes=args.processes, mongo_url=args.mongo_url, log=lambda line: None
+    )
+    popularity = Popularity(len(catalog.ids), np.random.default_rng(args.seed))
+    gateway = FakePaymentGateway(latency=args.payment_latency)
+    server.app.dependency_overrides[server.current_payment_gateway] = lambda: gateway
+    await server.app.router.startup()
+    print(f"Seeded and started in {time.perf_counter() - seeded:.1f}s")
+
+    weights = MIXES[args.mix]
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url="http://loadtest", timeout=60) as http:
+            login = await http.post("/api/auth/login", json={"email": "admin@ddebuut.com", "password": "admin123"})
+            admin_headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+            recorder = Recorder()
+            scenarios = Scenarios(http, recorder, catalog, popularity, admin_headers)
+            names, chances = list(weights), list(weights.values())
+            deadline = time.perf_counter() + args.duration
+
+            async def user():
+                while time.perf_counter() < deadline:
+                    await getattr(scenarios, random.choices(names, weights=chances)[0])()
+
+            print(f"Running the {args.mix} mix with {args.users} users for {args.duration}s...")
+            started = time.perf_counter()
+            await asyncio.gather(*[user() for _ in range(args.users)])
+            return recorder.report(time.perf_counter() - started)
+    finally:
+        await server.app.router.shutdown()
+        await gateway.close()
+        if not args.keep:
+            await client.drop_database(db.name)
+
+
+def print_report(report: dict):
+    print(f"\n{report['requests']} requests in {report['elapsed_s']}s, {report['rps']} req/s")
+    print(f"{'route':<34} {'reqs':>7} {'err':>5} {'rps':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for route, r in report["routes"].items():
+        print(f"{route:<34} {r['requests']:>7} {r['errors']:>5} {r['rps']:>8} {r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} {r['max_ms']:>8}")
+
+
+def compare(report: dict, baseline_path: str, tolerance: float) -> bool:
+    baseline = json.loads(Path(baseline_path).read_text())["routes"]
+    ok = True
+    for route, r in report["routes"].items():
+        before = baseline.get(route)
+        if before and r["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+            print(f"REGRESSION {route}: p95 {before['p95_ms']} -> {r['p95_ms']} ms")
+            ok = False
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process API load test")
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default=f"loadtest_{uuid.uuid4().hex[:8]}")
+    parser.add_argument("--in-memory", action="store_true", help="use mongomock-motor instead of a mongod")
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument("--users-count", type=int, default=1000, help="registered users to generate")
+    parser.add_argument("--reviews", type=int, default=2000)
+    parser.add_argument("--processes", type=int, default=1, help="order generator processes (needs a real mongod)")
+    parser.add_argument("--users", type=int, default=50, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=20, help="seconds")
+    parser.add_argument("--mix", choices=sorted(MIXES), default="mixed")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--payment-latency", type=float, default=0.0, help="simulated payment provider latency, seconds")
+    parser.add_argument("--save", help="write the results as JSON")
+    parser.add_argument("--compare", help="baseline JSON from an earlier --save")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p95 slowdown vs the baseline")
+    parser.add_argument("--keep", action="store_true", help="don't drop the database or temp uploads dir afterwards")
+    parser.add_argument("--uploads-dir", help="where the app stores uploads (default: a temp dir)")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    # server.py reads its configuration at import time
+    os.environ["MONGO_URL"] = args.mongo_url
+    os.environ["DB_NAME"] = args.db_name
+    uploads_dir = args.uploads_dir or tempfile.mkdtemp(prefix="loadtest-uploads-")
+    os.environ["UPLOADS_DIR"] = uploads_dir
+    if args.in_memory:
+        use_in_memory_mongo()
+
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        if not args.uploads_dir and not args.keep:
+            shutil.rmtree(uploads_dir, ignore_errors=True)
+    print_report(report)
+    if args.save:
+        Path(args.save).write_text(json.dumps(report, indent=2))
+    if args.compare and not compare(report, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""JSON serialization cost for realistic product and order payloads.
+
+Compares, per response body:
+  - the old path: FastAPI's jsonable_encoder + stdlib json (JSONResponse)
+  - FastJSONResponse as the default response class (jsonable_encoder + orjson)
+  - returning FastJSONResponse directly (orjson only)
+
+    cd backend && python -m benchmarks.serialization [--rounds 200]
+"""
+import argparse
+import json
+import random
+import sys
+import timeit
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from responses import FastJSONResponse  # noqa: E402
+
+SIZES = ["XS", "S", "M", "L", "XL", "XXL"]
+COLORS = ["Black", "White", "Washed Grey", "Olive", "Navy", "Burgundy"]
+
+
+def product(n: int) -> dict:
+    """Shaped like a stored product as returned by Motor with {"_id": 0}"""
+    return {
+        "id": str(uuid.uuid4()),
+        "name": f"Vintage Oversized Tee {n}",
+        "slug": f"vintage-oversized-tee-{n}",
+        "description": "Heavyweight cotton with a relaxed, boxy fit and a washed finish. " * 3,
+        "price": round(random.uniform(19, 120), 2),
+        "original_price": round(random.uniform(120, 200), 2),
+        "shipping_cost": 5.99,
+        "currency": "USD",
+        "category_id": str(uuid.uuid4()),
+        "in_stock": True,
+        "sizes": SIZES,
+        "colors": random.sample(COLORS, 3),
+        "images": [f"https://example.com/api/uploads/{uuid.uuid4().hex}.jpg" for _ in range(4)],
+        "created_at": datetime.utcnow() - timedelta(minutes=n),
+    }
+
+
+def order(n: int) -> dict:
+    items = [
+        {
+            "product_id": str(uuid.uuid4()),
+            "name": f"Vintage Oversized Tee {i}",
+            "price": 49.99,
+            "size": "M",
+            "color": "Black",
+            "quantity": 1 + i % 3,
+            "image": f"https://example.com/api/uploads/{uuid.uuid4().hex}.jpg",
+        }
+        for i in range(3)
+    ]
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": str(uuid.uuid4()),
+        "email": f"customer{n}@example.com",
+        "items": items,
+        "shipping_address": {
+            "first_name": "Alex", "last_name": "Doe", "address": "1 Main St",
+            "city": "Springfield", "state": "IL", "zip_code": "62701", "country": "US",
+        },
+        "subtotal": 179.94,
+        "shipping": 5.99,
+        "total": 185.93,
+        "status": "processing",
+        "paid": True,
+        "created_at": datetime.utcnow() - timedelta(hours=n),
+    }
+
+
+def main(args):
+    payloads = {
+        "products page (100)": {"products": [product(n) for n in range(100)], "total": 1000, "next_cursor": None},
+        "admin orders (1000)": [order(n) for n in range(1000)],
+        "user orders (100)": [order(n) for n in range(100)],
+    }
+    paths = {
+        "jsonable_encoder + json": lambda c: JSONResponse(jsonable_encoder(c)).body,
+        "jsonable_encoder + orjson": lambda c: FastJSONResponse(jsonable_encoder(c)).body,
+        "orjson direct": lambda c: FastJSONResponse(c).body,
+    }
+
+    for name, content in payloads.items():
+        # Same document either way, datetimes included
+        assert json.loads(paths["orjson direct"](content)) == json.loads(paths["jsonable_encoder + json"](content))
+        print(f"{name}, {len(paths['orjson direct'](content)) // 1024} KB")
+        baseline = None
+        for label, render in paths.items():
+            seconds = min(timeit.repeat(lambda: render(content), number=args.rounds, repeat=3)) / args.rounds
+            baseline = baseline or seconds
+            print(f"  {label:<28} {seconds * 1000:>8.3f} ms  {baseline / seconds:>6.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=200)
+    main(parser.parse_args())
@@ -0,0 +1,103 @@
+"""Requests/sec for a hot set of uploaded images.
+
+Serves the same generated image set through the plain StaticFiles mount and
+through ImmutableStaticFiles, in-process over ASGI, for full downloads,
+browser revalidation (If-None-Match -> 304) and range requests.
+
+    cd backend && python -m benchmarks.uploads [--images 50] [--requests 5000] [--concurrency 50]
+
+In-process numbers leave out the network and the server's sendfile path, so
+they compare per-request overhead rather than absolute throughput. A browser
+or CDN honouring `immutable` doesn't send the request at all.
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+from PIL import Image
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.staticfiles import StaticFiles
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from static_files import ImmutableStaticFiles  # noqa: E402
+
+
+def make_images(directory: Path, count: int) -> list:
+    """Noisy JPEGs (~100 KB each) stored under content-hash names"""
+    names = []
+    for _ in range(count):
+        image = Image.effect_noise((512, 512), 64).convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=90)
+        data = buffer.getvalue()
+        sha256 = hashlib.sha256(data).hexdigest()
+        name = f"{sha256[:2]}/{sha256[2:4]}/{sha256}.jpg"
+        (directory / name).parent.mkdir(parents=True, exist_ok=True)
+        (directory / name).write_bytes(data)
+        names.append(name)
+    return names
+
+
+async def run(client: httpx.AsyncClient, requests: list, concurrency: int) -> tuple:
+    semaphore = asyncio.Semaphore(concurrency)
+    received = 0
+
+    async def one(url, headers):
+        nonlocal received
+        async with semaphore:
+            response = await client.get(url, headers=headers)
+            assert response.status_code in (200, 206, 304), response.status_code
+            received += len(response.content)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[one(url, headers) for url, headers in requests])
+    elapsed = time.perf_counter() - started
+    return len(requests) / elapsed, received / elapsed
+
+
+async def main(args):
+    directory = Path(tempfile.mkdtemp(prefix="uploads-bench-"))
+    names = make_images(directory, args.images)
+    size = sum((directory / name).stat().st_size for name in names) // len(names)
+    print(f"{args.images} images, {size // 1024} KB average, {args.requests} requests, concurrency {args.concurrency}")
+
+    app = Starlette(routes=[
+        Mount("/plain", StaticFiles(directory=str(directory))),
+        Mount("/immutable", ImmutableStaticFiles(directory=str(directory))),
+    ])
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        etags = {}
+        for name in names:
+            etags[name] = (await client.get(f"/immutable/{name}")).headers["etag"]
+
+        hot = [random.choice(names) for _ in range(args.requests)]
+        scenarios = [
+            ("StaticFiles, full GET", [(f"/plain/{n}", {}) for n in hot]),
+            ("ImmutableStaticFiles, full GET", [(f"/immutable/{n}", {}) for n in hot]),
+            ("ImmutableStaticFiles, If-None-Match", [(f"/immutable/{n}", {"if-none-match": etags[n]}) for n in hot]),
+            ("ImmutableStaticFiles, 16 KB range", [(f"/immutable/{n}", {"range": "bytes=0-16383"}) for n in hot]),
+        ]
+        for label, requests in scenarios:
+            rps, throughput = await run(client, requests, args.concurrency)
+            print(f"{label:<40} {rps:>9.0f} req/s {throughput / 1024 / 1024:>9.1f} MB/s")
+
+    for path in sorted(directory.rglob("*"), reverse=True):
+        path.unlink() if path.is_file() else os.rmdir(path)
+    os.rmdir(directory)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--images", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,214 @@
+"""One-shot database bootstrap: indexes, seed data and migrations.
+
+Run it once per deploy, before (re)starting the API workers:
+
+    python bootstrap.py            # apply whatever is pending
+    python bootstrap.py --check    # exit 1 if the database is behind this code
+    python bootstrap.py --force    # re-run every step (all are idempotent)
+
+The command line also backfills image derivatives for stored uploads
+(`images.backfill`) unless given --skip-images; workers never do.
+
+When it finishes it leaves a marker document (`meta._id == "schema"`) with
+the last applied migration and a fingerprint of `indexes.INDEXES`. Worker
+startup only reads that marker through the shared client. Adding a migration
+to MIGRATIONS or changing an index declaration makes the marker stale, so
+the next bootstrap runs it. An index that could not be created (duplicates
+under a unique key) or conflicts with an existing one leaves the fingerprint
+out and is listed in `index_problems` instead, so `--check` fails and the
+next bootstrap tries again.
+
+Hosts without a release step can leave AUTO_BOOTSTRAP on (the default): the
+first worker to find a stale marker takes a lease in `meta` and bootstraps,
+and the others wait for the marker to become current instead of repeating
+the work.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from indexes import INDEXES, ensure_indexes
+from seed_data import seed_database
+from stats import StatsEngine
+
+logger = logging.getLogger(__name__)
+
+MARKER_ID = "schema"
+LOCK_ID = "bootstrap_lock"
+LOCK_LEASE_SECONDS = 600
+
+
+async def _initial_data(db):
+    await seed_database(db)
+    # Must exist before the first $inc, or pre-existing orders would be missed
+    await StatsEngine(db).ensure_built()
+
+
+# (version, description, migration) in order; append, never renumber
+MIGRATIONS = [
+    (1, "seed catalog, admin user and dashboard stats", _initial_data),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+class SchemaOutOfDate(RuntimeError):
+    pass
+
+
+def index_fingerprint() -> str:
+    declared = {name: [model.document for model in models] for name, models in INDEXES.items()}
+    return hashlib.sha256(json.dumps(declared, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def is_current(marker: Optional[dict]) -> bool:
+    return (
+        marker is not None
+        and marker.get("version", 0) >= SCHEMA_VERSION
+        and marker.get("indexes") == index_fingerprint()
+    )
+
+
+def describe(marker: Optional[dict]) -> str:
+    version = (marker or {}).get("version", 0)
+    if version < SCHEMA_VERSION:
+        return f"Database schema is at version {version}, this code expects {SCHEMA_VERSION}"
+    problems = (marker or {}).get("index_problems")
+    if problems:
+        names = ", ".join(f"{collection}.{name}" for collection, names in problems.items() for name in names)
+        return f"Indexes failed to apply or conflict with existing ones: {names}"
+    if (marker or {}).get("indexes") != index_fingerprint():
+        return "Index declarations changed since the last bootstrap"
+    return f"Database schema is up to date (version {version})"
+
+
+async def bootstrap(db, force: bool = False) -> dict:
+    """Apply pending steps and return the new marker"""
+    marker = await db.meta.find_one({"_id": MARKER_ID}) or {}
+    applied = 0 if force else marker.get("version", 0)
+
+    fingerprint = index_fingerprint()
+    problems = {}
+    if force or marker.get("indexes") != fingerprint:
+        logger.info("Reconciling indexes")
+        report = await ensure_indexes(db)
+        problems = {
+            collection: result["failed"] + result["conflicts"]
+            for collection, result in report.items()
+            if result["failed"] or result["conflicts"]
+        }
+
+    for version, description, migrate in MIGRATIONS:
+        if version > applied:
+            logger.info(f"Applying migration {version}: {description}")
+            started = time.perf_counter()
+            await migrate(db)
+            await db.meta.update_one(
+                {"_id": MARKER_ID},
+                {"$max": {"version": version}, "$set": {"updated_at": datetime.utcnow()}},
+                upsert=True
+            )
+            logger.info(f"Migration {version} done in {time.perf_counter() - started:.1f}s")
+
+    if problems:
+        logger.error(
+            f"Indexes not applied: {problems} - fix the data or drop the conflicting index; "
+            f"the next bootstrap retries them"
+        )
+        update = {"$set": {"index_problems": problems, "updated_at": datetime.utcnow()}, "$unset": {"indexes": ""}}
+    else:
+        update = {"$set": {"indexes": fingerprint, "updated_at": datetime.utcnow()}, "$unset": {"index_problems": ""}}
+    return await db.meta.find_one_and_update(
+        {"_id": MARKER_ID}, update, upsert=True, return_document=ReturnDocument.AFTER
+    )
+
+
+async def _acquire_lock(db, owner: str) -> bool:
+    now = datetime.utcnow()
+    try:
+        # Matches only an expired lease; a live one makes the upsert collide on _id
+        await db.meta.update_one(
+            {"_id": LOCK_ID, "expires_at": {"$lt": now}},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=LOCK_LEASE_SECONDS)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+async def ensure_schema(db, auto_bootstrap: bool = True, poll_interval: float = 1.0):
+    """Startup check: one read when the database is current"""
+    marker = await db.meta.find_one({"_id": MARKER_ID})
+    if is_current(marker):
+        return
+    if not auto_bootstrap:
+        raise SchemaOutOfDate(f"{describe(marker)} - run `python bootstrap.py` first")
+
+    owner = str(uuid.uuid4())
+    if await _acquire_lock(db, owner):
+        try:
+            await bootstrap(db)
+        finally:
+            await db.meta.delete_one({"_id": LOCK_ID, "owner": owner})
+        return
+
+    logger.info("Another worker is bootstrapping the database, waiting")
+    deadline = time.monotonic() + LOCK_LEASE_SECONDS
+    while time.monotonic() < deadline:
+        await asyncio.sleep(poll_interval)
+        if is_current(await db.meta.find_one({"_id": MARKER_ID})):
+            return
+        if await _acquire_lock(db, owner):
+            # The other worker finished without a current marker, or its lease
+            # expired (it died mid-bootstrap); finish the job here
+            try:
+                await bootstrap(db)
+            finally:
+                await db.meta.delete_one({"_id": LOCK_ID, "owner": owner})
+            return
+    raise SchemaOutOfDate("Timed out waiting for another worker to bootstrap the database")
+
+
+async def _main(args):
+    from dotenv import load_dotenv
+    from database import create_client, database_name
+
+    load_dotenv(Path(__file__).parent / '.env')
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    client = create_client()
+    db = client[database_name()]
+    try:
+        marker = await db.meta.find_one({"_id": MARKER_ID})
+        if args.check:
+            print(describe(marker))
+            raise SystemExit(0 if is_current(marker) else 1)
+        marker = await bootstrap(db, force=args.force)
+        print(f"Database at schema version {marker['version']}")
+        if not args.skip_images:
+            from images import backfill
+            from uploads import uploads_dir
+            result = await backfill(db, uploads_dir())
+            print(f"Image derivatives: {result['generated']} generated, {result['failed']} failed")
+        if not is_current(marker):
+            print(describe(marker))
+            raise SystemExit(1)
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply indexes, seed data and migrations")
+    parser.add_argument("--check", action="store_true", help="only report whether a bootstrap is needed")
+    parser.add_argument("--force", action="store_true", help="re-run every step")
+    parser.add_argument("--skip-images", action="store_true", help="don't backfill image derivatives")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,177 @@
+"""The MongoDB client, built once from settings, and its connection pool metrics.
+
+Every entry point (the API, bootstrap, seed_data, datagen, `uploads.py gc`)
+gets its client from `create_client`, so driver settings are configured per
+deployment through the environment instead of being hard-coded:
+
+    MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_MAX_CONNECTING,
+    MONGO_MAX_IDLE_TIME_MS, MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    MONGO_CONNECT_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS,
+    MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_TIMEOUT_MS (per operation),
+    MONGO_COMPRESSORS (e.g. "zstd,snappy,zlib"; zstd/snappy need their
+    Python packages), MONGO_APP_NAME
+
+Unset settings fall back to whatever MONGO_URL says, then to the driver
+defaults. `catalog_database` returns a handle for public catalog reads with
+MONGO_CATALOG_READ_PREFERENCE (default secondaryPreferred, optionally
+bounded by MONGO_CATALOG_MAX_STALENESS_S, at least 90). On a standalone
+server every read goes to the primary anyway.
+
+`pool_metrics` listens to the driver's connection pool events: checkouts,
+how long they waited for a connection, failures by reason, connections in
+use and open.
+"""
+import os
+import threading
+import time
+from collections import Counter, deque
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+
+DEFAULT_DB_NAME = "ddebuut"
+
+INT_OPTIONS = {
+    "MONGO_MAX_POOL_SIZE": "maxPoolSize",
+    "MONGO_MIN_POOL_SIZE": "minPoolSize",
+    "MONGO_MAX_CONNECTING": "maxConnecting",
+    "MONGO_MAX_IDLE_TIME_MS": "maxIdleTimeMS",
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": "waitQueueTimeoutMS",
+    "MONGO_CONNECT_TIMEOUT_MS": "connectTimeoutMS",
+    "MONGO_SOCKET_TIMEOUT_MS": "socketTimeoutMS",
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": "serverSelectionTimeoutMS",
+    "MONGO_TIMEOUT_MS": "timeoutMS",
+}
+
+READ_PREFERENCES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection pool counters, safe to update from the driver's threads"""
+
+    def __init__(self, window: int = 2048):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._waits = deque(maxlen=window)
+        self.checkouts = 0
+        self.checkout_failures = Counter()
+        self.in_use = 0
+        self.open = 0
+        self.created = 0
+        self.cleared = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    # A checkout starts and finishes on the same thread, so the start time
+    # can be kept per thread
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        wait = time.perf_counter() - getattr(self._local, "started", time.perf_counter())
+        with self._lock:
+            self.checkouts += 1
+            self.in_use += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            self._waits.append(wait)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures[str(event.reason)] += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open += 1
+            self.created += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open -= 1
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.cleared += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                "checkouts": self.checkouts,
+                "checkout_failures": dict(self.checkout_failures),
+                "in_use": self.in_use,
+                "open": self.open,
+                "created": self.created,
+                "cleared": self.cleared,
+                "wait_avg_ms": round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "wait_p99_ms": round(waits[int(0.99 * (len(waits) - 1))] * 1000, 3) if waits else 0.0,
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+            }
+
+
+pool_metrics = PoolMetrics()
+
+
+def client_options() -> dict:
+    options = {"appname": os.environ.get("MONGO_APP_NAME", "ddebuut")}
+    for variable, option in INT_OPTIONS.items():
+        value = os.environ.get(variable)
+        if value:
+            options[option] = int(value)
+    compressors = os.environ.get("MONGO_COMPRESSORS")
+    if compressors:
+        options["compressors"] = compressors
+    return options
+
+
+def create_client(mongo_url: str = None, listeners=(), **overrides) -> AsyncIOMotorClient:
+    """Motor client for MONGO_URL with the configured driver settings, plus extra event `listeners`"""
+    options = client_options()
+    options.update(overrides)
+    return AsyncIOMotorClient(
+        mongo_url or os.environ['MONGO_URL'],
+        event_listeners=[pool_metrics, *listeners],
+        **options
+    )
+
+
+def database_name() -> str:
+    return os.environ.get('DB_NAME', DEFAULT_DB_NAME)
+
+
+def catalog_read_preference():
+    mode = os.environ.get("MONGO_CATALOG_READ_PREFERENCE", "secondaryPreferred")
+    if mode not in READ_PREFERENCES:
+        raise ValueError(f"MONGO_CATALOG_READ_PREFERENCE must be one of {', '.join(READ_PREFERENCES)}")
+    max_staleness = os.environ.get("MONGO_CATALOG_MAX_STALENESS_S")
+    if mode == "primary" or not max_staleness:
+        return READ_PREFERENCES[mode]()
+    return READ_PREFERENCES[mode](max_staleness=int(max_staleness))
+
+
+def catalog_database(client: AsyncIOMotorClient, name: str = None):
+    """Handle on the same database that reads public catalog data with the catalog read preference"""
+    return client.get_database(name or database_name(), read_preference=catalog_read_preference())
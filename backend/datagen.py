@@ -0,0 +1,399 @@
+"""Synthetic store data at capacity-testing scale.
+
+Builds on the seed catalog in `seed_data`: the hand-written categories and
+products come first, then generated ones cloned from them up to the
+requested counts, followed by users, orders and reviews with realistic
+shapes:
+
+- product popularity follows a Zipf distribution, so a few products take
+  most of the orders and reviews, like a real shop
+- cart sizes are geometric (mostly one or two lines) with small quantities
+- order statuses, paid flags and ratings use skewed, shop-like weights
+- orders are spread over the last `--days` days; 30% are guest checkouts
+
+Everything is written with unordered `insert_many` batches, several in
+flight at a time, and orders (the bulk of the data) are generated by
+`--processes` worker processes, each with its own client and id range, so a
+10M-order dataset takes minutes against a local mongod. Indexes are built
+once the data is in (by `bootstrap`, which also adds the admin user and
+builds the dashboard stats). With --drop, the catalog cache versions are
+bumped at the end, so running API workers drop their caches and ETags.
+
+    python datagen.py --drop --products 20000 --users 500000 --orders 10000000 --reviews 1000000
+
+Synthetic users all share the password `password`.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+import numpy as np
+
+from seed_data import initial_categories, initial_products
+
+COLLECTIONS = ["categories", "products", "users", "orders", "reviews", "stats", "stats_daily"]
+# Replaced by --drop and served behind the catalog ETags (see http_cache)
+CATALOG_COLLECTIONS = ["categories", "products"]
+
+ZIPF_EXPONENT = 1.1
+GUEST_ORDER_SHARE = 0.3
+MAX_CART_LINES = 8
+ORDER_STATUSES = ["pending", "processing", "shipped", "delivered", "cancelled"]
+ORDER_STATUS_WEIGHTS = [0.08, 0.12, 0.2, 0.55, 0.05]
+RATING_WEIGHTS = [0.04, 0.05, 0.11, 0.3, 0.5]
+REVIEW_TITLES = ["Love it", "Great fit", "Runs small", "Good quality", "Not for me", "Exactly as pictured", "Would buy again"]
+REVIEW_COMMENTS = [
+    "Fabric feels heavier than expected and the print held up after washing.",
+    "Sized up one and it fits perfectly oversized.",
+    "Colour is a little darker than the photos but still looks great.",
+    "Shipping took a while, the jacket itself is excellent.",
+    "Stitching came loose after a few wears.",
+]
+CITIES = [("Springfield", "62701"), ("Portland", "97201"), ("Austin", "73301"), ("Denver", "80201"), ("Boston", "02108")]
+FIRST_NAMES = ["Alex", "Sam", "Jordan", "Taylor", "Morgan", "Casey", "Riley", "Jamie"]
+LAST_NAMES = ["Smith", "Garcia", "Chen", "Novak", "Okafor", "Silva", "Kim", "Brown"]
+
+
+class Catalog(NamedTuple):
+    """What order and review generation needs to know about each product, by popularity rank"""
+    ids: List[str]
+    slugs: List[str]
+    names: List[str]
+    prices: List[float]
+    images: List[str]
+    sizes: List[List[str]]
+    colors: List[List[str]]
+
+
+class Popularity:
+    """Draws indexes 0..n-1 with Zipf-like weights (index 0 most popular)"""
+
+    def __init__(self, n: int, rng: np.random.Generator, exponent: float = ZIPF_EXPONENT):
+        weights = 1.0 / np.arange(1, n + 1) ** exponent
+        self.cdf = np.cumsum(weights / weights.sum())
+        self.rng = rng
+
+    def sample(self, size: int) -> np.ndarray:
+        return np.minimum(np.searchsorted(self.cdf, self.rng.random(size)), len(self.cdf) - 1)
+
+
+def make_categories(count: int, now: datetime) -> List[dict]:
+    categories = [{**c, "created_at": now} for c in initial_categories]
+    for n in range(len(categories), count):
+        template = initial_categories[n % len(initial_categories)]
+        categories.append({
+            **template,
+            "id": f"cat-gen-{n}",
+            "name": f"{template['name']} {n}",
+            "slug": f"{template['slug']}-{n}",
+            "created_at": now,
+        })
+    return categories
+
+
+def make_products(count: int, categories: List[dict], rng: np.random.Generator, now: datetime) -> List[dict]:
+    products = [{**p, "created_at": now} for p in initial_products]
+    category_ids = [c["id"] for c in categories]
+    for n in range(len(products), count):
+        template = initial_products[n % len(initial_products)]
+        price = round(float(rng.lognormal(3.6, 0.6)), 2)
+        products.append({
+            **template,
+            "id": f"prod-gen-{n}",
+            "name": f"{template['name']} {n}",
+            "slug": f"{template['slug']}-{n}",
+            "price": price,
+            "original_price": round(price * float(rng.uniform(1.2, 2.5)), 2),
+            "category_id": category_ids[int(rng.integers(len(category_ids)))],
+            "in_stock": bool(rng.random() < 0.9),
+            "created_at": now - timedelta(minutes=int(rng.integers(0, 365 * 24 * 60))),
+        })
+    return products
+
+
+def make_catalog(products: List[dict], rng: np.random.Generator) -> Catalog:
+    """Products in a random popularity order, so popular ones aren't just the oldest"""
+    ranked = [products[i] for i in rng.permutation(len(products))]
+    return Catalog(
+        ids=[p["id"] for p in ranked],
+        slugs=[p["slug"] for p in ranked],
+        names=[p["name"] for p in ranked],
+        prices=[p["price"] for p in ranked],
+        images=[p["images"][0] if p.get("images") else "" for p in ranked],
+        sizes=[p.get("sizes") or ["One Size"] for p in ranked],
+        colors=[p.get("colors") or ["Default"] for p in ranked],
+    )
+
+
+def user_id(n: int) -> str:
+    return f"user-gen-{n}"
+
+
+def user_email(n: int) -> str:
+    return f"user{n}@example.com"
+
+
+def make_users(start: int, stop: int, password_hash: str, rng: np.random.Generator, now: datetime) -> List[dict]:
+    ages = rng.integers(0, 2 * 365 * 24 * 3600, stop - start)
+    return [
+        {
+            "id": user_id(n),
+            "email": user_email(n),
+            "name": f"{FIRST_NAMES[n % len(FIRST_NAMES)]} {LAST_NAMES[n // len(FIRST_NAMES) % len(LAST_NAMES)]}",
+            "password": password_hash,
+            "is_admin": False,
+            "created_at": now - timedelta(seconds=int(age)),
+        }
+        for n, age in zip(range(start, stop), ages)
+    ]
+
+
+def shipping_address(n: int) -> dict:
+    city, zip_code = CITIES[n % len(CITIES)]
+    return {
+        "first_name": FIRST_NAMES[n % len(FIRST_NAMES)],
+        "last_name": LAST_NAMES[n // len(FIRST_NAMES) % len(LAST_NAMES)],
+        "address": f"{100 + n % 9000} Market St",
+        "apartment": None,
+        "city": city,
+        "zip_code": zip_code,
+        "phone": None,
+    }
+
+
+def make_orders(count: int, catalog: Catalog, users: int, days: int, rng: np.random.Generator,
+                popularity: Popularity, now: datetime) -> List[dict]:
+    lines = np.minimum(rng.geometric(0.55, count), MAX_CART_LINES)
+    products = popularity.sample(int(lines.sum()))
+    quantities = np.minimum(rng.geometric(0.7, len(products)), 5)
+    picks = rng.random(len(products))
+    customers = rng.integers(0, max(users, 1), count)
+    guests = (rng.random(count) < GUEST_ORDER_SHARE) | (users == 0)
+    statuses = rng.choice(len(ORDER_STATUSES), count, p=ORDER_STATUS_WEIGHTS)
+    ages = rng.integers(0, days * 24 * 3600, count)
+
+    orders, line = [], 0
+    for n in range(count):
+        items, subtotal = [], 0.0
+        for _ in range(lines[n]):
+            p, quantity, pick = products[line], int(quantities[line]), picks[line]
+            line += 1
+            sizes, colors = catalog.sizes[p], catalog.colors[p]
+            price = catalog.prices[p]
+            items.append({
+                "product_id": catalog.ids[p],
+                "name": catalog.names[p],
+                "price": price,
+                "quantity": quantity,
+                "size": sizes[int(pick * len(sizes))],
+                "color": colors[int(pick * len(colors))],
+                "image": catalog.images[p],
+            })
+            subtotal += price * quantity
+        customer = int(customers[n])
+        status = ORDER_STATUSES[statuses[n]]
+        shipping_cost = 0 if subtotal >= 39 else 5.99
+        orders.append({
+            "id": str(uuid.uuid4()),
+            "user_id": None if guests[n] else user_id(customer),
+            "email": f"guest{customer}@example.com" if guests[n] else user_email(customer),
+            "shipping_address": shipping_address(customer),
+            "items": items,
+            "subtotal": round(subtotal, 2),
+            "shipping_cost": shipping_cost,
+            "total": round(subtotal + shipping_cost, 2),
+            "status": status,
+            "paid": status != "pending",
+            "created_at": now - timedelta(seconds=int(ages[n])),
+        })
+    return orders
+
+
+def make_reviews(count: int, catalog: Catalog, users: int, rng: np.random.Generator,
+                 popularity: Popularity, now: datetime) -> List[dict]:
+    products = popularity.sample(count)
+    authors = rng.integers(0, max(users, 1), count)
+    ratings = rng.choice(5, count, p=RATING_WEIGHTS) + 1
+    ages = rng.integers(0, 365 * 24 * 3600, count)
+    return [
+        {
+            "id": str(uuid.uuid4()),
+            "product_id": catalog.ids[products[n]],
+            "order_id": None,
+            "user_id": user_id(int(authors[n])) if users else None,
+            "user_name": FIRST_NAMES[int(authors[n]) % len(FIRST_NAMES)],
+            "rating": int(ratings[n]),
+            "title": REVIEW_TITLES[n % len(REVIEW_TITLES)],
+            "comment": REVIEW_COMMENTS[n % len(REVIEW_COMMENTS)],
+            "verified_purchase": True,
+            "images": [],
+            "created_at": now - timedelta(seconds=int(ages[n])),
+        }
+        for n in range(count)
+    ]
+
+
+class BatchWriter:
+    """insert_many(ordered=False) with up to `in_flight` batches outstanding"""
+
+    def __init__(self, collection, in_flight: int = 4):
+        self.collection = collection
+        self.pending = set()
+        self.in_flight = in_flight
+        self.written = 0
+
+    async def write(self, documents: List[dict]):
+        if len(self.pending) >= self.in_flight:
+            done, self.pending = await asyncio.wait(self.pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        self.pending.add(asyncio.ensure_future(self.collection.insert_many(documents, ordered=False)))
+        self.written += len(documents)
+
+    async def flush(self):
+        if self.pending:
+            await asyncio.gather(*self.pending)
+            self.pending = set()
+
+
+async def insert_orders(db, start: int, stop: int, catalog: Catalog, users: int, days: int,
+                        batch_size: int, seed: int, now: datetime) -> int:
+    """Generate and insert orders start..stop-1 (each range gets its own random stream)"""
+    rng = np.random.default_rng([seed, start])
+    popularity = Popularity(len(catalog.ids), rng)
+    writer = BatchWriter(db.orders)
+    for first in range(start, stop, batch_size):
+        await writer.write(make_orders(min(batch_size, stop - first), catalog, users, days, rng, popularity, now))
+    await writer.flush()
+    return writer.written
+
+
+def _insert_orders_process(mongo_url: str, db_name: str, *args) -> int:
+    from database import create_client
+
+    async def run():
+        client = create_client(mongo_url)
+        try:
+            return await insert_orders(client[db_name], *args)
+        finally:
+            client.close()
+
+    return asyncio.run(run())
+
+
+async def generate(db, categories: int = 20, products: int = 1000, users: int = 1000, orders: int = 10000,
+                   reviews: int = 2000, days: int = 365, batch_size: int = 5000, seed: int = 1,
+                   processes: int = 1, mongo_url: Optional[str] = None, log=print) -> Catalog:
+    """Fill `db` with synthetic data; returns the catalog ranked by popularity.
+
+    With `processes` > 1, orders are written by separate processes that
+    connect to `mongo_url`/`db.name` themselves.
+    """
+    from auth import get_password_hash
+
+    rng = np.random.default_rng(seed)
+    now = datetime.utcnow()
+    started = time.perf_counter()
+
+    def done(what: str, count: int):
+        log(f"{what}: {count} in {time.perf_counter() - started:.1f}s")
+
+    category_docs = make_categories(categories, now)
+    await db.categories.insert_many(category_docs, ordered=False)
+    done("categories", len(category_docs))
+
+    product_docs = make_products(products, category_docs, rng, now)
+    for first in range(0, len(product_docs), batch_size):
+        await db.products.insert_many(product_docs[first:first + batch_size], ordered=False)
+    done("products", len(product_docs))
+    catalog = make_catalog(product_docs, rng)
+
+    # One bcrypt hash for everyone; hashing per user would dominate the run
+    password_hash = get_password_hash("password")
+    writer = BatchWriter(db.users)
+    for first in range(0, users, batch_size):
+        await writer.write(make_users(first, min(first + batch_size, users), password_hash, rng, now))
+    await writer.flush()
+    done("users", users)
+
+    if processes > 1 and orders >= processes * batch_size:
+        loop = asyncio.get_running_loop()
+        bounds = np.linspace(0, orders, processes + 1, dtype=int)
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+            written = await asyncio.gather(*[
+                loop.run_in_executor(pool, _insert_orders_process, mongo_url, db.name, int(start), int(stop),
+                                     catalog, users, days, batch_size, seed, now)
+                for start, stop in zip(bounds, bounds[1:])
+            ])
+        done("orders", sum(written))
+    else:
+        done("orders", await insert_orders(db, 0, orders, catalog, users, days, batch_size, seed, now))
+
+    popularity = Popularity(len(catalog.ids), rng)
+    writer = BatchWriter(db.reviews)
+    for first in range(0, reviews, batch_size):
+        await writer.write(make_reviews(min(batch_size, reviews - first), catalog, users, rng, popularity, now))
+    await writer.flush()
+    done("reviews", reviews)
+    return catalog
+
+
+async def _main(args):
+    from dotenv import load_dotenv
+
+    from bootstrap import bootstrap
+    from database import create_client, database_name
+    from http_cache import CollectionVersions
+
+    root_dir = Path(__file__).parent
+    load_dotenv(root_dir / '.env')
+    mongo_url = os.environ['MONGO_URL']
+    client = create_client(mongo_url)
+    db = client[database_name()]
+    try:
+        if args.drop:
+            for name in COLLECTIONS:
+                await db.drop_collection(name)
+        elif await db.orders.estimated_document_count() or await db.products.estimated_document_count():
+            raise SystemExit(f"{db.name} already has data; pass --drop to replace it")
+
+        await generate(
+            db, args.categories, args.products, args.users, args.orders, args.reviews,
+            days=args.days, batch_size=args.batch_size, seed=args.seed,
+            processes=args.processes, mongo_url=mongo_url
+        )
+        # Indexes after the bulk load: building once is much cheaper than
+        # maintaining them on every insert. This also adds the admin user and
+        # builds the dashboard stats.
+        started = time.perf_counter()
+        await bootstrap(db, force=True)
+        print(f"bootstrapped in {time.perf_counter() - started:.1f}s")
+        if args.drop:
+            versions = CollectionVersions(db, CATALOG_COLLECTIONS)
+            for name in CATALOG_COLLECTIONS:
+                await versions.bump(name)
+            print("catalog cache versions bumped")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic store data")
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--orders", type=int, default=10000)
+    parser.add_argument("--reviews", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=365, help="spread orders over this many days")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="order generator processes")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--drop", action="store_true", help="drop the existing store collections first")
+    asyncio.run(_main(parser.parse_args()))
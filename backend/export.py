@@ -0,0 +1,71 @@
+"""Streaming NDJSON/CSV exports read straight from a Motor cursor.
+
+Documents are pulled from Mongo in batches and flushed to the client every
+BATCH_SIZE rows, so memory stays flat however large the collection is.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+from typing import List
+
+from fastapi.responses import StreamingResponse
+
+BATCH_SIZE = 1000
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _csv_cell(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, default=_json_default)
+    return value
+
+
+async def _ndjson_chunks(cursor):
+    lines = []
+    async for doc in cursor:
+        lines.append(json.dumps(doc, default=_json_default))
+        if len(lines) >= BATCH_SIZE:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+async def _csv_chunks(cursor, columns: List[str]):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    rows = 0
+    async for doc in cursor:
+        writer.writerow([_csv_cell(doc.get(column)) for column in columns])
+        rows += 1
+        if rows % BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    yield buffer.getvalue()
+
+
+def export_response(cursor, fmt: str, columns: List[str], name: str) -> StreamingResponse:
+    """Stream `cursor` as NDJSON (every field) or CSV (`columns` only)"""
+    cursor = cursor.batch_size(BATCH_SIZE)
+    if fmt == "csv":
+        body, media_type = _csv_chunks(cursor, columns), "text/csv"
+    else:
+        body, media_type = _ndjson_chunks(cursor), "application/x-ndjson"
+    filename = f"{name}-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.{fmt}"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -0,0 +1,204 @@
+"""Version-based ETags for public catalog responses.
+
+Every admin write to a catalog collection bumps that collection's counter in
+the `cache_versions` collection. `CatalogCacheMiddleware` derives the ETag of
+a cacheable GET from the counters of the collections the route reads, so a
+matching `If-None-Match` is answered with 304 straight from memory, before
+the request reaches a handler or Mongo. 200 responses get the ETag plus a
+Cache-Control that lets browsers revalidate and shared caches serve them.
+
+Each worker re-reads the counters every `sync_interval` seconds; when another
+worker's write moved one, the registered `on_change` callbacks run first
+(to drop in-process caches, waiting for any rebuild they start) and only
+then is the new version used in ETags. A bump can name the documents it
+changed; the last CHANGE_LOG_SIZE of those are kept with the counter, so a
+worker that only missed a few writes can refresh just those documents.
+
+The counters outlive deploys, so ETags also carry the build they were
+produced by (`build_version`): a release that changes a response's shape
+must not answer 304 to a client holding the old body.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import time
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+CHANGE_LOG_SIZE = 100
+
+
+def build_version(source_dir: Path) -> str:
+    """APP_VERSION, else the commit Render deployed, else a hash of the Python sources"""
+    version = os.environ.get("APP_VERSION") or os.environ.get("RENDER_GIT_COMMIT", "")[:12]
+    if version:
+        return version
+    digest = hashlib.sha256()
+    for path in sorted(source_dir.glob("*.py")):
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:12]
+
+
+class CollectionVersions:
+    def __init__(self, db, collections: Iterable[str], sync_interval: float = 2.0):
+        self.db = db
+        self.sync_interval = sync_interval
+        self._versions: Dict[str, int] = {name: 0 for name in collections}
+        self._changed_at: Dict[str, float] = {}
+        self._listeners: List[Callable[[str, Optional[List[str]]], Optional[Awaitable]]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def on_change(self, callback: Callable[[str, Optional[List[str]]], Optional[Awaitable]]):
+        """Call `callback(collection, ids)` when a write from another worker is noticed.
+
+        `ids` are the documents changed since this worker's version, None when
+        that isn't known (a bump without ids, or more writes than the change
+        log holds). If it returns an awaitable, the new version is only used
+        once that is done.
+        """
+        self._listeners.append(callback)
+
+    def get(self, collection: str) -> int:
+        return self._versions[collection]
+
+    def changed_within(self, collection: str, seconds: float) -> bool:
+        """Whether this worker saw `collection` change in the last `seconds`"""
+        changed_at = self._changed_at.get(collection)
+        return changed_at is not None and time.monotonic() - changed_at < seconds
+
+    async def bump(self, collection: str, ids: Optional[Iterable[str]] = None):
+        """Move `collection` on; `ids` are the documents written, if known"""
+        doc = await self.db.cache_versions.find_one_and_update(
+            {"_id": collection},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            projection={"version": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        change = {"version": doc["version"], "ids": None if ids is None else list(ids)}
+        await self.db.cache_versions.update_one(
+            {"_id": collection},
+            {"$push": {"changes": {"$each": [change], "$slice": -CHANGE_LOG_SIZE}}}
+        )
+        self._versions[collection] = max(self._versions[collection], doc["version"])
+        self._changed_at[collection] = time.monotonic()
+
+    def _changed_ids(self, doc: dict) -> Optional[List[str]]:
+        """Documents written between this worker's version and `doc`, None if unknown"""
+        missed = range(self._versions[doc["_id"]] + 1, doc["version"] + 1)
+        if len(missed) > CHANGE_LOG_SIZE:
+            return None
+        logged = {change["version"]: change["ids"] for change in doc.get("changes", [])}
+        ids = {}
+        for version in missed:
+            # Not logged yet (the bump is between its two writes) counts as unknown too
+            if logged.get(version) is None:
+                return None
+            ids.update(dict.fromkeys(logged[version]))
+        return list(ids)
+
+    async def sync(self):
+        docs = await self.db.cache_versions.find({"_id": {"$in": list(self._versions)}}).to_list(None)
+        changed = {doc["_id"]: doc for doc in docs if doc["version"] > self._versions[doc["_id"]]}
+        pending = []
+        for name, doc in changed.items():
+            self._changed_at[name] = time.monotonic()
+            ids = self._changed_ids(doc)
+            for callback in self._listeners:
+                result = callback(name, ids)
+                if result is not None:
+                    pending.append(result)
+        # A failed rebuild raises here and leaves the old versions, so the next sync retries
+        await asyncio.gather(*pending)
+        for name, doc in changed.items():
+            self._versions[name] = max(self._versions[name], doc["version"])
+
+    async def _sync_loop(self):
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            try:
+                await self.sync()
+            except Exception as e:
+                logger.warning(f"Cache version sync failed: {e}")
+
+    async def start(self):
+        # Counters start from the clock, so ETags handed out against an older
+        # (dropped or restored) database can't match fresh ones
+        origin = int(time.time() * 1000)
+        for name in self._versions:
+            await self.db.cache_versions.update_one({"_id": name}, {"$setOnInsert": {"version": origin}}, upsert=True)
+        # Nothing is cached yet, so the current versions are taken without running the callbacks
+        async for doc in self.db.cache_versions.find({"_id": {"$in": list(self._versions)}}, {"version": 1}):
+            self._versions[doc["_id"]] = max(self._versions[doc["_id"]], doc["version"])
+        self._task = asyncio.create_task(self._sync_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return dict(self._versions)
+
+
+class CatalogCacheMiddleware:
+    """ETag / If-None-Match handling for GET routes matched by `rules`.
+
+    `rules` is a list of (path regex, collections the response depends on);
+    `build` identifies the code that renders the responses. A response that
+    sets `Cache-Control: no-store` itself is passed through untagged.
+    """
+
+    def __init__(
+        self, app: ASGIApp, versions: CollectionVersions, rules: List[Tuple[str, List[str]]], cache_control: str, build: str
+    ):
+        self.app = app
+        self.versions = versions
+        self.rules = [(re.compile(pattern), collections) for pattern, collections in rules]
+        self.cache_control = cache_control
+        self.build = build
+
+    def _etag(self, path: str) -> Optional[str]:
+        for pattern, collections in self.rules:
+            if pattern.fullmatch(path):
+                parts = [self.build, *(f"{name[0]}{self.versions.get(name)}" for name in collections)]
+                return 'W/"' + "-".join(parts) + '"'
+        return None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+        # Taken before the handler reads anything, so the body is never older than its tag
+        etag = self._etag(scope["path"])
+        if etag is None:
+            await self.app(scope, receive, send)
+            return
+
+        if_none_match = Headers(scope=scope).get("if-none-match")
+        if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+            await send({
+                "type": "http.response.start",
+                "status": 304,
+                "headers": [(b"etag", etag.encode()), (b"cache-control", self.cache_control.encode())],
+            })
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        async def send_tagged(message: Message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                headers = MutableHeaders(scope=message)
+                if "no-store" not in headers.get("cache-control", ""):
+                    headers["etag"] = etag
+                    headers["cache-control"] = self.cache_control
+            await send(message)
+
+        await self.app(scope, receive, send_tagged)
@@ -0,0 +1,261 @@
+"""Responsive derivatives for uploaded images.
+
+Every upload gets resized WebP (and AVIF, when Pillow was built with it)
+copies at DERIVATIVE_WIDTHS, written next to the original as
+`<name>-<width>w.<format>`. EXIF/XMP metadata is not carried over. Widths
+above the original's are saved at the original size, so every name in a
+srcset exists once the upload is processed. Work runs on a small thread pool
+in the background; `manifest` is computed from names alone and can be
+returned right away.
+
+The outcome is recorded on the file's `uploads` document: `derivatives`
+maps each format to the widths written, or `derivatives_error` says why
+they couldn't be. Pages only advertise a srcset for uploads whose
+`derivatives` are recorded, so a pending or failed upload falls back to the
+original. Recording them changes the product responses (`image_widths`), so
+the `products` catalog version is bumped with `versions`, once per upload
+and once per backfill, to move the ETags on.
+
+Uploads stored before derivatives existed (or whose copies went missing) are
+covered by a one-shot backfill, run by `python bootstrap.py` after the
+database steps or on its own:
+
+    python images.py                   # generate what is missing
+    python images.py --retry-failed    # also retry uploads that failed before
+
+It runs on its own single, low-priority thread and skips uploads whose
+generation already failed, so broken files aren't retried on every run.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import re
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+from PIL import Image, ImageOps, features
+from pymongo import UpdateOne
+
+from http_cache import CollectionVersions
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_WIDTHS: Tuple[int, ...] = (320, 640, 1024)
+QUALITY = {"webp": 80, "avif": 60}
+DERIVATIVE_NAME = re.compile(r"-\d+w\.(webp|avif)$")
+BACKFILL_NICENESS = 10
+
+
+def available_formats() -> Tuple[str, ...]:
+    return ("webp", "avif") if features.check("avif") else ("webp",)
+
+
+def derivative_name(filename: str, width: int, fmt: str) -> str:
+    stem = filename.rsplit(".", 1)[0]
+    return f"{stem}-{width}w.{fmt}"
+
+
+def is_derivative(filename: str) -> bool:
+    return DERIVATIVE_NAME.search(filename) is not None
+
+
+def generate_derivatives(path: Path, widths: Iterable[int], formats: Iterable[str]) -> List[Path]:
+    """Write every width/format variant of the image at `path`"""
+    written = []
+    with Image.open(path) as source:
+        image = ImageOps.exif_transpose(source)
+        icc_profile = source.info.get("icc_profile")
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if image.mode in ("LA", "P", "PA") else "RGB")
+
+        for width in widths:
+            target_width = min(width, image.width)
+            resized = image
+            if target_width != image.width:
+                height = max(1, round(image.height * target_width / image.width))
+                resized = image.resize((target_width, height), Image.LANCZOS)
+            for fmt in formats:
+                target = path.with_name(derivative_name(path.name, width, fmt))
+                # Unique, so two processes working on the same upload never share a temp file
+                tmp = target.with_name(f".{target.name}.{uuid.uuid4().hex}.tmp")
+                try:
+                    resized.save(tmp, fmt.upper(), quality=QUALITY[fmt], icc_profile=icc_profile)
+                    os.replace(tmp, target)
+                except BaseException:
+                    tmp.unlink(missing_ok=True)
+                    raise
+                written.append(target)
+    return written
+
+
+def _lower_priority(niceness: int):
+    # On Linux this only affects the calling thread
+    try:
+        os.nice(niceness)
+    except OSError:
+        pass
+
+
+class ImageDerivativePipeline:
+    def __init__(
+        self,
+        db,
+        directory: Path,
+        workers: int = 2,
+        widths: Tuple[int, ...] = DERIVATIVE_WIDTHS,
+        niceness: int = 0,
+        versions: Optional[CollectionVersions] = None,
+    ):
+        self.db = db
+        self.versions = versions
+        self.directory = directory
+        self.widths = widths
+        self.formats = available_formats()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix="image-derivatives",
+            initializer=_lower_priority if niceness else None,
+            initargs=(niceness,) if niceness else (),
+        )
+        self._pending = set()
+        self.generated = 0
+        self.failed = 0
+
+    def manifest(self, filename: str, base_url: str) -> dict:
+        """srcset strings per format for `filename`, served under `base_url`"""
+        return {
+            "widths": list(self.widths),
+            "formats": {
+                fmt: ", ".join(f"{base_url}/{derivative_name(filename, w, fmt)} {w}w" for w in self.widths)
+                for fmt in self.formats
+            },
+        }
+
+    async def _announce(self):
+        if self.versions is not None:
+            # No product document changed, so other workers have nothing to re-index
+            await self.versions.bump("products", [])
+
+    async def _process(self, filename: str, announce: bool = True):
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                self._executor, generate_derivatives, self.directory / filename, self.widths, self.formats
+            )
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Image derivatives for {filename} failed: {e}")
+            update = {"$set": {"derivatives_error": str(e), "derivatives_failed_at": datetime.utcnow()}, "$unset": {"derivatives": ""}}
+        else:
+            self.generated += 1
+            update = {
+                "$set": {"derivatives": {fmt: list(self.widths) for fmt in self.formats}},
+                "$unset": {"derivatives_error": "", "derivatives_failed_at": ""},
+            }
+        await self.db.uploads.update_one({"id": filename}, update, upsert=True)
+        if announce and "derivatives" in update["$set"]:
+            await self._announce()
+
+    def schedule(self, filename: str, announce: bool = True) -> asyncio.Task:
+        task = asyncio.create_task(self._process(filename, announce))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+        return task
+
+    def _scan(self) -> Tuple[List[str], List[str]]:
+        """Originals under the directory: (lacking a derivative, with all of them)"""
+        names = {
+            p.relative_to(self.directory).as_posix()
+            for p in self.directory.rglob("*")
+            if p.is_file() and not p.name.startswith(".")
+        }
+        missing, complete = [], []
+        for name in sorted(names):
+            if name.startswith(".") or is_derivative(name):
+                continue
+            if any(derivative_name(name, w, f) not in names for w in self.widths for f in self.formats):
+                missing.append(name)
+            else:
+                complete.append(name)
+        return missing, complete
+
+    async def backfill(self, retry_failed: bool = False) -> dict:
+        """Generate missing derivatives and record existing ones; returns counts"""
+        recorded = {
+            upload["id"]: upload
+            async for upload in self.db.uploads.find({}, {"_id": 0, "id": 1, "derivatives": 1, "derivatives_error": 1})
+        }
+        missing, complete = await asyncio.get_running_loop().run_in_executor(self._executor, self._scan)
+
+        formats = {fmt: list(self.widths) for fmt in self.formats}
+        unrecorded = [name for name in complete if recorded.get(name, {}).get("derivatives") != formats]
+        if unrecorded:
+            await self.db.uploads.bulk_write([
+                UpdateOne({"id": name}, {"$set": {"derivatives": formats}, "$unset": {"derivatives_error": ""}}, upsert=True)
+                for name in unrecorded
+            ], ordered=False)
+
+        failed_before = {name for name in missing if "derivatives_error" in recorded.get(name, {})}
+        todo = missing if retry_failed else [name for name in missing if name not in failed_before]
+        if todo:
+            logger.info(f"Generating image derivatives for {len(todo)} existing uploads")
+        generated, failed = self.generated, self.failed
+        await asyncio.gather(*[self.schedule(name, announce=False) for name in todo])
+        if unrecorded or self.generated > generated:
+            await self._announce()
+        return {
+            "generated": self.generated - generated,
+            "failed": self.failed - failed,
+            "recorded": len(unrecorded),
+            "skipped_failed": 0 if retry_failed else len(failed_before),
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "formats": list(self.formats),
+            "widths": list(self.widths),
+            "pending": len(self._pending),
+            "generated": self.generated,
+            "failed": self.failed,
+        }
+
+
+async def backfill(db, directory: Path, retry_failed: bool = False) -> dict:
+    """One-shot backfill on a dedicated low-priority thread"""
+    pipeline = ImageDerivativePipeline(
+        db, directory, workers=1, niceness=BACKFILL_NICENESS, versions=CollectionVersions(db, ["products"])
+    )
+    try:
+        return await pipeline.backfill(retry_failed)
+    finally:
+        pipeline.shutdown()
+
+
+async def _main(args):
+    from dotenv import load_dotenv
+    from database import create_client, database_name
+    from uploads import uploads_dir
+
+    load_dotenv(Path(__file__).parent / '.env')
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    client = create_client()
+    try:
+        result = await backfill(client[database_name()], uploads_dir(), args.retry_failed)
+    finally:
+        client.close()
+    print(
+        f"Generated derivatives for {result['generated']} uploads, {result['failed']} failed, "
+        f"{result['recorded']} already generated, {result['skipped_failed']} skipped after earlier failures"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate missing image derivatives for stored uploads")
+    parser.add_argument("--retry-failed", action="store_true", help="also retry uploads whose derivatives failed before")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,159 @@
+"""MongoDB index declarations and startup reconciliation.
+
+Every query pattern used by server.py should be backed by one of the indexes
+declared in INDEXES. `ensure_indexes` is idempotent: it creates what is missing,
+leaves matching indexes alone and only logs about conflicting, undeclared or
+unused ones so nothing is ever dropped automatically.
+"""
+import logging
+from typing import Dict, List, Optional
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+
+# Processed webhook events are kept well past the provider's retry window
+# (Stripe retries for up to three days) so redeliveries still dedupe
+WEBHOOK_EVENT_RETENTION_SECONDS = 30 * 24 * 3600
+
+
+def _index(*keys, unique: bool = False, expire_after: Optional[int] = None) -> IndexModel:
+    if expire_after is not None:
+        return IndexModel(list(keys), unique=unique, expireAfterSeconds=expire_after)
+    return IndexModel(list(keys), unique=unique)
+
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "users": [
+        _index(("id", ASCENDING), unique=True),
+        _index(("email", ASCENDING), unique=True),
+        _index(("created_at", DESCENDING), ("id", DESCENDING)),
+    ],
+    "categories": [
+        _index(("id", ASCENDING), unique=True),
+        _index(("slug", ASCENDING), unique=True),
+    ],
+    "products": [
+        _index(("id", ASCENDING), unique=True),
+        _index(("slug", ASCENDING), unique=True),
+        # GET /api/products: optional category filter + one of the sort modes,
+        # with id as the keyset pagination tiebreaker
+        _index(("created_at", DESCENDING), ("id", DESCENDING)),
+        _index(("price", ASCENDING), ("id", ASCENDING)),
+        _index(("name", ASCENDING), ("id", ASCENDING)),
+        _index(("category_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)),
+        _index(("category_id", ASCENDING), ("price", ASCENDING), ("id", ASCENDING)),
+        _index(("category_id", ASCENDING), ("name", ASCENDING), ("id", ASCENDING)),
+    ],
+    "orders": [
+        _index(("id", ASCENDING), unique=True),
+        _index(("created_at", DESCENDING), ("id", DESCENDING)),
+        _index(("status", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)),
+        _index(("email", ASCENDING), ("created_at", DESCENDING)),
+        _index(("user_id", ASCENDING), ("created_at", DESCENDING)),
+        # can-review lookup: orders of a user containing a product
+        _index(("user_id", ASCENDING), ("items.product_id", ASCENDING)),
+    ],
+    "reviews": [
+        _index(("id", ASCENDING), unique=True),
+        _index(("created_at", DESCENDING), ("id", DESCENDING)),
+        _index(("product_id", ASCENDING), ("created_at", DESCENDING)),
+        _index(("user_id", ASCENDING), ("product_id", ASCENDING)),
+    ],
+    "hero_slides": [
+        _index(("id", ASCENDING), unique=True),
+        _index(("order", ASCENDING)),
+    ],
+    "promos": [
+        _index(("id", ASCENDING), unique=True),
+        _index(("code", ASCENDING)),
+        _index(("is_active", ASCENDING)),
+        _index(("created_at", DESCENDING)),
+    ],
+    "settings": [
+        _index(("key", ASCENDING), unique=True),
+    ],
+    "payment_transactions": [
+        _index(("session_id", ASCENDING), unique=True),
+        _index(("order_id", ASCENDING)),
+    ],
+    "uploads": [
+        _index(("id", ASCENDING), unique=True),
+    ],
+    "webhook_events": [
+        _index(("id", ASCENDING), unique=True),
+        _index(("status", ASCENDING), ("available_at", ASCENDING)),
+        _index(("claim", ASCENDING)),
+        # TTL: only done events have processed_at; failed ones stay for inspection
+        _index(("processed_at", ASCENDING), expire_after=WEBHOOK_EVENT_RETENTION_SECONDS),
+    ],
+}
+
+
+def _same_spec(model: IndexModel, info: dict) -> bool:
+    declared = model.document
+    return (
+        list(declared["key"].items()) == list(info["key"])
+        and bool(declared.get("unique", False)) == bool(info.get("unique", False))
+        and declared.get("expireAfterSeconds") == info.get("expireAfterSeconds")
+    )
+
+
+async def _log_unused_indexes(collection, names: List[str]):
+    """Log declared indexes that have served no operation since mongod started"""
+    try:
+        stats = await collection.aggregate([{"$indexStats": {}}]).to_list(None)
+    except Exception as e:
+        # Diagnostics only - e.g. shared Atlas tiers reject $indexStats
+        logger.debug(f"$indexStats unavailable for {collection.name}: {e}")
+        return
+    for stat in stats:
+        if stat["name"] in names and stat.get("accesses", {}).get("ops", 0) == 0:
+            since = stat.get("accesses", {}).get("since")
+            logger.info(f"Index {collection.name}.{stat['name']} unused since {since}")
+
+
+async def ensure_indexes(db) -> Dict[str, dict]:
+    """Create missing indexes and report conflicting, undeclared and unused ones"""
+    report = {}
+    for collection_name, models in INDEXES.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        declared_names = [m.document["name"] for m in models]
+
+        created, conflicts, failed = [], [], []
+        for model in models:
+            name = model.document["name"]
+            if name in existing:
+                if not _same_spec(model, existing[name]):
+                    conflicts.append(name)
+                    logger.warning(
+                        f"Index {collection_name}.{name} exists with a different spec "
+                        f"{existing[name]} - drop it manually to apply the declared one"
+                    )
+                continue
+
+            logger.info(f"Creating missing index {collection_name}.{name}")
+            try:
+                # One at a time so a unique violation doesn't block the rest
+                await collection.create_indexes([model])
+                created.append(name)
+            except OperationFailure as e:
+                failed.append(name)
+                logger.error(f"Failed to create index {collection_name}.{name}: {e}")
+
+        undeclared = [n for n in existing if n != "_id_" and n not in declared_names]
+        for name in undeclared:
+            logger.warning(f"Undeclared index {collection_name}.{name} (not in indexes.INDEXES)")
+
+        await _log_unused_indexes(collection, declared_names)
+
+        report[collection_name] = {
+            "created": created,
+            "conflicts": conflicts,
+            "failed": failed,
+            "undeclared": undeclared,
+        }
+    return report
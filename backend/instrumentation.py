@@ -0,0 +1,286 @@
+"""Per-route latency and MongoDB command metrics, exposed in Prometheus text format.
+
+`RequestMetricsMiddleware` times every HTTP request and labels it with the
+matched route template (`/api/products/{slug}`, not the raw path). While a
+request runs, its `RequestStats` sits in a context variable; Motor copies
+the context into the thread that runs each driver call, so `CommandMetrics`
+(a pymongo CommandListener) can charge every Mongo command and its duration
+to the request that issued it. Per route that gives histograms of latency,
+Mongo commands per request and time spent in them, which makes N+1 query
+patterns stand out. Requests over `commands_warn` commands are logged.
+
+Commands slower than `slow_ms` are logged with the shape of their filter
+(values replaced by "?"), never the values themselves.
+
+`render()` returns everything in the Prometheus exposition format for the
+metrics endpoint. Counters are per worker process, like runtime-stats.
+
+With `server_timing` on (for debugging), responses also carry the request's
+Mongo and total time in a Server-Timing header. It is off by default, since
+it tells any client how long the database took.
+"""
+import contextvars
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import monitoring
+from starlette.datastructures import MutableHeaders
+from starlette.routing import BaseRoute, Match, Mount
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COMMAND_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Driver handshakes and session cleanup aren't work a handler asked for
+IGNORED_COMMANDS = {"hello", "ismaster", "isMaster", "endSessions", "saslStart", "saslContinue", "ping"}
+FILTER_KEYS = ("filter", "query", "pipeline", "sort")
+
+
+class RequestStats:
+    __slots__ = ("path", "commands", "db_seconds")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.commands = 0
+        self.db_seconds = 0.0
+
+
+current_request: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("current_request", default=None)
+
+
+def query_shape(value):
+    """`value` with every literal replaced by "?", keeping field names and operators"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)) and value and all(isinstance(item, dict) for item in value):
+        return [query_shape(item) for item in value]
+    return "?"
+
+
+def command_shape(command: dict) -> dict:
+    shape = {key: query_shape(command[key]) for key in FILTER_KEYS if key in command}
+    for key in ("updates", "deletes"):
+        if command.get(key):
+            shape["q"] = query_shape(command[key][0].get("q", {}))
+    return shape
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(**labels) -> str:
+    escaped = (
+        f'{key}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for key, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+def _render_histogram(lines: List[str], name: str, labels: dict, histogram: Histogram):
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+    lines.append(f'{name}_bucket{_labels(**labels, le="+Inf")} {histogram.count}')
+    lines.append(f"{name}_sum{_labels(**labels)} {histogram.sum}")
+    lines.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Mongo command counters and durations, per command and per request"""
+
+    def __init__(self, slow_ms: float = 100.0):
+        self.slow_seconds = slow_ms / 1000
+        self._lock = threading.Lock()
+        # (command name, collection) -> [count, failures, seconds]
+        self.commands: Dict[Tuple[str, str], List[float]] = defaultdict(lambda: [0, 0, 0.0])
+        self.slow = 0
+        self._started: Dict[tuple, tuple] = {}
+
+    def started(self, event):
+        if event.command_name in IGNORED_COMMANDS:
+            return
+        collection = event.command.get(event.command_name)
+        if not isinstance(collection, str):
+            collection = event.command.get("collection", "")
+        with self._lock:
+            self._started[(event.request_id, event.connection_id)] = (collection, event.command)
+
+    def _finished(self, event, failed: bool):
+        with self._lock:
+            started = self._started.pop((event.request_id, event.connection_id), None)
+            if started is None:
+                return
+            collection, command = started
+            seconds = event.duration_micros / 1_000_000
+            totals = self.commands[(event.command_name, collection)]
+            totals[0] += 1
+            totals[1] += failed
+            totals[2] += seconds
+            stats = current_request.get()
+            if stats is not None:
+                stats.commands += 1
+                stats.db_seconds += seconds
+            slow = seconds >= self.slow_seconds
+            if slow:
+                self.slow += 1
+        if slow:
+            logger.warning(
+                f"Slow Mongo {event.command_name} on {collection}: {seconds * 1000:.1f} ms, "
+                f"shape {command_shape(command)}, request {stats.path if stats else '-'}"
+            )
+
+    def succeeded(self, event):
+        self._finished(event, failed=False)
+
+    def failed(self, event):
+        self._finished(event, failed=True)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.latency: Dict[Tuple[str, str], Histogram] = {}
+        self.db_commands: Dict[Tuple[str, str], Histogram] = {}
+        self.db_seconds: Dict[Tuple[str, str], Histogram] = {}
+        self.responses: Dict[Tuple[str, str, int], int] = defaultdict(int)
+
+    def observe(self, method: str, route: str, status: int, seconds: float, stats: RequestStats):
+        key = (method, route)
+        if key not in self.latency:
+            self.latency[key] = Histogram(LATENCY_BUCKETS)
+            self.db_commands[key] = Histogram(COMMAND_COUNT_BUCKETS)
+            self.db_seconds[key] = Histogram(LATENCY_BUCKETS)
+        self.latency[key].observe(seconds)
+        self.db_commands[key].observe(stats.commands)
+        self.db_seconds[key].observe(stats.db_seconds)
+        self.responses[(method, route, status)] += 1
+
+
+def route_label(scope: Scope, routes: List[BaseRoute], root_path: str) -> str:
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    # Answered before routing (a 304 from the ETag middleware) or by a
+    # mounted app, which rewrote root_path: match again the way the router did
+    probe = {**scope, "root_path": root_path}
+    for route in routes:
+        if route.matches(probe)[0] == Match.FULL:
+            return f"{route.path}/{{path}}" if isinstance(route, Mount) else route.path
+    return "<unmatched>"
+
+
+class RequestMetricsMiddleware:
+    """Times requests, counts their Mongo commands and optionally adds a Server-Timing header"""
+
+    def __init__(
+        self, app: ASGIApp, metrics: RequestMetrics, routes: List[BaseRoute], commands_warn: int = 25, server_timing: bool = False
+    ):
+        self.app = app
+        self.metrics = metrics
+        self.routes = routes
+        self.commands_warn = commands_warn
+        self.server_timing = server_timing
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope["path"])
+        root_path = scope.get("root_path", "")
+        token = current_request.set(stats)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_timed(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    MutableHeaders(scope=message).append(
+                        "server-timing",
+                        f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.commands} commands", '
+                        f"app;dur={(time.perf_counter() - started) * 1000:.1f}"
+                    )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            current_request.reset(token)
+            route = route_label(scope, self.routes, root_path)
+            self.metrics.observe(scope["method"], route, status, time.perf_counter() - started, stats)
+            if stats.commands >= self.commands_warn:
+                logger.warning(f"{scope['method']} {route} issued {stats.commands} Mongo commands ({stats.path})")
+
+
+def render(requests: RequestMetrics, commands: CommandMetrics, pool: Optional[dict] = None) -> str:
+    lines = [
+        "# HELP http_request_duration_seconds Request latency by route",
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    for (method, route), histogram in sorted(requests.latency.items()):
+        _render_histogram(lines, "http_request_duration_seconds", {"method": method, "route": route}, histogram)
+
+    lines += ["# HELP http_responses_total Responses by route and status", "# TYPE http_responses_total counter"]
+    for (method, route, status), count in sorted(requests.responses.items()):
+        lines.append(f"http_responses_total{_labels(method=method, route=route, status=status)} {count}")
+
+    lines += [
+        "# HELP http_request_mongo_commands Mongo commands issued per request",
+        "# TYPE http_request_mongo_commands histogram",
+    ]
+    for (method, route), histogram in sorted(requests.db_commands.items()):
+        _render_histogram(lines, "http_request_mongo_commands", {"method": method, "route": route}, histogram)
+
+    lines += [
+        "# HELP http_request_mongo_seconds Time per request spent in Mongo commands",
+        "# TYPE http_request_mongo_seconds histogram",
+    ]
+    for (method, route), histogram in sorted(requests.db_seconds.items()):
+        _render_histogram(lines, "http_request_mongo_seconds", {"method": method, "route": route}, histogram)
+
+    with commands._lock:
+        totals = sorted((key, list(value)) for key, value in commands.commands.items())
+        slow = commands.slow
+    lines += ["# HELP mongo_commands_total Mongo commands by name and collection", "# TYPE mongo_commands_total counter"]
+    lines += [f"mongo_commands_total{_labels(command=c, collection=coll)} {int(t[0])}" for (c, coll), t in totals]
+    lines += ["# HELP mongo_command_failures_total Failed Mongo commands", "# TYPE mongo_command_failures_total counter"]
+    lines += [f"mongo_command_failures_total{_labels(command=c, collection=coll)} {int(t[1])}" for (c, coll), t in totals]
+    lines += ["# HELP mongo_command_seconds_total Time spent in Mongo commands", "# TYPE mongo_command_seconds_total counter"]
+    lines += [f"mongo_command_seconds_total{_labels(command=c, collection=coll)} {t[2]}" for (c, coll), t in totals]
+    lines += ["# HELP mongo_slow_commands_total Commands over the slow query threshold", "# TYPE mongo_slow_commands_total counter"]
+    lines.append(f"mongo_slow_commands_total {slow}")
+
+    if pool is not None:
+        lines += [
+            "# HELP mongo_pool_checkouts_total Connections checked out of the pool",
+            "# TYPE mongo_pool_checkouts_total counter",
+            f"mongo_pool_checkouts_total {pool['checkouts']}",
+            "# HELP mongo_pool_wait_seconds_max Longest wait for a pooled connection",
+            "# TYPE mongo_pool_wait_seconds_max gauge",
+            f"mongo_pool_wait_seconds_max {pool['wait_max_ms'] / 1000}",
+            "# HELP mongo_pool_connections Pooled connections by state",
+            "# TYPE mongo_pool_connections gauge",
+            f'mongo_pool_connections{{state="in_use"}} {pool["in_use"]}',
+            f'mongo_pool_connections{{state="open"}} {pool["open"]}',
+        ]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,104 @@
+"""Opaque keyset (cursor) pagination helpers.
+
+A cursor encodes the sort key and `id` of the last document of a page, so the
+next page is fetched with a range filter on an index instead of `skip`, and
+stays stable when documents are inserted between requests.
+"""
+import base64
+import json
+from datetime import datetime
+from typing import Any, Optional, Tuple
+
+from fastapi import HTTPException
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    return value
+
+
+def _decode_value(value: Any) -> Any:
+    if isinstance(value, dict) and "$dt" in value:
+        return datetime.fromisoformat(value["$dt"])
+    return value
+
+
+def encode_cursor(doc: dict, sort_field: str, sort_order: int) -> str:
+    payload = {
+        "f": sort_field,
+        "o": sort_order,
+        "v": _encode_value(doc.get(sort_field)),
+        "id": doc["id"],
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort_field: str, sort_order: int) -> Tuple[Any, str]:
+    """Return (last sort value, last id); 400 if the cursor is garbage or from another sort"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        value, last_id = _decode_value(payload["v"]), payload["id"]
+        matches = payload["f"] == sort_field and payload["o"] == sort_order
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not matches:
+        raise HTTPException(status_code=400, detail="Cursor does not match the requested sort")
+    return value, last_id
+
+
+def keyset_filter(sort_field: str, sort_order: int, last_value: Any, last_id: str) -> dict:
+    """Filter for documents strictly after (last_value, last_id) in (sort_field, id) order.
+
+    Documents with a null or missing sort key sort before every value, so they
+    come first ascending and last descending; range operators never match
+    them, so they get branches of their own.
+    """
+    op = "$gt" if sort_order == 1 else "$lt"
+    if last_value is None:
+        branches = [{sort_field: None, "id": {op: last_id}}]
+        if sort_order == 1:
+            branches.append({sort_field: {"$ne": None}})
+        return {"$or": branches}
+    branches = [
+        {sort_field: {op: last_value}},
+        {sort_field: last_value, "id": {op: last_id}},
+    ]
+    if sort_order == -1:
+        branches.append({sort_field: None})
+    return {"$or": branches}
+
+
+def keyset_sort(sort_field: str, sort_order: int) -> list:
+    return [(sort_field, sort_order), ("id", sort_order)]
+
+
+def next_cursor(page: list, limit: int, sort_field: str, sort_order: int) -> Optional[str]:
+    """Cursor for the page after `page`, which was fetched with limit + 1 to detect the end.
+
+    Trims the look-ahead document from `page` in place.
+    """
+    if len(page) <= limit:
+        return None
+    del page[limit:]
+    return encode_cursor(page[-1], sort_field, sort_order)
+
+
+async def fetch_page(
+    collection,
+    query: dict,
+    projection: dict,
+    limit: int,
+    cursor: Optional[str] = None,
+    sort_field: str = "created_at",
+    sort_order: int = -1,
+) -> Tuple[list, Optional[str]]:
+    """One keyset page of `collection` plus the cursor of the page after it"""
+    page_query = query
+    if cursor:
+        last_value, last_id = decode_cursor(cursor, sort_field, sort_order)
+        page_query = {"$and": [query, keyset_filter(sort_field, sort_order, last_value, last_id)]}
+    docs = await collection.find(page_query, projection).sort(keyset_sort(sort_field, sort_order)).limit(limit + 1).to_list(limit + 1)
+    return docs, next_cursor(docs, limit, sort_field, sort_order)
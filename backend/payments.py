@@ -0,0 +1,210 @@
+"""Long-lived payment gateway service.
+
+One gateway is created at startup and shared by every checkout request
+instead of building a `StripeCheckout` (and re-reading the environment) per
+call. Calls go through a bounded semaphore and a per-call timeout, and the
+Stripe SDK is pointed at a single pooled keep-alive HTTP client.
+
+`FakePaymentGateway` implements the same interface entirely in memory so
+tests and benchmarks can exercise checkout offline. It accepts unsigned
+webhooks and reports every session paid, so `create_payment_gateway` never
+returns it: install it by overriding the `current_payment_gateway`
+dependency in server.py, as `benchmarks/load.py` does.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Dict, Optional
+
+from emergentintegrations.payments.stripe.checkout import (
+    StripeCheckout,
+    CheckoutSessionRequest,
+    CheckoutSessionResponse,
+    CheckoutStatusResponse,
+    CheckoutWebhookResponse
+)
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentGatewayError(Exception):
+    pass
+
+
+class PaymentGateway(ABC):
+    """Concurrency cap, timeout and call metrics shared by every implementation"""
+
+    def __init__(self, max_concurrency: int = 20, timeout: float = 15.0):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.total_seconds = 0.0
+
+    async def _call(self, name: str, coro_factory):
+        self.waiting += 1
+        async with self._semaphore:
+            self.waiting -= 1
+            self.in_flight += 1
+            started = time.perf_counter()
+            try:
+                return await asyncio.wait_for(coro_factory(), self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise PaymentGatewayError(f"Payment provider timed out after {self.timeout}s ({name})")
+            except Exception:
+                self.errors += 1
+                raise
+            finally:
+                self.calls += 1
+                self.total_seconds += time.perf_counter() - started
+                self.in_flight -= 1
+
+    @abstractmethod
+    async def create_checkout_session(self, request: CheckoutSessionRequest, webhook_url: str) -> CheckoutSessionResponse:
+        ...
+
+    @abstractmethod
+    async def get_checkout_status(self, session_id: str, webhook_url: str) -> CheckoutStatusResponse:
+        ...
+
+    @abstractmethod
+    async def handle_webhook(self, body: bytes, signature: Optional[str], webhook_url: str) -> CheckoutWebhookResponse:
+        ...
+
+    async def close(self):
+        pass
+
+    def stats(self) -> dict:
+        return {
+            "gateway": type(self).__name__,
+            "max_concurrency": self.max_concurrency,
+            "timeout": self.timeout,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "avg_ms": round(self.total_seconds / self.calls * 1000, 1) if self.calls else 0.0,
+        }
+
+
+class StripePaymentGateway(PaymentGateway):
+    def __init__(self, api_key: str, **kwargs):
+        super().__init__(**kwargs)
+        self.api_key = api_key
+        # StripeCheckout is bound to a webhook URL; normally there is just one
+        self._clients: Dict[str, StripeCheckout] = {}
+        self._http_client = self._install_pooled_http_client()
+
+    def _install_pooled_http_client(self):
+        """Route Stripe SDK traffic through one keep-alive connection pool"""
+        try:
+            import stripe
+            # allow_sync_methods: the SDK may be driven synchronously from a thread
+            http_client = stripe.HTTPXClient(timeout=self.timeout, allow_sync_methods=True)
+        except Exception as e:
+            logger.warning(f"Pooled Stripe HTTP client unavailable, using SDK default: {e}")
+            return None
+        stripe.default_http_client = http_client
+        return http_client
+
+    def _client(self, webhook_url: str) -> StripeCheckout:
+        client = self._clients.get(webhook_url)
+        if client is None:
+            client = StripeCheckout(api_key=self.api_key, webhook_url=webhook_url)
+            self._clients[webhook_url] = client
+        return client
+
+    async def create_checkout_session(self, request, webhook_url):
+        return await self._call("create_checkout_session", lambda: self._client(webhook_url).create_checkout_session(request))
+
+    async def get_checkout_status(self, session_id, webhook_url):
+        return await self._call("get_checkout_status", lambda: self._client(webhook_url).get_checkout_status(session_id))
+
+    async def handle_webhook(self, body, signature, webhook_url):
+        return await self._call("handle_webhook", lambda: self._client(webhook_url).handle_webhook(body, signature))
+
+    async def close(self):
+        if self._http_client is not None:
+            try:
+                self._http_client.close()
+                await self._http_client.close_async()
+            except Exception as e:
+                logger.debug(f"Closing Stripe HTTP client failed: {e}")
+
+
+class FakePaymentGateway(PaymentGateway):
+    """In-memory stand-in: sessions are created instantly and report `paid`.
+
+    Webhook bodies are plain JSON with event_type, event_id, session_id and
+    payment_status; signatures are not checked. `latency` simulates provider
+    round-trip time for benchmarks.
+    """
+
+    def __init__(self, latency: float = 0.0, payment_status: str = "paid", **kwargs):
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.payment_status = payment_status
+        self.sessions: Dict[str, CheckoutSessionRequest] = {}
+
+    async def _sleep(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def create_checkout_session(self, request, webhook_url):
+        async def create():
+            await self._sleep()
+            session_id = f"cs_fake_{uuid.uuid4().hex}"
+            self.sessions[session_id] = request
+            url = request.success_url.replace("{CHECKOUT_SESSION_ID}", session_id)
+            return CheckoutSessionResponse(url=url, session_id=session_id)
+        return await self._call("create_checkout_session", create)
+
+    async def get_checkout_status(self, session_id, webhook_url):
+        async def status():
+            await self._sleep()
+            request = self.sessions.get(session_id)
+            if request is None:
+                raise PaymentGatewayError(f"No such checkout session: {session_id}")
+            return CheckoutStatusResponse(
+                status="complete",
+                payment_status=self.payment_status,
+                amount_total=int(round(request.amount * 100)),
+                currency=request.currency,
+                metadata=request.metadata or {}
+            )
+        return await self._call("get_checkout_status", status)
+
+    async def handle_webhook(self, body, signature, webhook_url):
+        async def parse():
+            event = json.loads(body)
+            return CheckoutWebhookResponse(
+                event_type=event.get("event_type", "checkout.session.completed"),
+                event_id=event.get("event_id") or f"evt_fake_{uuid.uuid4().hex}",
+                session_id=event["session_id"],
+                payment_status=event.get("payment_status", self.payment_status),
+                metadata=event.get("metadata", {})
+            )
+        return await self._call("handle_webhook", parse)
+
+
+def create_payment_gateway() -> Optional[PaymentGateway]:
+    """Gateway configured from the environment, None when Stripe isn't configured"""
+    options = {
+        "max_concurrency": int(os.environ.get("PAYMENT_MAX_CONCURRENCY", "20")),
+        "timeout": float(os.environ.get("PAYMENT_TIMEOUT", "15")),
+    }
+    api_key = os.environ.get("STRIPE_API_KEY")
+    if not api_key:
+        logger.warning("STRIPE_API_KEY is not set, checkout endpoints are disabled")
+        return None
+    return StripePaymentGateway(api_key, **options)
@@ -0,0 +1,26 @@
+"""Write helpers that hand back the stored document without a read-back query."""
+from typing import Optional
+
+from pymongo import ReturnDocument
+
+
+async def insert_document(collection, doc: dict) -> dict:
+    """Insert `doc` and return it as `find_one(..., {"_id": 0})` would.
+
+    The driver adds `_id` to the dict it is given, so a copy is inserted and
+    the caller's dict stays free of the (non JSON-serializable) ObjectId.
+    """
+    await collection.insert_one(dict(doc))
+    return doc
+
+
+async def update_document(collection, query: dict, update_data: dict) -> Optional[dict]:
+    """`$set` update_data and return the updated document, None if nothing matched"""
+    if not update_data:
+        return await collection.find_one(query, {"_id": 0})
+    return await collection.find_one_and_update(
+        query,
+        {"$set": update_data},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
@@ -0,0 +1,26 @@
+"""orjson-backed JSON responses.
+
+`FastJSONResponse` is the app's default response class. orjson serializes the
+naive datetimes Motor returns natively, in the same ISO format FastAPI's
+encoder produced, and anything else it doesn't know (ObjectId) falls back to
+`str`. Handlers that return large lists of Mongo documents return a
+`FastJSONResponse` directly, which also skips FastAPI's `jsonable_encoder`
+walk over every nested value.
+"""
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+
+
+def _default(value: Any) -> str:
+    return str(value)
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,359 @@
+"""In-process full-text index over the product catalog.
+
+Products are tokenized (case-folded, accents stripped) from their name,
+description and category name into an inverted index. Every token is also
+registered under its prefixes so the SearchModal type-ahead can match
+partially typed words. Queries AND their terms together and rank by a
+field-weighted idf score, exact token matches beating prefix matches.
+
+Short prefixes ("j", "ja", "jac") match a large part of the vocabulary, so
+their postings are kept merged per prefix as products are indexed, scored
+with the idf of the prefix as a whole. Only the requested number of results
+is ranked, with a heap instead of a full sort, but every match is counted.
+
+The index is built from Mongo at startup and rebuilt periodically as a
+safety net. In between it is kept current by the admin product/category
+handlers, and writes made by other uvicorn workers are applied document by
+document with `apply_product_changes` / `apply_category_changes`.
+"""
+import asyncio
+import heapq
+import logging
+import math
+import re
+import time
+import unicodedata
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+FIELD_WEIGHTS = {"name": 3.0, "category": 2.0, "description": 1.0}
+PREFIX_MATCH_BOOST = 0.6
+MIN_PREFIX_LENGTH = 2
+# Prefixes shorter than this get merged postings
+SHORT_PREFIX_LENGTH = 4
+
+_TOKEN_RE = re.compile(r"\w+")
+_PROJECTION = {"_id": 0, "id": 1, "name": 1, "description": 1, "category_id": 1, "price": 1, "in_stock": 1}
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    folded = unicodedata.normalize("NFKD", text.casefold())
+    folded = "".join(c for c in folded if not unicodedata.combining(c))
+    return _TOKEN_RE.findall(folded)
+
+
+class ProductSearchIndex:
+    def __init__(self, refresh_interval: float = 300.0):
+        self.refresh_interval = refresh_interval
+        self.built_at: Optional[float] = None
+        self._postings: Dict[str, Dict[str, float]] = defaultdict(dict)
+        self._prefixes: Dict[str, Set[str]] = defaultdict(set)
+        self._prefix_postings: Dict[str, Dict[str, float]] = defaultdict(dict)
+        self._doc_terms: Dict[str, Dict[str, float]] = {}
+        self._docs: Dict[str, dict] = {}
+        # Ranking tie-break, kept flat so it doesn't go through every doc
+        self._names: Dict[str, str] = {}
+        self._category_names: Dict[str, str] = {}
+        self._rebuild_task: Optional[asyncio.Task] = None
+        self._rebuild_again = False
+        self._pending: Optional[list] = None
+        # Type-ahead repeats the same prefixes a lot; any index change clears it
+        self._results = TTLCache("search_results", maxsize=512, ttl=refresh_interval)
+
+    @property
+    def ready(self) -> bool:
+        """Whether the first build has finished; until then searches should go to Mongo"""
+        return self.built_at is not None
+
+    def __len__(self):
+        return len(self._docs)
+
+    # ---- maintenance ----
+
+    def _terms(self, product: dict) -> Dict[str, float]:
+        terms: Dict[str, float] = {}
+        fields = {
+            "name": product.get("name"),
+            "category": self._category_names.get(product.get("category_id"), ""),
+            "description": product.get("description"),
+        }
+        for field, text in fields.items():
+            weight = FIELD_WEIGHTS[field]
+            for token in tokenize(text):
+                # A token counts once per field, at its best field weight
+                terms[token] = max(terms.get(token, 0.0), weight)
+        return terms
+
+    def add(self, product: dict):
+        """Index or re-index a product document"""
+        if self._pending is not None:
+            self._pending.append(("add", product))
+        product_id = product["id"]
+        self._remove(product_id)
+        doc = {k: product.get(k) for k in _PROJECTION if k != "_id"}
+        terms = self._terms(doc)
+        self._docs[product_id] = doc
+        self._names[product_id] = doc.get("name") or ""
+        self._doc_terms[product_id] = terms
+        for token, weight in terms.items():
+            if not self._postings[token]:
+                for i in range(MIN_PREFIX_LENGTH, len(token) + 1):
+                    self._prefixes[token[:i]].add(token)
+            self._postings[token][product_id] = weight
+        for prefix, weight in _short_prefix_weights(terms).items():
+            self._prefix_postings[prefix][product_id] = weight
+
+    def remove(self, product_id: str):
+        if self._pending is not None:
+            self._pending.append(("remove", product_id))
+        self._remove(product_id)
+
+    def _invalidate_results(self):
+        if len(self._results):
+            self._results.clear()
+
+    def _remove(self, product_id: str):
+        self._invalidate_results()
+        terms = self._doc_terms.pop(product_id, None)
+        self._docs.pop(product_id, None)
+        self._names.pop(product_id, None)
+        if not terms:
+            return
+        for prefix in _short_prefix_weights(terms):
+            postings = self._prefix_postings.get(prefix)
+            if postings is not None:
+                postings.pop(product_id, None)
+                if not postings:
+                    del self._prefix_postings[prefix]
+        for token in terms:
+            postings = self._postings.get(token)
+            if postings is None:
+                continue
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[token]
+                for i in range(MIN_PREFIX_LENGTH, len(token) + 1):
+                    tokens = self._prefixes.get(token[:i])
+                    if tokens is not None:
+                        tokens.discard(token)
+                        if not tokens:
+                            del self._prefixes[token[:i]]
+
+    async def apply_product_changes(self, db, product_ids: List[str]):
+        """Re-read products another worker wrote; ids no longer found were deleted"""
+        found = set()
+        async for product in db.products.find({"id": {"$in": product_ids}}, _PROJECTION):
+            found.add(product["id"])
+            self.add(product)
+        for product_id in product_ids:
+            if product_id not in found:
+                self.remove(product_id)
+
+    async def apply_category_changes(self, db, category_ids: List[str]):
+        """Pick up category names another worker changed"""
+        async for category in db.categories.find({"id": {"$in": category_ids}}, {"_id": 0, "id": 1, "name": 1}):
+            if self._category_names.get(category["id"]) != category.get("name", ""):
+                self.set_category_name(category["id"], category.get("name"))
+
+    def set_category_name(self, category_id: str, name: Optional[str]):
+        """Re-index the products of a category after it was renamed"""
+        if self._pending is not None:
+            self._pending.append(("category", (category_id, name)))
+        self._category_names[category_id] = name or ""
+        for doc in [d for d in self._docs.values() if d.get("category_id") == category_id]:
+            self.add(doc)
+
+    async def rebuild(self, db):
+        """Build a fresh index from Mongo and swap it in, replaying writes made meanwhile"""
+        started = time.perf_counter()
+        self._pending = []
+        try:
+            fresh = ProductSearchIndex(self.refresh_interval)
+            async for category in db.categories.find({}, {"_id": 0, "id": 1, "name": 1}):
+                fresh._category_names[category["id"]] = category.get("name", "")
+            async for product in db.products.find({}, _PROJECTION).batch_size(1000):
+                fresh.add(product)
+
+            for op, arg in self._pending:
+                if op == "add":
+                    fresh.add(arg)
+                elif op == "remove":
+                    fresh.remove(arg)
+                else:
+                    fresh.set_category_name(*arg)
+        finally:
+            self._pending = None
+
+        self._postings = fresh._postings
+        self._prefixes = fresh._prefixes
+        self._prefix_postings = fresh._prefix_postings
+        self._doc_terms = fresh._doc_terms
+        self._docs = fresh._docs
+        self._names = fresh._names
+        self._category_names = fresh._category_names
+        self._invalidate_results()
+        self.built_at = time.monotonic()
+        logger.info(
+            f"Product search index built: {len(self._docs)} products, "
+            f"{len(self._postings)} terms in {(time.perf_counter() - started) * 1000:.0f}ms"
+        )
+
+    async def _rebuild_until_current(self, db):
+        while True:
+            self._rebuild_again = False
+            try:
+                await self.rebuild(db)
+            except Exception:
+                # The next maybe_refresh tries again
+                logger.exception("Product search index rebuild failed")
+                return
+            if not self._rebuild_again:
+                return
+
+    def maybe_refresh(self, db, force: bool = False) -> Optional[asyncio.Task]:
+        """Schedule a background rebuild once the index is older than refresh_interval.
+
+        `force` rebuilds regardless of age; if a rebuild is already running,
+        another one is queued after it, since the running one may have read
+        the collection before the write that prompted this call. Returns the
+        rebuild task (None when nothing was scheduled), which finishes once
+        the index has caught up.
+        """
+        if self._rebuild_task is not None and not self._rebuild_task.done():
+            if force:
+                self._rebuild_again = True
+            return self._rebuild_task
+        if not force and self.built_at is not None and time.monotonic() - self.built_at < self.refresh_interval:
+            return None
+        self._rebuild_task = asyncio.create_task(self._rebuild_until_current(db))
+        return self._rebuild_task
+
+    async def stop(self):
+        if self._rebuild_task is not None:
+            self._rebuild_task.cancel()
+            await asyncio.gather(self._rebuild_task, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "ready": self.ready,
+            "products": len(self._docs),
+            "terms": len(self._postings),
+            "prefixes": len(self._prefixes),
+            "short_prefixes": len(self._prefix_postings),
+            "age_seconds": round(time.monotonic() - self.built_at, 1) if self.built_at else None,
+            "results_cache": self._results.stats(),
+        }
+
+    # ---- querying ----
+
+    def _match_term(self, term: str) -> Dict[str, float]:
+        total_docs = max(len(self._docs), 1)
+        if MIN_PREFIX_LENGTH <= len(term) < SHORT_PREFIX_LENGTH:
+            postings = self._prefix_postings.get(term)
+            if not postings:
+                return {}
+            idf = math.log(1 + total_docs / len(postings))
+            return {product_id: weight * idf for product_id, weight in postings.items()}
+
+        if len(term) >= MIN_PREFIX_LENGTH:
+            tokens = self._prefixes.get(term, ())
+        else:
+            tokens = (term,) if term in self._postings else ()
+
+        scores: Dict[str, float] = {}
+        for token in tokens:
+            postings = self._postings[token]
+            boost = 1.0 if token == term else PREFIX_MATCH_BOOST
+            idf = math.log(1 + total_docs / len(postings))
+            if not scores:
+                scores = {product_id: weight * boost * idf for product_id, weight in postings.items()}
+                continue
+            for product_id, weight in postings.items():
+                score = weight * boost * idf
+                if score > scores.get(product_id, 0.0):
+                    scores[product_id] = score
+        return scores
+
+    def search(
+        self,
+        query: str,
+        limit: Optional[int] = None,
+        category_id: Optional[str] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        in_stock: Optional[bool] = None,
+    ) -> List[str]:
+        """Product ids matching every query term, best match first"""
+        return self.search_with_total(query, limit, category_id, min_price, max_price, in_stock)[0]
+
+    def search_with_total(
+        self,
+        query: str,
+        limit: Optional[int] = None,
+        category_id: Optional[str] = None,
+        min_price: Optional[float] = None,
+        max_price: Optional[float] = None,
+        in_stock: Optional[bool] = None,
+    ) -> Tuple[List[str], int]:
+        """Like `search`, plus how many products matched in all, `limit` regardless"""
+        key = (query.casefold().strip(), limit, category_id, min_price, max_price, in_stock)
+        cached = self._results.get(key)
+        if cached is not None:
+            return cached
+        result = self._search(query, limit, category_id, min_price, max_price, in_stock)
+        self._results.set(key, result)
+        return result
+
+    def _search(self, query, limit, category_id, min_price, max_price, in_stock) -> Tuple[List[str], int]:
+        terms = sorted(set(tokenize(query)), key=len, reverse=True)
+        if not terms:
+            return [], 0
+
+        # Start from the most selective (longest) term and intersect
+        scores: Optional[Dict[str, float]] = None
+        for term in terms:
+            term_scores = self._match_term(term)
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {pid: s + term_scores[pid] for pid, s in scores.items() if pid in term_scores}
+            if not scores:
+                return [], 0
+
+        docs = self._docs
+        if category_id is not None or min_price is not None or max_price is not None or in_stock is not None:
+            def keep(doc):
+                price = doc.get("price") or 0
+                return (
+                    (category_id is None or doc.get("category_id") == category_id)
+                    and (min_price is None or price >= min_price)
+                    and (max_price is None or price <= max_price)
+                    and (in_stock is None or doc.get("in_stock") == in_stock)
+                )
+            scores = {pid: s for pid, s in scores.items() if keep(docs[pid])}
+
+        # (negated score, name, id) tuples compare faster than a key function
+        ranked = zip([-score for score in scores.values()], map(self._names.__getitem__, scores), scores)
+        if limit and limit < len(scores):
+            ranked = heapq.nsmallest(limit, ranked)
+        else:
+            ranked = sorted(ranked)
+        return [pid for _, _, pid in ranked], len(scores)
+
+
+def _short_prefix_weights(terms: Dict[str, float]) -> Dict[str, float]:
+    """Best weight per short prefix of a product's tokens, exact tokens unboosted"""
+    weights: Dict[str, float] = {}
+    for token, weight in terms.items():
+        for i in range(MIN_PREFIX_LENGTH, min(len(token), SHORT_PREFIX_LENGTH - 1) + 1):
+            prefix = token[:i]
+            boosted = weight if prefix == token else weight * PREFIX_MATCH_BOOST
+            if boosted > weights.get(prefix, 0.0):
+                weights[prefix] = boosted
+    return weights
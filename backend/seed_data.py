@@ -1,4 +1,3 @@
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
 from models import Category, Product
 import asyncio
@@ -261,27 +260,22 @@ initial_products = [
     }
 ]
 
-async def seed_database():
+async def seed_database(db):
     """Seed database with initial data if empty"""
-    client = AsyncIOMotorClient(mongo_url)
-    db = client[db_name]
-    
     # Check if categories exist
     cat_count = await db.categories.count_documents({})
     if cat_count == 0:
         print("Seeding categories...")
-        for cat in initial_categories:
-            cat["created_at"] = datetime.utcnow() if "created_at" not in cat else cat["created_at"]
-            await db.categories.insert_one(cat)
+        now = datetime.utcnow()
+        await db.categories.insert_many([{**cat, "created_at": now} for cat in initial_categories], ordered=False)
         print(f"Inserted {len(initial_categories)} categories")
     
     # Check if products exist
     prod_count = await db.products.count_documents({})
     if prod_count == 0:
         print("Seeding products...")
-        for prod in initial_products:
-            prod["created_at"] = datetime.utcnow() if "created_at" not in prod else prod["created_at"]
-            await db.products.insert_one(prod)
+        now = datetime.utcnow()
+        await db.products.insert_many([{**prod, "created_at": now} for prod in initial_products], ordered=False)
         print(f"Inserted {len(initial_products)} products")
     
     # Create default admin user if not exists
@@ -298,9 +292,14 @@ async def seed_database():
         }
         await db.users.insert_one(admin_user)
         print("Created default admin user: admin@ddebuut.com / admin123")
-    
-    client.close()
+
+async def main():
+    from database import create_client
+    client = create_client(mongo_url)
+    try:
+        await seed_database(client[db_name])
+    finally:
+        client.close()
 
 if __name__ == "__main__":
-    from datetime import datetime
-    asyncio.run(seed_database())
+    asyncio.run(main())
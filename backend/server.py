@@ -1,9 +1,10 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, UploadFile, File
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, Response, UploadFile, File
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import re
+import asyncio
+import secrets
 import logging
 import uuid
 import shutil
@@ -20,11 +21,27 @@ from models import (
     HeroSlideCreate, HeroSlideUpdate
 )
 from auth import (
-    get_password_hash, verify_password, create_access_token,
+    password_hasher, create_access_token,
     get_current_user, get_current_user_optional, decode_token
 )
+from cache import TTLCache
+from pagination import decode_cursor, encode_cursor, keyset_filter, keyset_sort, next_cursor, fetch_page
+from export import export_response
+from search import ProductSearchIndex
+from persistence import insert_document, update_document
+from stats import RebuildInProgress, StatsEngine
+from webhooks import WebhookQueue
+from uploads import save_upload, attach_image_widths, uploads_dir, UploadSizeLimit
+from images import ImageDerivativePipeline
+from static_files import ImmutableStaticFiles
+from http_cache import CollectionVersions, CatalogCacheMiddleware, build_version
+from responses import FastJSONResponse
+from bootstrap import ensure_schema
+from database import create_client, database_name, catalog_database, pool_metrics
+from instrumentation import CommandMetrics, RequestMetrics, RequestMetricsMiddleware, render as render_metrics
+from pymongo import ReturnDocument
+from payments import PaymentGateway, PaymentGatewayError, create_payment_gateway
 from emergentintegrations.payments.stripe.checkout import (
-    StripeCheckout, 
     CheckoutSessionResponse, 
     CheckoutStatusResponse, 
     CheckoutSessionRequest
@@ -34,28 +51,139 @@ from pydantic import BaseModel
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ.get('DB_NAME', 'ddebuut')]
+# Per-route latency and Mongo command metrics, served by /api/metrics to
+# scrapers holding METRICS_TOKEN (the endpoint is off without one); commands
+# slower than SLOW_QUERY_MS are logged with their filter shape.
+# SERVER_TIMING=1 (debugging only) adds per-request timings to every response.
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
+request_metrics = RequestMetrics()
+command_metrics = CommandMetrics(slow_ms=float(os.environ.get("SLOW_QUERY_MS", "100")))
+
+# MongoDB connection; public catalog reads go through catalog_reads()
+client = create_client(listeners=[command_metrics])
+db = client[database_name()]
+catalog_db = catalog_database(client)
+
+# Storefront data that only changes through admin_router; every admin write
+# handler touching these collections invalidates the matching keys, and
+# other workers drop them when catalog_versions notices the write
+catalog_cache = TTLCache(
+    "catalog",
+    maxsize=int(os.environ.get("CATALOG_CACHE_SIZE", "512")),
+    ttl=float(os.environ.get("CATALOG_CACHE_TTL", "60"))
+)
+
+# Product counts per normalized filter, cleared on any admin product write
+product_totals_cache = TTLCache(
+    "product_totals",
+    maxsize=1024,
+    ttl=float(os.environ.get("PRODUCT_TOTALS_TTL", "30"))
+)
+
+# Materialized order counters/revenue for the admin dashboard
+stats_engine = StatsEngine(db)
+
+# User principal records (no password) for authorization checks. Other
+# workers may serve a revoked admin flag for up to PRINCIPAL_CACHE_TTL seconds
+principal_cache = TTLCache(
+    "principals",
+    maxsize=int(os.environ.get("PRINCIPAL_CACHE_SIZE", "4096")),
+    ttl=float(os.environ.get("PRINCIPAL_CACHE_TTL", "30"))
+)
+
+# Full-text product search, built from Mongo in the background at startup
+# (searches fall back to a name match until it is ready), rebuilt every
+# SEARCH_INDEX_REFRESH seconds and updated in place by admin product writes.
+# Only the best SEARCH_MAX_RESULTS matches can be paged through; `total`
+# still counts all of them
+product_search = ProductSearchIndex(refresh_interval=float(os.environ.get("SEARCH_INDEX_REFRESH", "300")))
+SEARCH_MAX_RESULTS = 1000
+
+# Per-collection write counters behind the public catalog ETags and the
+# cross-worker invalidation of catalog_cache, shared by all workers through
+# Mongo and re-read every HTTP_CACHE_SYNC_INTERVAL seconds
+catalog_versions = CollectionVersions(
+    db,
+    ["products", "categories", "hero_slides", "settings", "promos"],
+    sync_interval=float(os.environ.get("HTTP_CACHE_SYNC_INTERVAL", "2"))
+)
+
+def drop_stale_catalog_caches(collection: str, ids: Optional[List[str]]):
+    """Another worker changed `collection`; forget what this one has cached.
+
+    Returns the search index update, which the new version waits for: just
+    the changed documents when they are known, a full rebuild otherwise.
+    """
+    if collection == "products":
+        product_totals_cache.clear()
+        if ids is None:
+            return product_search.maybe_refresh(db, force=True)
+        return product_search.apply_product_changes(db, ids) if ids else None
+    elif collection == "categories":
+        catalog_cache.invalidate("categories", prefix="category:")
+        if ids is None:
+            return product_search.maybe_refresh(db, force=True)
+        return product_search.apply_category_changes(db, ids) if ids else None
+    elif collection == "hero_slides":
+        catalog_cache.invalidate("hero_slides")
+    elif collection == "settings":
+        catalog_cache.invalidate("marquee")
+    elif collection == "promos":
+        catalog_cache.invalidate("promo:active")
+    return None
+
+catalog_versions.on_change(drop_stale_catalog_caches)
+
+# How long after a catalog change this worker keeps reading it from the
+# primary; a lagging secondary could otherwise put the old data in the local
+# caches or behind the new ETag. Should cover the usual replication lag.
+CATALOG_SETTLE_SECONDS = float(os.environ.get("MONGO_CATALOG_SETTLE_SECONDS", "10"))
+
+def catalog_reads(collection: str):
+    """Collection for public catalog reads: secondaries allowed, except right after a change"""
+    if catalog_versions.changed_within(collection, CATALOG_SETTLE_SECONDS):
+        return db[collection]
+    return catalog_db[collection]
+
+# Upstream checkout status per session: concurrent polls share one provider
+# call, and a session is checked upstream at most once per interval
+checkout_status_cache = TTLCache(
+    "checkout_status",
+    maxsize=4096,
+    ttl=float(os.environ.get("CHECKOUT_STATUS_MIN_INTERVAL", "3"))
+)
+
+# Shared payment gateway, created at startup (None when Stripe isn't configured)
+payment_gateway: Optional[PaymentGateway] = None
 
 # Create the main app
-app = FastAPI(title="ddebuut API")
+app = FastAPI(title="ddebuut API", default_response_class=FastJSONResponse)
 
-# Setup uploads directory
-UPLOADS_DIR = ROOT_DIR / "uploads"
-UPLOADS_DIR.mkdir(exist_ok=True)
+# Setup uploads directory (UPLOADS_DIR, default backend/uploads)
+UPLOADS_DIR = uploads_dir()
+UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
+
+# Resized WebP/AVIF copies of every upload for srcset, generated in the background
+image_derivatives = ImageDerivativePipeline(
+    db, UPLOADS_DIR, workers=int(os.environ.get("IMAGE_WORKERS", "2")), versions=catalog_versions
+)
 
 # Mount static files for uploads at /api/uploads to work with ingress
-app.mount("/api/uploads", StaticFiles(directory=str(UPLOADS_DIR)), name="uploads")
+app.mount("/api/uploads", ImmutableStaticFiles(directory=str(UPLOADS_DIR)), name="uploads")
 
 # Create routers
 api_router = APIRouter(prefix="/api")
 admin_router = APIRouter(prefix="/api/admin")
 
 # ============ Auth Helper ============
+async def get_principal(user_id: str) -> Optional[dict]:
+    """Cached user record without the password hash, None for unknown ids"""
+    async def load():
+        return await db.users.find_one({"id": user_id}, {"_id": 0, "password": 0})
+    return await principal_cache.get_or_load(user_id, load)
+
 async def get_admin_user(user_id: str = Depends(get_current_user)):
-    user = await db.users.find_one({"id": user_id})
+    user = await get_principal(user_id)
     if not user or not user.get("is_admin", False):
         raise HTTPException(status_code=403, detail="Admin access required")
     return user
@@ -74,7 +202,7 @@ async def register(user_data: UserCreate):
         "id": str(uuid.uuid4()),
         "email": user_data.email,
         "name": user_data.name,
-        "password": get_password_hash(user_data.password),
+        "password": await password_hasher.hash(user_data.password),
         "is_admin": False,
         "created_at": datetime.utcnow()
     }
@@ -87,15 +215,23 @@ async def register(user_data: UserCreate):
 @api_router.post("/auth/login", response_model=Token)
 async def login(credentials: UserLogin):
     user = await db.users.find_one({"email": credentials.email})
-    if not user or not verify_password(credentials.password, user["password"]):
+    if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
+    valid, new_hash = await password_hasher.verify_and_update(credentials.password, user["password"])
+    if not valid:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    
+    # Stored hash used an outdated bcrypt cost - upgrade it transparently
+    if new_hash:
+        await db.users.update_one({"id": user["id"]}, {"$set": {"password": new_hash}})
+    
     access_token = create_access_token({"user_id": user["id"]})
     return Token(access_token=access_token)
 
 @api_router.get("/auth/me", response_model=UserResponse)
 async def get_me(user_id: str = Depends(get_current_user)):
-    user = await db.users.find_one({"id": user_id})
+    user = await get_principal(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return UserResponse(
@@ -108,21 +244,25 @@ async def get_me(user_id: str = Depends(get_current_user)):
 # ============ Public Category Routes ============
 @api_router.get("/categories", response_model=List[Category])
 async def get_categories():
-    categories = await db.categories.find({}, {"_id": 0}).to_list(100)
-    return categories
+    async def load():
+        return await catalog_reads("categories").find({}, {"_id": 0}).to_list(100)
+    return await catalog_cache.get_or_load("categories", load)
 
 # ============ Hero Slides Routes ============
 @api_router.get("/hero-slides")
 async def get_hero_slides():
     """Get hero slides for homepage carousel"""
-    slides = await db.hero_slides.find({}, {"_id": 0}).sort("order", 1).to_list(20)
-    return slides
+    async def load():
+        return await catalog_reads("hero_slides").find({}, {"_id": 0}).sort("order", 1).to_list(20)
+    return await catalog_cache.get_or_load("hero_slides", load)
 
 # ============ Marquee Routes ============
 @api_router.get("/marquee")
 async def get_marquee_texts():
     """Get marquee announcement texts"""
-    marquee = await db.settings.find_one({"key": "marquee_texts"}, {"_id": 0})
+    async def load():
+        return await db.settings.find_one({"key": "marquee_texts"}, {"_id": 0})
+    marquee = await catalog_cache.get_or_load("marquee", load)
     if marquee and marquee.get("texts"):
         return marquee["texts"]
     # Default texts
@@ -135,12 +275,19 @@ async def get_marquee_texts():
 @api_router.get("/promo/active")
 async def get_active_promo():
     """Get active promo code for popup"""
-    promo = await db.promos.find_one({"is_active": True}, {"_id": 0})
-    return promo
+    async def load():
+        return await db.promos.find_one({"is_active": True}, {"_id": 0})
+    return await catalog_cache.get_or_load("promo:active", load)
+
+async def get_category_by_slug(slug: str) -> Optional[dict]:
+    """Cached category lookup, None when the slug doesn't exist"""
+    async def load():
+        return await catalog_reads("categories").find_one({"slug": slug}, {"_id": 0})
+    return await catalog_cache.get_or_load(f"category:{slug}", load)
 
 @api_router.get("/categories/{slug}")
 async def get_category(slug: str):
-    category = await db.categories.find_one({"slug": slug}, {"_id": 0})
+    category = await get_category_by_slug(slug)
     if not category:
         raise HTTPException(status_code=404, detail="Category not found")
     return category
@@ -155,13 +302,19 @@ async def get_products(
     sort: Optional[str] = "recommended",
     search: Optional[str] = None,
     limit: int = Query(default=50, le=100),
-    skip: int = 0
+    skip: int = 0,
+    cursor: Optional[str] = None,
+    with_total: bool = True
 ):
+    """List products; pass the returned next_cursor back as `cursor` for keyset paging (skip is ignored then).
+
+    `with_total=false` skips counting and returns total as null.
+    """
     query = {}
     
     # Category filter
     if category:
-        cat = await db.categories.find_one({"slug": category}, {"_id": 0})
+        cat = await get_category_by_slug(category)
         if cat:
             query["category_id"] = cat["id"]
     
@@ -179,9 +332,29 @@ async def get_products(
     if in_stock is not None:
         query["in_stock"] = in_stock
     
-    # Search filter
+    # Search filter - ranked ids from the in-process index, with the other
+    # filters already applied, so no count query is needed either
+    ranked_ids = None
+    uncached = False
     if search:
-        query["name"] = {"$regex": search, "$options": "i"}
+        product_search.maybe_refresh(db)
+    if search and not product_search.ready:
+        # Still building at startup: a plain name match, kept out of HTTP caches
+        # so clients don't hold on to it once ranked results are available
+        query["name"] = {"$regex": re.escape(search), "$options": "i"}
+        uncached = True
+    elif search:
+        ranked_ids, matched = product_search.search_with_total(
+            search,
+            limit=SEARCH_MAX_RESULTS,
+            category_id=query.get("category_id"),
+            min_price=min_price,
+            max_price=max_price,
+            in_stock=in_stock
+        )
+        if sort in (None, "recommended"):
+            return await get_products_by_relevance(ranked_ids, matched, limit, skip, cursor, with_total)
+        query = {"id": {"$in": ranked_ids}}
     
     # Sorting
     sort_field = "created_at"
@@ -199,16 +372,73 @@ async def get_products(
         sort_field = "name"
         sort_order = -1
     
-    products = await db.products.find(query, {"_id": 0}).sort(sort_field, sort_order).skip(skip).limit(limit).to_list(limit)
-    total = await db.products.count_documents(query)
+    # Fetch one extra document to know whether there is a next page
+    page_query = query
+    if cursor:
+        last_value, last_id = decode_cursor(cursor, sort_field, sort_order)
+        page_query = {"$and": [query, keyset_filter(sort_field, sort_order, last_value, last_id)]}
+        skip = 0
+    page = catalog_reads("products").find(page_query, {"_id": 0}).sort(keyset_sort(sort_field, sort_order)).skip(skip).limit(limit + 1).to_list(limit + 1)
+    
+    if ranked_ids is not None:
+        products, total = await page, (matched if with_total else None)
+    elif with_total:
+        products, total = await asyncio.gather(page, count_products(query))
+    else:
+        products, total = await page, None
+    next_page = next_cursor(products, limit, sort_field, sort_order)
+    await attach_image_widths(db, products)
+    
+    return FastJSONResponse(
+        {"products": products, "total": total, "next_cursor": next_page},
+        headers={"Cache-Control": "no-store"} if uncached else None
+    )
+
+async def get_products_by_relevance(ranked_ids: List[str], matched: int, limit: int, skip: int, cursor: Optional[str], with_total: bool):
+    """Search results page in relevance order; the cursor carries the offset into the ranking"""
+    offset = skip
+    if cursor:
+        offset, _ = decode_cursor(cursor, "relevance", -1)
+        if not isinstance(offset, int) or offset < 0:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    page_ids = ranked_ids[offset:offset + limit]
+    
+    docs = await catalog_reads("products").find({"id": {"$in": page_ids}}, {"_id": 0}).to_list(len(page_ids))
+    by_id = {doc["id"]: doc for doc in docs}
+    products = [by_id[pid] for pid in page_ids if pid in by_id]
+    await attach_image_widths(db, products)
+    
+    next_page = None
+    if offset + limit < len(ranked_ids):
+        next_page = encode_cursor({"relevance": offset + limit, "id": page_ids[-1]}, "relevance", -1)
+    
+    return FastJSONResponse({"products": products, "total": matched if with_total else None, "next_cursor": next_page})
+
+async def count_products(query: dict) -> int:
+    """Product count for a filter, cached briefly per normalized filter"""
+    if not query:
+        return await catalog_reads("products").estimated_document_count()
+    
+    price = query.get("price", {})
+    key = (
+        query.get("category_id"),
+        price.get("$gte"),
+        price.get("$lte"),
+        query.get("in_stock"),
+        # Name match of the search fallback while the index warms up
+        query.get("name", {}).get("$regex")
+    )
     
-    return {"products": products, "total": total}
+    async def load():
+        return await catalog_reads("products").count_documents(query)
+    return await product_totals_cache.get_or_load(key, load)
 
 @api_router.get("/products/{slug}")
 async def get_product(slug: str):
-    product = await db.products.find_one({"slug": slug}, {"_id": 0})
+    product = await catalog_reads("products").find_one({"slug": slug}, {"_id": 0})
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
+    await attach_image_widths(db, [product])
     return product
 
 # ============ Order Routes ============
@@ -216,16 +446,25 @@ async def get_product(slug: str):
 async def create_order(order_data: OrderCreate, user_id: Optional[str] = Depends(get_current_user_optional)):
     import uuid
     
+    # Fetch every product in the cart with a single query
+    product_ids = list(dict.fromkeys(item.product_id for item in order_data.items))
+    products = await db.products.find(
+        {"id": {"$in": product_ids}},
+        {"_id": 0, "id": 1, "price": 1, "shipping_cost": 1}
+    ).to_list(len(product_ids))
+    products_by_id = {p["id"]: p for p in products}
+    
+    missing = [pid for pid in product_ids if pid not in products_by_id]
+    if missing:
+        raise HTTPException(status_code=400, detail=f"Products not found: {', '.join(missing)}")
+    
     # Validate and get fresh prices from database
     validated_items = []
     subtotal = 0
     total_shipping = 0
     
     for item in order_data.items:
-        # Get current product price from database
-        product = await db.products.find_one({"id": item.product_id}, {"_id": 0})
-        if not product:
-            raise HTTPException(status_code=400, detail=f"Product {item.product_id} not found")
+        product = products_by_id[item.product_id]
         
         # Use current price from database (not from client)
         current_price = product.get("price", item.price)
@@ -267,15 +506,15 @@ async def create_order(order_data: OrderCreate, user_id: Optional[str] = Depends
         "created_at": datetime.utcnow()
     }
     
-    await db.orders.insert_one(order)
-    
-    # Return order without MongoDB _id
-    return await db.orders.find_one({"id": order_id}, {"_id": 0})
+    stats_token = await stats_engine.rebuild_token()
+    await insert_document(db.orders, {**order, **stats_engine.new_order_fields(stats_token, order)})
+    await stats_engine.record_order_created(order, stats_token)
+    return order
 
 @api_router.get("/orders")
 async def get_user_orders(user_id: str = Depends(get_current_user)):
     orders = await db.orders.find({"user_id": user_id}, {"_id": 0}).sort("created_at", -1).to_list(100)
-    return orders
+    return FastJSONResponse(orders)
 
 @api_router.get("/orders/{order_id}")
 async def get_order(order_id: str, user_id: Optional[str] = Depends(get_current_user_optional)):
@@ -294,10 +533,10 @@ async def get_order(order_id: str, user_id: Optional[str] = Depends(get_current_
 async def get_product_reviews(product_identifier: str):
     """Get all reviews for a product (by id or slug)"""
     # First try to find product by slug
-    product = await db.products.find_one({"slug": product_identifier}, {"_id": 0, "id": 1})
+    product = await catalog_reads("products").find_one({"slug": product_identifier}, {"_id": 0, "id": 1})
     if not product:
         # Try by id
-        product = await db.products.find_one({"id": product_identifier}, {"_id": 0, "id": 1})
+        product = await catalog_reads("products").find_one({"id": product_identifier}, {"_id": 0, "id": 1})
     
     if not product:
         return []
@@ -312,7 +551,7 @@ async def create_review(review_data: ReviewCreate, user_id: str = Depends(get_cu
     import uuid
     
     # Get user info
-    user = await db.users.find_one({"id": user_id})
+    user = await get_principal(user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -351,8 +590,7 @@ async def create_review(review_data: ReviewCreate, user_id: str = Depends(get_cu
         "created_at": datetime.utcnow()
     }
     
-    await db.reviews.insert_one(review)
-    return await db.reviews.find_one({"id": review["id"]}, {"_id": 0})
+    return await insert_document(db.reviews, review)
 
 @api_router.get("/reviews/can-review/{product_identifier}")
 async def can_review_product(product_identifier: str, user_id: str = Depends(get_current_user)):
@@ -389,6 +627,84 @@ async def can_review_product(product_identifier: str, user_id: str = Depends(get
 
 # ============ Admin Routes ============
 
+# Admin list endpoints return one keyset page (ADMIN_PAGE_SIZE rows unless
+# asked for up to ADMIN_PAGE_LIMIT) as a plain JSON array, which is what the
+# admin SPA expects; the cursor of the next page goes in X-Next-Cursor.
+# /export streams the whole filtered collection as NDJSON or CSV.
+ADMIN_PAGE_SIZE = 50
+ADMIN_PAGE_LIMIT = 1000
+EXPORT_FORMAT = Query(default="ndjson", pattern="^(ndjson|csv)$")
+USER_PROJECTION = {"_id": 0, "password": 0}
+
+EXPORT_COLUMNS = {
+    "products": ["id", "name", "slug", "price", "original_price", "shipping_cost", "currency", "category_id", "in_stock", "sizes", "colors", "images", "created_at"],
+    "orders": ["id", "user_id", "email", "status", "paid", "subtotal", "shipping_cost", "total", "items", "shipping_address", "created_at"],
+    "reviews": ["id", "product_id", "order_id", "user_id", "user_name", "rating", "title", "comment", "verified_purchase", "is_fake", "images", "created_at"],
+    "users": ["id", "email", "name", "is_admin", "created_at"],
+}
+
+async def admin_page(collection, query: dict, projection: dict, limit: int, cursor: Optional[str], transform=None) -> FastJSONResponse:
+    """One keyset page as a JSON array, with the next page's cursor in X-Next-Cursor"""
+    items, next_page = await fetch_page(collection, query, projection, limit, cursor)
+    if transform is not None:
+        items = [transform(item) for item in items]
+    return FastJSONResponse(items, headers={"X-Next-Cursor": next_page} if next_page else None)
+
+def admin_products_filter(category_id: Optional[str] = None, in_stock: Optional[bool] = None) -> dict:
+    query = {}
+    if category_id:
+        query["category_id"] = category_id
+    if in_stock is not None:
+        query["in_stock"] = in_stock
+    return query
+
+def admin_orders_filter(
+    status: Optional[str] = None,
+    paid: Optional[bool] = None,
+    email: Optional[str] = None,
+    user_id: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None
+) -> dict:
+    query = {}
+    if status:
+        query["status"] = status
+    if paid is not None:
+        query["paid"] = paid
+    if email:
+        query["email"] = email
+    if user_id:
+        query["user_id"] = user_id
+    if created_from or created_to:
+        query["created_at"] = {}
+        if created_from:
+            query["created_at"]["$gte"] = created_from
+        if created_to:
+            query["created_at"]["$lt"] = created_to
+    return query
+
+def admin_reviews_filter(
+    product_id: Optional[str] = None,
+    rating: Optional[int] = None,
+    is_fake: Optional[bool] = None
+) -> dict:
+    query = {}
+    if product_id:
+        query["product_id"] = product_id
+    if rating is not None:
+        query["rating"] = rating
+    if is_fake is not None:
+        query["is_fake"] = True if is_fake else {"$ne": True}
+    return query
+
+def admin_users_filter(is_admin: Optional[bool] = None, email: Optional[str] = None) -> dict:
+    query = {}
+    if is_admin is not None:
+        query["is_admin"] = is_admin
+    if email:
+        query["email"] = email
+    return query
+
 # File Upload for Images
 ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp'}
 MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
@@ -408,18 +724,11 @@ async def upload_image(
             detail=f"Invalid file type. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"
         )
     
-    # Check file size
-    contents = await file.read()
-    if len(contents) > MAX_FILE_SIZE:
-        raise HTTPException(status_code=400, detail="File too large. Max 5MB allowed.")
-    
-    # Generate unique filename
-    unique_filename = f"{uuid.uuid4()}{file_ext}"
-    file_path = UPLOADS_DIR / unique_filename
-    
-    # Save file
-    with open(file_path, "wb") as f:
-        f.write(contents)
+    # Stream to disk off the event loop, checking size and content as it goes
+    stored = await save_upload(db, file, UPLOADS_DIR, MAX_FILE_SIZE)
+    unique_filename = stored.filename
+    if stored.created:
+        image_derivatives.schedule(unique_filename)
     
     # Generate URL - use /api/uploads/ path for ingress compatibility
     base_url = str(request.base_url).rstrip('/')
@@ -428,13 +737,30 @@ async def upload_image(
         base_url = base_url.replace('http://', 'https://')
     image_url = f"{base_url}/api/uploads/{unique_filename}"
     
-    return {"url": image_url, "filename": unique_filename}
+    return {
+        "url": image_url,
+        "filename": unique_filename,
+        "srcset": image_derivatives.manifest(unique_filename, f"{base_url}/api/uploads")
+    }
 
 # Admin Products
 @admin_router.get("/products")
-async def admin_get_products(admin: dict = Depends(get_admin_user)):
-    products = await db.products.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return products
+async def admin_get_products(
+    query: dict = Depends(admin_products_filter),
+    limit: int = Query(default=ADMIN_PAGE_SIZE, ge=1, le=ADMIN_PAGE_LIMIT),
+    cursor: Optional[str] = None,
+    admin: dict = Depends(get_admin_user)
+):
+    return await admin_page(db.products, query, {"_id": 0}, limit, cursor)
+
+@admin_router.get("/products/export")
+async def admin_export_products(
+    query: dict = Depends(admin_products_filter),
+    format: str = EXPORT_FORMAT,
+    admin: dict = Depends(get_admin_user)
+):
+    cursor = db.products.find(query, {"_id": 0}).sort("created_at", -1)
+    return export_response(cursor, format, EXPORT_COLUMNS["products"], "products")
 
 @admin_router.post("/products")
 async def admin_create_product(product_data: ProductCreate, admin: dict = Depends(get_admin_user)):
@@ -451,21 +777,24 @@ async def admin_create_product(product_data: ProductCreate, admin: dict = Depend
         "created_at": datetime.utcnow()
     }
     
-    await db.products.insert_one(product)
+    await insert_document(db.products, product)
+    product_totals_cache.clear()
+    product_search.add(product)
+    await catalog_versions.bump("products", [product["id"]])
     return product
 
 @admin_router.put("/products/{product_id}")
 async def admin_update_product(product_id: str, product_data: ProductUpdate, admin: dict = Depends(get_admin_user)):
-    product = await db.products.find_one({"id": product_id}, {"_id": 0})
-    if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
-    
     update_data = {k: v for k, v in product_data.dict().items() if v is not None}
     
-    if update_data:
-        await db.products.update_one({"id": product_id}, {"$set": update_data})
+    updated = await update_document(db.products, {"id": product_id}, update_data)
+    if not updated:
+        raise HTTPException(status_code=404, detail="Product not found")
     
-    updated = await db.products.find_one({"id": product_id}, {"_id": 0})
+    if update_data:
+        product_totals_cache.clear()
+        product_search.add(updated)
+        await catalog_versions.bump("products", [product_id])
     return updated
 
 @admin_router.delete("/products/{product_id}")
@@ -473,6 +802,9 @@ async def admin_delete_product(product_id: str, admin: dict = Depends(get_admin_
     result = await db.products.delete_one({"id": product_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    product_totals_cache.clear()
+    product_search.remove(product_id)
+    await catalog_versions.bump("products", [product_id])
     return {"message": "Product deleted"}
 
 # Admin Categories
@@ -497,27 +829,31 @@ async def admin_create_hero_slide(slide_data: HeroSlideCreate, admin: dict = Dep
         "order": slide_data.order if slide_data.order else await db.hero_slides.count_documents({}) + 1,
         "created_at": datetime.utcnow()
     }
-    await db.hero_slides.insert_one(slide)
-    return await db.hero_slides.find_one({"id": slide_id}, {"_id": 0})
+    created = await insert_document(db.hero_slides, slide)
+    catalog_cache.invalidate("hero_slides")
+    await catalog_versions.bump("hero_slides")
+    return created
 
 @admin_router.put("/hero-slides/{slide_id}")
 async def admin_update_hero_slide(slide_id: str, slide_data: HeroSlideUpdate, admin: dict = Depends(get_admin_user)):
-    slide = await db.hero_slides.find_one({"id": slide_id})
-    if not slide:
-        raise HTTPException(status_code=404, detail="Slide not found")
-    
     update_data = {k: v for k, v in slide_data.dict().items() if v is not None}
     
-    if update_data:
-        await db.hero_slides.update_one({"id": slide_id}, {"$set": update_data})
+    updated = await update_document(db.hero_slides, {"id": slide_id}, update_data)
+    if not updated:
+        raise HTTPException(status_code=404, detail="Slide not found")
     
-    return await db.hero_slides.find_one({"id": slide_id}, {"_id": 0})
+    if update_data:
+        catalog_cache.invalidate("hero_slides")
+        await catalog_versions.bump("hero_slides")
+    return updated
 
 @admin_router.delete("/hero-slides/{slide_id}")
 async def admin_delete_hero_slide(slide_id: str, admin: dict = Depends(get_admin_user)):
     result = await db.hero_slides.delete_one({"id": slide_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Slide not found")
+    catalog_cache.invalidate("hero_slides")
+    await catalog_versions.bump("hero_slides")
     return {"message": "Slide deleted"}
 
 # Admin Marquee
@@ -539,6 +875,8 @@ async def admin_update_marquee(data: dict, admin: dict = Depends(get_admin_user)
         {"$set": {"key": "marquee_texts", "texts": texts}},
         upsert=True
     )
+    catalog_cache.invalidate("marquee")
+    await catalog_versions.bump("settings")
     return {"message": "Marquee updated"}
 
 # Admin Promo Codes
@@ -562,15 +900,13 @@ async def admin_create_promo(promo_data: dict, admin: dict = Depends(get_admin_u
         "is_active": promo_data.get("is_active", True),
         "created_at": datetime.utcnow()
     }
-    await db.promos.insert_one(promo)
-    return await db.promos.find_one({"id": promo["id"]}, {"_id": 0})
+    created = await insert_document(db.promos, promo)
+    catalog_cache.invalidate("promo:active")
+    await catalog_versions.bump("promos")
+    return created
 
 @admin_router.put("/promos/{promo_id}")
 async def admin_update_promo(promo_id: str, promo_data: dict, admin: dict = Depends(get_admin_user)):
-    promo = await db.promos.find_one({"id": promo_id})
-    if not promo:
-        raise HTTPException(status_code=404, detail="Promo not found")
-    
     update_data = {}
     if "code" in promo_data:
         update_data["code"] = promo_data["code"].upper()
@@ -581,16 +917,22 @@ async def admin_update_promo(promo_id: str, promo_data: dict, admin: dict = Depe
     if "is_active" in promo_data:
         update_data["is_active"] = promo_data["is_active"]
     
-    if update_data:
-        await db.promos.update_one({"id": promo_id}, {"$set": update_data})
+    updated = await update_document(db.promos, {"id": promo_id}, update_data)
+    if not updated:
+        raise HTTPException(status_code=404, detail="Promo not found")
     
-    return await db.promos.find_one({"id": promo_id}, {"_id": 0})
+    if update_data:
+        catalog_cache.invalidate("promo:active")
+        await catalog_versions.bump("promos")
+    return updated
 
 @admin_router.delete("/promos/{promo_id}")
 async def admin_delete_promo(promo_id: str, admin: dict = Depends(get_admin_user)):
     result = await db.promos.delete_one({"id": promo_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Promo not found")
+    catalog_cache.invalidate("promo:active")
+    await catalog_versions.bump("promos")
     return {"message": "Promo deleted"}
 
 @admin_router.post("/categories")
@@ -607,21 +949,25 @@ async def admin_create_category(category_data: CategoryCreate, admin: dict = Dep
         "created_at": datetime.utcnow()
     }
     
-    await db.categories.insert_one(category)
+    await insert_document(db.categories, category)
+    catalog_cache.invalidate("categories", prefix="category:")
+    product_search.set_category_name(category["id"], category["name"])
+    await catalog_versions.bump("categories", [category["id"]])
     return category
 
 @admin_router.put("/categories/{category_id}")
 async def admin_update_category(category_id: str, category_data: CategoryUpdate, admin: dict = Depends(get_admin_user)):
-    category = await db.categories.find_one({"id": category_id}, {"_id": 0})
-    if not category:
-        raise HTTPException(status_code=404, detail="Category not found")
-    
     update_data = {k: v for k, v in category_data.dict().items() if v is not None}
     
-    if update_data:
-        await db.categories.update_one({"id": category_id}, {"$set": update_data})
+    updated = await update_document(db.categories, {"id": category_id}, update_data)
+    if not updated:
+        raise HTTPException(status_code=404, detail="Category not found")
     
-    updated = await db.categories.find_one({"id": category_id}, {"_id": 0})
+    if update_data:
+        catalog_cache.invalidate("categories", prefix="category:")
+        if "name" in update_data:
+            product_search.set_category_name(category_id, update_data["name"])
+        await catalog_versions.bump("categories", [category_id])
     return updated
 
 @admin_router.delete("/categories/{category_id}")
@@ -629,13 +975,28 @@ async def admin_delete_category(category_id: str, admin: dict = Depends(get_admi
     result = await db.categories.delete_one({"id": category_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Category not found")
+    catalog_cache.invalidate("categories", prefix="category:")
+    await catalog_versions.bump("categories", [category_id])
     return {"message": "Category deleted"}
 
 # Admin Reviews (Fake Reviews Management)
 @admin_router.get("/reviews")
-async def admin_get_reviews(admin: dict = Depends(get_admin_user)):
-    reviews = await db.reviews.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return reviews
+async def admin_get_reviews(
+    query: dict = Depends(admin_reviews_filter),
+    limit: int = Query(default=ADMIN_PAGE_SIZE, ge=1, le=ADMIN_PAGE_LIMIT),
+    cursor: Optional[str] = None,
+    admin: dict = Depends(get_admin_user)
+):
+    return await admin_page(db.reviews, query, {"_id": 0}, limit, cursor)
+
+@admin_router.get("/reviews/export")
+async def admin_export_reviews(
+    query: dict = Depends(admin_reviews_filter),
+    format: str = EXPORT_FORMAT,
+    admin: dict = Depends(get_admin_user)
+):
+    cursor = db.reviews.find(query, {"_id": 0}).sort("created_at", -1)
+    return export_response(cursor, format, EXPORT_COLUMNS["reviews"], "reviews")
 
 @admin_router.post("/reviews")
 async def admin_create_review(review_data: dict, admin: dict = Depends(get_admin_user)):
@@ -652,24 +1013,19 @@ async def admin_create_review(review_data: dict, admin: dict = Depends(get_admin
         "created_at": datetime.utcnow(),
         "is_fake": True  # Mark as admin-created
     }
-    await db.reviews.insert_one(review)
-    return await db.reviews.find_one({"id": review["id"]}, {"_id": 0})
+    return await insert_document(db.reviews, review)
 
 @admin_router.put("/reviews/{review_id}")
 async def admin_update_review(review_id: str, review_data: dict, admin: dict = Depends(get_admin_user)):
-    review = await db.reviews.find_one({"id": review_id})
-    if not review:
-        raise HTTPException(status_code=404, detail="Review not found")
-    
     update_data = {
         k: v for k, v in review_data.items() 
         if k in ["product_id", "user_name", "rating", "title", "comment", "verified_purchase", "images"] and v is not None
     }
     
-    if update_data:
-        await db.reviews.update_one({"id": review_id}, {"$set": update_data})
-    
-    return await db.reviews.find_one({"id": review_id}, {"_id": 0})
+    updated = await update_document(db.reviews, {"id": review_id}, update_data)
+    if not updated:
+        raise HTTPException(status_code=404, detail="Review not found")
+    return updated
 
 @admin_router.delete("/reviews/{review_id}")
 async def admin_delete_review(review_id: str, admin: dict = Depends(get_admin_user)):
@@ -680,36 +1036,66 @@ async def admin_delete_review(review_id: str, admin: dict = Depends(get_admin_us
 
 # Admin Orders
 @admin_router.get("/orders")
-async def admin_get_orders(admin: dict = Depends(get_admin_user)):
-    orders = await db.orders.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return orders
+async def admin_get_orders(
+    query: dict = Depends(admin_orders_filter),
+    limit: int = Query(default=ADMIN_PAGE_SIZE, ge=1, le=ADMIN_PAGE_LIMIT),
+    cursor: Optional[str] = None,
+    admin: dict = Depends(get_admin_user)
+):
+    return await admin_page(db.orders, query, {"_id": 0}, limit, cursor)
+
+@admin_router.get("/orders/export")
+async def admin_export_orders(
+    query: dict = Depends(admin_orders_filter),
+    format: str = EXPORT_FORMAT,
+    admin: dict = Depends(get_admin_user)
+):
+    cursor = db.orders.find(query, {"_id": 0}).sort("created_at", -1)
+    return export_response(cursor, format, EXPORT_COLUMNS["orders"], "orders")
 
 @admin_router.put("/orders/{order_id}/status")
 async def admin_update_order_status(order_id: str, status_data: OrderStatusUpdate, admin: dict = Depends(get_admin_user)):
-    order = await db.orders.find_one({"id": order_id})
-    if not order:
-        raise HTTPException(status_code=404, detail="Order not found")
-    
     valid_statuses = ["pending", "processing", "shipped", "delivered", "cancelled"]
     if status_data.status not in valid_statuses:
         raise HTTPException(status_code=400, detail=f"Invalid status. Must be one of: {valid_statuses}")
     
-    await db.orders.update_one({"id": order_id}, {"$set": {"status": status_data.status}})
+    stats_token = await stats_engine.track_change(order_id)
+    previous = await db.orders.find_one_and_update(
+        {"id": order_id},
+        {"$set": {"status": status_data.status, **stats_engine.tracked_fields(stats_token, status=status_data.status)}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.BEFORE
+    )
+    if not previous:
+        raise HTTPException(status_code=404, detail="Order not found")
     
-    updated = await db.orders.find_one({"id": order_id})
-    return updated
+    await stats_engine.record_status_change(previous, previous.get("status", "pending"), status_data.status, stats_token)
+    return {**previous, "status": status_data.status}
 
 # Admin Users
 @admin_router.get("/users")
-async def admin_get_users(admin: dict = Depends(get_admin_user)):
-    users = await db.users.find().to_list(1000)
-    return [{
+async def admin_get_users(
+    query: dict = Depends(admin_users_filter),
+    limit: int = Query(default=ADMIN_PAGE_SIZE, ge=1, le=ADMIN_PAGE_LIMIT),
+    cursor: Optional[str] = None,
+    admin: dict = Depends(get_admin_user)
+):
+    return await admin_page(db.users, query, USER_PROJECTION, limit, cursor, transform=lambda u: {
         "id": u["id"],
         "email": u["email"],
         "name": u["name"],
         "is_admin": u.get("is_admin", False),
         "created_at": u.get("created_at")
-    } for u in users]
+    })
+
+@admin_router.get("/users/export")
+async def admin_export_users(
+    query: dict = Depends(admin_users_filter),
+    format: str = EXPORT_FORMAT,
+    admin: dict = Depends(get_admin_user)
+):
+    cursor = db.users.find(query, USER_PROJECTION).sort("created_at", -1)
+    return export_response(cursor, format, EXPORT_COLUMNS["users"], "users")
 
 @admin_router.put("/users/{user_id}/admin")
 async def admin_toggle_user_admin(user_id: str, admin: dict = Depends(get_admin_user)):
@@ -719,34 +1105,54 @@ async def admin_toggle_user_admin(user_id: str, admin: dict = Depends(get_admin_
     
     new_status = not user.get("is_admin", False)
     await db.users.update_one({"id": user_id}, {"$set": {"is_admin": new_status}})
+    principal_cache.invalidate(user_id)
     
     return {"message": f"User admin status set to {new_status}"}
 
 # Admin Dashboard Stats
 @admin_router.get("/stats")
-async def admin_get_stats(admin: dict = Depends(get_admin_user)):
-    products_count = await db.products.count_documents({})
-    categories_count = await db.categories.count_documents({})
-    orders_count = await db.orders.count_documents({})
-    users_count = await db.users.count_documents({})
-    
-    # Recent orders
-    recent_orders = await db.orders.find().sort("created_at", -1).limit(5).to_list(5)
-    
-    # Total revenue
-    pipeline = [{"$group": {"_id": None, "total": {"$sum": "$total"}}}]
-    revenue_result = await db.orders.aggregate(pipeline).to_list(1)
-    total_revenue = revenue_result[0]["total"] if revenue_result else 0
-    
+async def admin_get_stats(
+    days: int = Query(default=30, ge=1, le=366),
+    rebuild: bool = False,
+    admin: dict = Depends(get_admin_user)
+):
+    """Dashboard numbers from the materialized stats; rebuild=true recomputes them from orders"""
+    try:
+        return await stats_engine.dashboard(days=days, rebuild=rebuild)
+    except RebuildInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+# Admin Runtime Stats
+@admin_router.get("/runtime-stats")
+async def admin_get_runtime_stats(admin: dict = Depends(get_admin_user)):
+    """In-process cache counters for this worker"""
     return {
-        "products": products_count,
-        "categories": categories_count,
-        "orders": orders_count,
-        "users": users_count,
-        "total_revenue": total_revenue,
-        "recent_orders": recent_orders
+        "catalog_cache": catalog_cache.stats(),
+        "product_totals_cache": product_totals_cache.stats(),
+        "product_search": product_search.stats(),
+        "password_hashing": password_hasher.stats(),
+        "principal_cache": principal_cache.stats(),
+        "payments": payment_gateway.stats() if payment_gateway else None,
+        "checkout_status_cache": checkout_status_cache.stats(),
+        "webhook_queue": webhook_queue.stats(),
+        "image_derivatives": image_derivatives.stats(),
+        "catalog_versions": catalog_versions.stats(),
+        "mongo_pool": pool_metrics.stats()
     }
 
+# Prometheus scrape target; per worker, like runtime-stats
+@api_router.get("/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    token = os.environ.get("METRICS_TOKEN")
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest(request.headers.get("authorization", "").encode(), f"Bearer {token}".encode()):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(
+        render_metrics(request_metrics, command_metrics, pool_metrics.stats()),
+        media_type="text/plain; version=0.0.4"
+    )
+
 # Root endpoint
 @api_router.get("/")
 async def root():
@@ -761,11 +1167,39 @@ class CreateCheckoutRequest(BaseModel):
 class CheckoutStatusRequest(BaseModel):
     session_id: str
 
+def current_payment_gateway() -> Optional[PaymentGateway]:
+    """The startup-created gateway; override this dependency to swap in a fake"""
+    return payment_gateway
+
+def get_payment_gateway(gateway: Optional[PaymentGateway] = Depends(current_payment_gateway)) -> PaymentGateway:
+    if gateway is None:
+        raise HTTPException(status_code=500, detail="Stripe not configured")
+    return gateway
+
+def stripe_webhook_url(request: Request) -> str:
+    webhook_url = os.environ.get("STRIPE_WEBHOOK_URL")
+    if webhook_url:
+        return webhook_url
+    host_url = str(request.base_url).rstrip('/')
+    return f"{host_url}/api/webhook/stripe"
+
+async def mark_order_paid(order_id: str):
+    """Flag an order as paid and processing once; repeated notifications are no-ops"""
+    stats_token = await stats_engine.track_change(order_id)
+    previous = await db.orders.find_one_and_update(
+        {"id": order_id, "paid": {"$ne": True}},
+        {"$set": {"status": "processing", "paid": True, **stats_engine.tracked_fields(stats_token, status="processing", paid=True)}},
+        projection={"_id": 0, "status": 1, "total": 1, "created_at": 1}
+    )
+    if previous:
+        await stats_engine.record_paid(previous, "processing", stats_token)
+
 @api_router.post("/checkout/create")
 async def create_checkout_session(
     checkout_data: CreateCheckoutRequest, 
     request: Request,
-    user_id: Optional[str] = Depends(get_current_user_optional)
+    user_id: Optional[str] = Depends(get_current_user_optional),
+    gateway: PaymentGateway = Depends(get_payment_gateway)
 ):
     """Create Stripe checkout session for an order"""
     import uuid
@@ -775,16 +1209,6 @@ async def create_checkout_session(
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    # Get Stripe API key
-    stripe_api_key = os.environ.get("STRIPE_API_KEY")
-    if not stripe_api_key:
-        raise HTTPException(status_code=500, detail="Stripe not configured")
-    
-    # Initialize Stripe
-    host_url = str(request.base_url).rstrip('/')
-    webhook_url = f"{host_url}/api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
-    
     # Build URLs from frontend origin
     origin_url = checkout_data.origin_url.rstrip('/')
     success_url = f"{origin_url}/checkout/success?session_id={{CHECKOUT_SESSION_ID}}"
@@ -806,7 +1230,7 @@ async def create_checkout_session(
     )
     
     try:
-        session: CheckoutSessionResponse = await stripe_checkout.create_checkout_session(checkout_request)
+        session: CheckoutSessionResponse = await gateway.create_checkout_session(checkout_request, stripe_webhook_url(request))
         
         # Save payment transaction
         transaction = {
@@ -830,98 +1254,176 @@ async def create_checkout_session(
         logger.error(f"Stripe checkout error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Payment error: {str(e)}")
 
+def checkout_is_final(transaction: dict) -> bool:
+    """Paid or expired sessions never change again upstream"""
+    return transaction.get("payment_status") == "paid" or transaction.get("status") == "expired"
+
+def checkout_status_from_transaction(transaction: dict) -> dict:
+    amount_total = transaction.get("amount_total")
+    if amount_total is None:
+        amount_total = int(round(transaction.get("amount", 0) * 100))
+    return {
+        "status": transaction.get("status") or "complete",
+        "payment_status": transaction["payment_status"],
+        "amount_total": amount_total,
+        "currency": transaction.get("currency", "usd")
+    }
+
+async def refresh_checkout_status(session_id: str, transaction: Optional[dict], gateway: PaymentGateway, webhook_url: str) -> dict:
+    """Ask the provider for the session status and record it if it changed"""
+    status: CheckoutStatusResponse = await gateway.get_checkout_status(session_id, webhook_url)
+    result = {
+        "status": status.status,
+        "payment_status": status.payment_status,
+        "amount_total": status.amount_total,
+        "currency": status.currency
+    }
+    
+    # Only write when something moved; pending polls leave Mongo alone
+    if transaction and (transaction.get("payment_status"), transaction.get("status")) != (status.payment_status, status.status):
+        await db.payment_transactions.update_one(
+            {"session_id": session_id},
+            {"$set": {
+                "payment_status": status.payment_status,
+                "status": status.status,
+                "amount_total": status.amount_total,
+                "updated_at": datetime.utcnow()
+            }}
+        )
+        
+        # Update order status if paid
+        if status.payment_status == "paid":
+            await mark_order_paid(transaction["order_id"])
+    
+    return result
+
 @api_router.get("/checkout/status/{session_id}")
-async def get_checkout_status(session_id: str, request: Request):
+async def get_checkout_status(
+    session_id: str,
+    request: Request,
+    gateway: Optional[PaymentGateway] = Depends(current_payment_gateway)
+):
     """Get payment status for a checkout session"""
-    stripe_api_key = os.environ.get("STRIPE_API_KEY")
-    if not stripe_api_key:
-        raise HTTPException(status_code=500, detail="Stripe not configured")
+    transaction = await db.payment_transactions.find_one({"session_id": session_id}, {"_id": 0})
+    if transaction and checkout_is_final(transaction):
+        return checkout_status_from_transaction(transaction)
     
-    host_url = str(request.base_url).rstrip('/')
-    webhook_url = f"{host_url}/api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
+    if gateway is None:
+        raise HTTPException(status_code=500, detail="Stripe not configured")
     
     try:
-        status: CheckoutStatusResponse = await stripe_checkout.get_checkout_status(session_id)
-        
-        # Update transaction and order status
-        transaction = await db.payment_transactions.find_one({"session_id": session_id})
-        if transaction:
-            new_status = "paid" if status.payment_status == "paid" else status.payment_status
-            
-            # Update transaction
-            await db.payment_transactions.update_one(
-                {"session_id": session_id},
-                {"$set": {
-                    "payment_status": new_status,
-                    "updated_at": datetime.utcnow()
-                }}
-            )
-            
-            # Update order status if paid
-            if status.payment_status == "paid":
-                await db.orders.update_one(
-                    {"id": transaction["order_id"]},
-                    {"$set": {"status": "processing", "paid": True}}
-                )
-        
-        return {
-            "status": status.status,
-            "payment_status": status.payment_status,
-            "amount_total": status.amount_total,
-            "currency": status.currency
-        }
+        return await checkout_status_cache.get_or_load(
+            session_id,
+            lambda: refresh_checkout_status(session_id, transaction, gateway, stripe_webhook_url(request))
+        )
     except Exception as e:
         logger.error(f"Stripe status error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Status check error: {str(e)}")
 
+async def process_webhook_events(events: List[dict]):
+    """Apply a batch of queued webhook events; safe to run more than once"""
+    session_ids = list({e["session_id"] for e in events if e.get("payment_status") == "paid"})
+    if not session_ids:
+        return
+    
+    transactions = await db.payment_transactions.find(
+        {"session_id": {"$in": session_ids}},
+        {"_id": 0, "session_id": 1, "order_id": 1}
+    ).to_list(len(session_ids))
+    if transactions:
+        await db.payment_transactions.update_many(
+            {"session_id": {"$in": [t["session_id"] for t in transactions]}},
+            {"$set": {"payment_status": "paid", "updated_at": datetime.utcnow()}}
+        )
+        # Each order is claimed on its own so the paid counters stay exact
+        await asyncio.gather(*[mark_order_paid(t["order_id"]) for t in transactions])
+    checkout_status_cache.invalidate(*session_ids)
+
+# Verified webhook events waiting for processing, drained by background workers
+webhook_queue = WebhookQueue(
+    db,
+    process_webhook_events,
+    workers=int(os.environ.get("WEBHOOK_WORKERS", "2")),
+    batch_size=int(os.environ.get("WEBHOOK_BATCH_SIZE", "100"))
+)
+
 @api_router.post("/webhook/stripe")
-async def stripe_webhook(request: Request):
-    """Handle Stripe webhook events"""
-    stripe_api_key = os.environ.get("STRIPE_API_KEY")
-    if not stripe_api_key:
+async def stripe_webhook(
+    request: Request,
+    gateway: Optional[PaymentGateway] = Depends(current_payment_gateway)
+):
+    """Verify a Stripe webhook event and queue it for processing"""
+    if gateway is None:
         return {"status": "error", "message": "Stripe not configured"}
     
-    host_url = str(request.base_url).rstrip('/')
-    webhook_url = f"{host_url}/api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
+    # A 4xx tells the provider not to retry, so only bad events get one;
+    # anything that could succeed later is a 5xx and will be redelivered
+    body = await request.body()
+    signature = request.headers.get("Stripe-Signature")
+    try:
+        webhook_response = await gateway.handle_webhook(body, signature, stripe_webhook_url(request))
+    except PaymentGatewayError as e:
+        logger.error(f"Webhook verification unavailable: {e}")
+        raise HTTPException(status_code=503, detail="Payment provider unavailable")
+    except Exception as e:
+        logger.warning(f"Rejected webhook: {e}")
+        raise HTTPException(status_code=400, detail="Invalid webhook signature or payload")
+    
+    logger.info(f"Stripe webhook: {webhook_response.event_type} - {webhook_response.session_id}")
     
+    # Provider retries carry the same event id and are dropped here
+    event_id = webhook_response.event_id or f"{webhook_response.event_type}:{webhook_response.session_id}"
     try:
-        body = await request.body()
-        signature = request.headers.get("Stripe-Signature")
-        
-        webhook_response = await stripe_checkout.handle_webhook(body, signature)
-        
-        logger.info(f"Stripe webhook: {webhook_response.event_type} - {webhook_response.session_id}")
-        
-        # Update payment status based on webhook
-        if webhook_response.payment_status == "paid":
-            transaction = await db.payment_transactions.find_one({"session_id": webhook_response.session_id})
-            if transaction:
-                await db.payment_transactions.update_one(
-                    {"session_id": webhook_response.session_id},
-                    {"$set": {"payment_status": "paid", "updated_at": datetime.utcnow()}}
-                )
-                await db.orders.update_one(
-                    {"id": transaction["order_id"]},
-                    {"$set": {"status": "processing", "paid": True}}
-                )
-        
-        return {"status": "success"}
+        await webhook_queue.enqueue(event_id, {
+            "event_type": webhook_response.event_type,
+            "session_id": webhook_response.session_id,
+            "payment_status": webhook_response.payment_status,
+            "metadata": webhook_response.metadata
+        })
     except Exception as e:
-        logger.error(f"Webhook error: {str(e)}")
-        return {"status": "error", "message": str(e)}
+        logger.error(f"Storing webhook event {event_id} failed: {e}")
+        raise HTTPException(status_code=500, detail="Could not store webhook event")
+    
+    return {"status": "success"}
 
 # Include routers
 app.include_router(api_router)
 app.include_router(admin_router)
 
+# Added before CORS so early 304/413 responses still carry CORS headers
+app.add_middleware(UploadSizeLimit, paths=["/api/admin/upload"], max_size=MAX_FILE_SIZE)
+app.add_middleware(
+    CatalogCacheMiddleware,
+    versions=catalog_versions,
+    rules=[
+        (r"/api/products", ["products", "categories"]),
+        (r"/api/products/[^/]+", ["products"]),
+        (r"/api/categories(/[^/]+)?", ["categories"]),
+        (r"/api/hero-slides", ["hero_slides"]),
+    ],
+    cache_control=os.environ.get(
+        "CATALOG_CACHE_CONTROL",
+        "public, max-age=0, s-maxage=30, stale-while-revalidate=120"
+    ),
+    build=build_version(ROOT_DIR)
+)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
+)
+
+# Outermost, so the timings include the other middleware and ETag 304s
+app.add_middleware(
+    RequestMetricsMiddleware,
+    metrics=request_metrics,
+    routes=app.routes,
+    commands_warn=int(os.environ.get("REQUEST_COMMANDS_WARN", "25")),
+    server_timing=SERVER_TIMING
 )
 
 # Configure logging
@@ -931,13 +1433,32 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Set to 0 where `python bootstrap.py` runs as a release step, so a worker
+# started against an un-bootstrapped database fails instead of migrating it
+AUTO_BOOTSTRAP = os.environ.get("AUTO_BOOTSTRAP", "1") == "1"
+
 @app.on_event("startup")
 async def startup_event():
-    # Seed database with initial data
-    from seed_data import seed_database
-    await seed_database()
-    logger.info("Database seeded successfully")
+    # Indexes, seed data and migrations are applied by `python bootstrap.py`;
+    # a current database costs one marker read here
+    await ensure_schema(db, auto_bootstrap=AUTO_BOOTSTRAP)
+
+    product_search.maybe_refresh(db)
+    
+    await catalog_versions.start()
+
+    global payment_gateway
+    payment_gateway = create_payment_gateway()
+    
+    webhook_queue.start()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await webhook_queue.stop()
+    await catalog_versions.stop()
+    await product_search.stop()
     client.close()
+    password_hasher.shutdown()
+    image_derivatives.shutdown()
+    if payment_gateway is not None:
+        await payment_gateway.close()
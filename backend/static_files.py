@@ -0,0 +1,140 @@
+"""Static file serving for uploaded images.
+
+Upload names never get reused for different bytes (content-hash names, and
+uuid names for older uploads), so every response can be cached forever:
+`ImmutableStaticFiles` sends `Cache-Control: immutable` with a year-long
+max-age and a strong ETag (the sha256 itself for content-addressed files).
+It also answers single-range `Range` requests with 206, honouring
+`If-Range`. Uploads are images, which are already compressed, so there is
+no content negotiation. Full files go out through FileResponse
+(which uses the server's pathsend extension when available) and ranges
+through the zero-copy extension when the server offers it, so the bytes can
+be sendfile()d instead of passing through Python.
+"""
+import os
+import re
+import stat
+from email.utils import formatdate
+from mimetypes import guess_type
+from typing import Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Receive, Scope, Send
+
+CHUNK_SIZE = 64 * 1024
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+CONTENT_HASH_NAME = re.compile(r"^([0-9a-f]{64})\.[a-z0-9]+$")
+RANGE_HEADER = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def strong_etag(path: str, stat_result: os.stat_result) -> str:
+    match = CONTENT_HASH_NAME.match(os.path.basename(path))
+    tag = match.group(1) if match else f"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}"
+    return f'"{tag}"'
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """(first, last) byte of a single `bytes=` range, None to send the whole file.
+
+    Raises 416 when the range is well formed but outside the file.
+    """
+    match = RANGE_HEADER.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        # Multiple or malformed ranges: ignoring Range is always allowed
+        return None
+    first, last = match.groups()
+    if first == "":
+        length = int(last)
+        if length == 0:
+            raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+
+class FileRangeResponse(Response):
+    """206 response carrying bytes [start, end] of a file"""
+
+    def __init__(self, path: str, start: int, end: int, size: int, headers: dict, media_type: str):
+        super().__init__(status_code=206, headers=headers, media_type=media_type)
+        self.path = path
+        self.start = start
+        self.length = end - start + 1
+        self.headers["content-range"] = f"bytes {start}-{end}/{size}"
+        self.headers["content-length"] = str(self.length)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"] == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        if "http.response.zerocopy" in scope.get("extensions", {}):
+            file = await anyio.to_thread.run_sync(open, self.path, "rb")
+            try:
+                await send({
+                    "type": "http.response.zerocopy",
+                    "file": file,
+                    "offset": self.start,
+                    "count": self.length,
+                    "more_body": False,
+                })
+            finally:
+                await anyio.to_thread.run_sync(file.close)
+            return
+
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            remaining = self.length
+            while remaining:
+                chunk = await file.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining:
+            # File shrank underneath us; close the body rather than hang
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+class ImmutableStaticFiles(StaticFiles):
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if scope["method"] not in ("GET", "HEAD"):
+            raise HTTPException(status_code=405)
+
+        request_headers = Headers(scope=scope)
+        try:
+            full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path)
+        except PermissionError:
+            raise HTTPException(status_code=401)
+        if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+            raise HTTPException(status_code=404)
+
+        etag = strong_etag(full_path, stat_result)
+        headers = {
+            "cache-control": IMMUTABLE_CACHE_CONTROL,
+            "etag": etag,
+            "last-modified": formatdate(stat_result.st_mtime, usegmt=True),
+            "accept-ranges": "bytes",
+        }
+
+        if self.is_not_modified(Headers(headers), request_headers):
+            return NotModifiedResponse(Headers(headers))
+
+        media_type = guess_type(path)[0] or "application/octet-stream"
+        range_header = request_headers.get("range")
+        if_range = request_headers.get("if-range")
+        if range_header and (if_range is None or if_range == etag):
+            byte_range = parse_range(range_header, stat_result.st_size)
+            if byte_range is not None:
+                return FileRangeResponse(full_path, *byte_range, stat_result.st_size, headers, media_type)
+
+        return FileResponse(full_path, stat_result=stat_result, headers=headers, media_type=media_type)
@@ -0,0 +1,314 @@
+"""Materialized dashboard statistics.
+
+Order counters and revenue totals are kept in the `stats` collection (one
+`totals` document plus one document per UTC day in `stats_daily`) and updated
+with `$inc` as orders are created, change status or get paid, so the admin
+dashboard never scans the `orders` collection. `rebuild` recomputes
+everything from scratch when the materialized state is missing or suspected
+to be off.
+
+A rebuild runs while orders keep coming in. It takes a lease in `meta`
+(one rebuild at a time, across workers) and, while that lease is live,
+writers don't `$inc` the counters. Instead they tag each order they touch
+with a `stats_rebuild` field holding the order's state before its first
+change (`base`) and its latest state (`last`), so the scan counts every
+tagged order at its `base`. The new daily documents are written to a
+temporary collection and renamed over `stats_daily`. Once the lease is
+released, the `last - base` difference of every tagged order is applied on
+top and the tags are removed.
+"""
+import asyncio
+import logging
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+TOTALS_ID = "totals"
+REBUILD_ID = "stats_rebuild"
+REBUILD_LEASE_SECONDS = 3600
+# How long a writer may take between checking for a rebuild and writing its
+# update; the rebuild waits this long after taking and after releasing the lease
+REBUILD_SETTLE_SECONDS = 2.0
+
+
+def _day(order: dict) -> str:
+    created_at = order.get("created_at") or datetime.utcnow()
+    return created_at.strftime("%Y-%m-%d")
+
+
+def _status_inc(status: str, count: int, revenue: float) -> dict:
+    return {f"by_status.{status}.count": count, f"by_status.{status}.revenue": revenue}
+
+
+def _state(order: dict) -> dict:
+    """The fields of an order that the counters depend on"""
+    return {"status": order.get("status") or "pending", "paid": order.get("paid") is True, "total": order.get("total", 0)}
+
+
+def _contribution(state: Optional[dict], sign: int) -> dict:
+    if state is None:
+        return {}
+    total = state.get("total", 0) * sign
+    inc = {"orders": sign, "revenue": total, **_status_inc(state.get("status", "pending"), sign, total)}
+    if state.get("paid"):
+        inc.update({"paid_orders": sign, "paid_revenue": total})
+    return inc
+
+
+def _add(into: dict, inc: dict):
+    for key, value in inc.items():
+        into[key] = into.get(key, 0) + value
+
+
+class RebuildInProgress(RuntimeError):
+    pass
+
+
+class StatsEngine:
+    def __init__(self, db, settle_seconds: float = REBUILD_SETTLE_SECONDS):
+        self.db = db
+        self.settle_seconds = settle_seconds
+
+    async def rebuild_token(self) -> Optional[str]:
+        """Token of the rebuild in progress, if any"""
+        marker = await self.db.meta.find_one({"_id": REBUILD_ID, "expires_at": {"$gt": datetime.utcnow()}})
+        return marker["token"] if marker else None
+
+    async def track_change(self, order_id: str) -> Optional[str]:
+        """Call before changing an order's status or paid flag.
+
+        If a rebuild is running, tags the order with its current state (once
+        per rebuild) and returns the rebuild token, which the caller passes
+        to `tracked_fields` and to the `record_*` method.
+        """
+        token = await self.rebuild_token()
+        if token is None:
+            return None
+        while True:
+            order = await self.db.orders.find_one(
+                {"id": order_id}, {"_id": 0, "status": 1, "paid": 1, "total": 1, REBUILD_ID: 1}
+            )
+            if order is None or (order.get(REBUILD_ID) or {}).get("token") == token:
+                return token
+            state = _state(order)
+            # Only tag the state we read; a concurrent change means reading again
+            result = await self.db.orders.update_one(
+                {
+                    "id": order_id,
+                    "status": order.get("status"),
+                    "paid": order.get("paid"),
+                    f"{REBUILD_ID}.token": {"$ne": token},
+                },
+                {"$set": {REBUILD_ID: {"token": token, "base": state, "last": state}}}
+            )
+            if result.matched_count:
+                return token
+
+    @staticmethod
+    def new_order_fields(token: Optional[str], order: dict) -> dict:
+        """Fields that tag an order created during a rebuild (`token` from `rebuild_token`)"""
+        if token is None:
+            return {}
+        return {REBUILD_ID: {"token": token, "base": None, "last": _state(order)}}
+
+    @staticmethod
+    def tracked_fields(token: Optional[str], **changes) -> dict:
+        """`$set` fields that keep a tagged order's latest state next to the change itself"""
+        if token is None:
+            return {}
+        return {f"{REBUILD_ID}.last.{field}": value for field, value in changes.items()}
+
+    async def _inc(self, order: dict, inc: dict, token: Optional[str] = None):
+        if token:
+            # Tagged order: the rebuild applies the change when it finishes
+            return
+        await asyncio.gather(
+            self.db.stats.update_one({"_id": TOTALS_ID}, {"$inc": inc}, upsert=True),
+            self.db.stats_daily.update_one({"_id": _day(order)}, {"$inc": inc}, upsert=True),
+        )
+
+    async def record_order_created(self, order: dict, token: Optional[str] = None):
+        total = order.get("total", 0)
+        status = order.get("status", "pending")
+        await self._inc(order, {"orders": 1, "revenue": total, **_status_inc(status, 1, total)}, token)
+
+    async def record_status_change(self, order: dict, old_status: str, new_status: str, token: Optional[str] = None):
+        """`order` is the document before the change"""
+        if old_status == new_status:
+            return
+        total = order.get("total", 0)
+        await self._inc(order, {**_status_inc(old_status, -1, -total), **_status_inc(new_status, 1, total)}, token)
+
+    async def record_paid(self, order: dict, new_status: str, token: Optional[str] = None):
+        """`order` is the document before it was marked paid"""
+        total = order.get("total", 0)
+        inc = {"paid_orders": 1, "paid_revenue": total}
+        old_status = order.get("status", "pending")
+        if old_status != new_status:
+            inc.update(_status_inc(old_status, -1, -total))
+            inc.update(_status_inc(new_status, 1, total))
+        await self._inc(order, inc, token)
+
+    async def rebuild(self):
+        """Recompute the materialized state from the orders collection.
+
+        Raises RebuildInProgress if another rebuild holds the lease.
+        """
+        token = uuid.uuid4().hex
+        now = datetime.utcnow()
+        try:
+            # Matches only an expired lease; a live one makes the upsert collide on _id
+            await self.db.meta.update_one(
+                {"_id": REBUILD_ID, "expires_at": {"$lt": now}},
+                {"$set": {"token": token, "started_at": now, "expires_at": now + timedelta(seconds=REBUILD_LEASE_SECONDS)}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            raise RebuildInProgress("Dashboard stats are already being rebuilt")
+
+        try:
+            # Writers that missed the lease finish their $inc on the old documents
+            await asyncio.sleep(self.settle_seconds)
+            totals = await self._recompute(token)
+        finally:
+            await self.db.meta.delete_one({"_id": REBUILD_ID, "token": token})
+            # Writers that saw the lease finish tagging their orders
+            await asyncio.sleep(self.settle_seconds)
+            # Also runs when the recompute failed: the changes still belong on the old counters
+            replayed = await self._replay(token)
+        logger.info(f"Dashboard stats rebuilt from {totals['orders']} orders, {replayed} changed during the rebuild")
+        return await self.db.stats.find_one({"_id": TOTALS_ID})
+
+    async def _recompute(self, token: str) -> dict:
+        # Orders tagged by this rebuild are counted as they were before their first change
+        state = {"$cond": [
+            {"$eq": [f"${REBUILD_ID}.token", token]},
+            f"${REBUILD_ID}.base",
+            {"status": {"$ifNull": ["$status", "pending"]}, "paid": {"$eq": ["$paid", True]}, "total": "$total"},
+        ]}
+        pipeline = [
+            {"$project": {"created_at": 1, "state": state}},
+            {"$match": {"state": {"$ne": None}}},
+            {"$group": {
+                "_id": {
+                    "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}},
+                    "status": "$state.status",
+                    "paid": "$state.paid",
+                },
+                "count": {"$sum": 1},
+                "revenue": {"$sum": "$state.total"},
+            }}
+        ]
+        rows = await self.db.orders.aggregate(pipeline).to_list(None)
+
+        totals: dict = {"_id": TOTALS_ID, "orders": 0, "revenue": 0, "paid_orders": 0, "paid_revenue": 0, "by_status": {}}
+        days: dict = {}
+        for row in rows:
+            key, count, revenue = row["_id"], row["count"], row["revenue"]
+            day = days.setdefault(key["day"], {
+                "_id": key["day"], "orders": 0, "revenue": 0, "paid_orders": 0, "paid_revenue": 0, "by_status": {}
+            })
+            for doc in (totals, day):
+                doc["orders"] += count
+                doc["revenue"] += revenue
+                if key.get("paid"):
+                    doc["paid_orders"] += count
+                    doc["paid_revenue"] += revenue
+                status = doc["by_status"].setdefault(key["status"], {"count": 0, "revenue": 0})
+                status["count"] += count
+                status["revenue"] += revenue
+
+        # Swap the new days in with a rename, so live upserts never collide with the insert
+        staging = self.db[f"stats_daily_rebuild_{token}"]
+        try:
+            if days:
+                await staging.insert_many(list(days.values()), ordered=False)
+                await staging.rename("stats_daily", dropTarget=True)
+            else:
+                await self.db.stats_daily.drop()
+        except BaseException:
+            await staging.drop()
+            raise
+        await self.db.stats.replace_one({"_id": TOTALS_ID}, totals, upsert=True)
+        return totals
+
+    async def _replay(self, token: str) -> int:
+        """Apply the changes tagged orders went through during the rebuild, then untag them"""
+        totals: dict = {}
+        days: Dict[str, dict] = defaultdict(dict)
+        count = 0
+        async for order in self.db.orders.find({f"{REBUILD_ID}.token": token}, {"_id": 0, "created_at": 1, REBUILD_ID: 1}):
+            tag = order[REBUILD_ID]
+            for inc in (_contribution(tag.get("last"), 1), _contribution(tag.get("base"), -1)):
+                _add(totals, inc)
+                _add(days[_day(order)], inc)
+            count += 1
+
+        writes = [(self.db.stats_daily, day, inc) for day, inc in days.items()] + [(self.db.stats, TOTALS_ID, totals)]
+        await asyncio.gather(*(
+            collection.update_one({"_id": _id}, {"$inc": {k: v for k, v in inc.items() if v}}, upsert=True)
+            for collection, _id, inc in writes
+            if any(inc.values())
+        ))
+        await self.db.orders.update_many({f"{REBUILD_ID}.token": token}, {"$unset": {REBUILD_ID: ""}})
+        return count
+
+    async def ensure_built(self):
+        """Build the materialized state if it doesn't exist yet (first deploy)"""
+        if await self.db.stats.find_one({"_id": TOTALS_ID}, {"_id": 1}) is None:
+            try:
+                await self.rebuild()
+            except RebuildInProgress:
+                pass
+
+    async def dashboard(self, days: int = 30, rebuild: bool = False) -> dict:
+        if rebuild:
+            totals = await self.rebuild()
+        else:
+            totals = await self.db.stats.find_one({"_id": TOTALS_ID})
+            if totals is None:
+                totals = await self.rebuild()
+
+        since = (datetime.utcnow() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        products, categories, users, recent_orders, daily = await asyncio.gather(
+            self.db.products.estimated_document_count(),
+            self.db.categories.estimated_document_count(),
+            self.db.users.estimated_document_count(),
+            self.db.orders.find({}, {"_id": 0}).sort("created_at", -1).limit(5).to_list(5),
+            self.db.stats_daily.find({"_id": {"$gte": since}}).sort("_id", 1).to_list(days),
+        )
+
+        return {
+            "products": products,
+            "categories": categories,
+            "orders": totals.get("orders", 0),
+            "users": users,
+            "total_revenue": round(totals.get("revenue", 0), 2),
+            "paid_orders": totals.get("paid_orders", 0),
+            "paid_revenue": round(totals.get("paid_revenue", 0), 2),
+            "revenue_by_status": _rounded_statuses(totals.get("by_status", {})),
+            "revenue_by_day": [
+                {
+                    "date": d["_id"],
+                    "orders": d.get("orders", 0),
+                    "revenue": round(d.get("revenue", 0), 2),
+                    "paid_revenue": round(d.get("paid_revenue", 0), 2),
+                    "by_status": _rounded_statuses(d.get("by_status", {})),
+                }
+                for d in daily
+            ],
+            "recent_orders": recent_orders,
+        }
+
+
+def _rounded_statuses(by_status: Optional[dict]) -> dict:
+    return {
+        status: {"count": v.get("count", 0), "revenue": round(v.get("revenue", 0), 2)}
+        for status, v in (by_status or {}).items()
+        if v.get("count", 0)
+    }
@@ -0,0 +1,455 @@
+"""Streaming, content-addressed image upload storage.
+
+Uploads are copied from the request in CHUNK_SIZE pieces to a temp file, with
+every blocking file operation running in the thread pool so the event loop
+keeps serving other requests. The copy stops as soon as `max_size` is
+exceeded, the first bytes must carry a real JPEG/PNG/WebP signature, and the
+finished file is moved into place with an atomic rename, so a partially
+written image is never visible under its final name.
+
+Files are stored by the sha256 of their bytes under two levels of shard
+directories (`ab/cd/abcd....jpg`), so identical uploads share one file and
+one immutable URL. The `uploads` collection indexes every stored file.
+References aren't stored there: any product, category, hero slide, review or
+order write can change them, so `collect_garbage` counts them when it runs
+and deletes files (and their derivatives) that nothing points at any more
+and that weren't uploaded within the grace period. Run it with
+`python uploads.py gc [--dry-run]`.
+
+GC and uploads of the same bytes can overlap: an upload records itself
+(clearing any GC claim) before its file is committed, and GC claims each
+file in the index, moves it into `.trash` and only deletes it if its claim
+survived; otherwise the file is put back.
+
+Everything that touches the files (the API, the CLIs, the benchmarks) finds
+them through `uploads_dir()`: UPLOADS_DIR if set, else `backend/uploads`.
+
+`UploadSizeLimit` rejects requests whose declared Content-Length is already
+over the limit before the multipart body is parsed and spooled at all, and
+counts the bytes of bodies without one (chunked, or a lying header) as they
+arrive, answering 413 as soon as they go over.
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import shutil
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+from typing import List, NamedTuple, Optional
+
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+from starlette.concurrency import run_in_threadpool
+
+from images import DERIVATIVE_NAME
+
+CHUNK_SIZE = 64 * 1024
+
+# Allowance for multipart boundaries and part headers around the file
+MULTIPART_OVERHEAD = 64 * 1024
+
+# Canonical extension for each sniffed type
+IMAGE_EXTENSIONS = {"jpeg": ".jpg", "png": ".png", "webp": ".webp"}
+
+UPLOADS_URL_PATH = "/api/uploads/"
+DEFAULT_UPLOADS_DIR = Path(__file__).parent / "uploads"
+
+# Unreferenced files younger than this are kept: an admin may have uploaded
+# an image for a product form that hasn't been saved yet
+GC_GRACE_SECONDS = 24 * 3600
+
+# Where stored uploads can be referenced from: collection -> URL fields
+REFERENCE_FIELDS = {
+    "products": ["images"],
+    "categories": ["image"],
+    "hero_slides": ["image"],
+    "reviews": ["images"],
+    "orders": ["items.image"],
+}
+
+
+class StoredUpload(NamedTuple):
+    filename: str
+    sha256: str
+    size: int
+    image_type: str
+    created: bool
+
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Image type from the file signature, None if it isn't JPEG, PNG or WebP"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def _discard(path: Path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def content_path(sha256: str, extension: str) -> str:
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}"
+
+
+def _write_chunk(out, digest, chunk: bytes):
+    out.write(chunk)
+    digest.update(chunk)
+
+
+def _commit(tmp_path: Path, target: Path) -> bool:
+    """Move the temp file to `target`; False if identical content was already stored"""
+    if target.exists():
+        _discard(tmp_path)
+        # Refresh mtime so a re-upload restarts the GC grace period
+        os.utime(target)
+        return False
+    target.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(tmp_path, target)
+    return True
+
+
+async def save_upload(db, file: UploadFile, directory: Path, max_size: int) -> StoredUpload:
+    """Stream `file` into `directory` under its content hash and index it in `uploads`"""
+    tmp_dir = directory / ".incoming"
+    tmp_dir.mkdir(exist_ok=True)
+    tmp_path = tmp_dir / uuid.uuid4().hex
+    out = await run_in_threadpool(open, tmp_path, "wb")
+    try:
+        size = 0
+        image_type = None
+        digest = hashlib.sha256()
+        while True:
+            chunk = await file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            if image_type is None:
+                image_type = sniff_image_type(chunk)
+                if image_type is None:
+                    raise HTTPException(status_code=400, detail="File is not a JPEG, PNG or WebP image")
+            size += len(chunk)
+            if size > max_size:
+                raise HTTPException(status_code=400, detail=f"File too large. Max {max_size // (1024 * 1024)}MB allowed.")
+            await run_in_threadpool(_write_chunk, out, digest, chunk)
+        if image_type is None:
+            raise HTTPException(status_code=400, detail="Empty file")
+        await run_in_threadpool(out.close)
+
+        sha256 = digest.hexdigest()
+        filename = content_path(sha256, IMAGE_EXTENSIONS[image_type])
+        # Recorded first, so a garbage collection deleting these bytes right now backs off
+        await record_upload(db, filename, sha256, size, image_type)
+        created = await run_in_threadpool(_commit, tmp_path, directory / filename)
+        return StoredUpload(filename, sha256, size, image_type, created)
+    except BaseException:
+        await run_in_threadpool(out.close)
+        await run_in_threadpool(_discard, tmp_path)
+        raise
+
+
+async def record_upload(db, filename: str, sha256: str, size: int, image_type: str):
+    """Index a stored file in the `uploads` collection, revoking any GC claim on it"""
+    now = datetime.utcnow()
+    await db.uploads.update_one(
+        {"id": filename},
+        {
+            "$setOnInsert": {"sha256": sha256, "size": size, "type": image_type, "created_at": now},
+            "$set": {"last_uploaded_at": now},
+            "$unset": {"gc_claim": ""},
+        },
+        upsert=True
+    )
+
+
+def upload_name(url: str) -> Optional[str]:
+    """Stored filename a URL points at, None if it isn't one of ours"""
+    if not isinstance(url, str) or UPLOADS_URL_PATH not in url:
+        return None
+    return url.split(UPLOADS_URL_PATH, 1)[1].split("?", 1)[0].split("#", 1)[0]
+
+
+async def attach_image_widths(db, docs: List[dict], field: str = "images") -> List[dict]:
+    """Add `image_widths` ({stored filename: WebP widths}) to docs whose uploaded images have derivatives"""
+    names = {upload_name(url) for doc in docs for url in doc.get(field) or []}
+    names.discard(None)
+    if not names:
+        return docs
+    ready = {
+        upload["id"]: upload["derivatives"]["webp"]
+        async for upload in db.uploads.find(
+            {"id": {"$in": list(names)}, "derivatives.webp": {"$exists": True}},
+            {"_id": 0, "id": 1, "derivatives.webp": 1}
+        )
+    }
+    for doc in docs:
+        widths = {name: ready[name] for name in map(upload_name, doc.get(field) or []) if name in ready}
+        if widths:
+            doc["image_widths"] = widths
+    return docs
+
+
+def _values(doc, dotted: str):
+    """Every value at a dotted path, descending into lists"""
+    values = [doc]
+    for part in dotted.split("."):
+        found = []
+        for value in values:
+            if isinstance(value, list):
+                found.extend(v.get(part) for v in value if isinstance(v, dict))
+            elif isinstance(value, dict):
+                found.append(value.get(part))
+        values = found
+    for value in values:
+        if isinstance(value, list):
+            yield from value
+        elif value is not None:
+            yield value
+
+
+async def count_references(db) -> Counter:
+    refs: Counter = Counter()
+    for collection, fields in REFERENCE_FIELDS.items():
+        projection = {"_id": 0, **{field: 1 for field in fields}}
+        async for doc in db[collection].find({}, projection):
+            for field in fields:
+                for url in _values(doc, field):
+                    name = upload_name(url)
+                    if name:
+                        refs[name] += 1
+    return refs
+
+
+def _stored_files(directory: Path) -> dict:
+    """Original uploads under `directory` -> (mtime, size, derivative paths)"""
+    originals, derivatives = {}, {}
+    for path in directory.rglob("*"):
+        relative = path.relative_to(directory).as_posix()
+        if relative.startswith(".") or "/." in relative or not path.is_file():
+            continue
+        match = DERIVATIVE_NAME.search(path.name)
+        if match:
+            derivatives.setdefault((path.parent, path.name[:match.start()]), []).append(path)
+        else:
+            originals[relative] = path
+    files = {}
+    for relative, path in originals.items():
+        stat = path.stat()
+        stem = path.name.rsplit(".", 1)[0]
+        files[relative] = (stat.st_mtime, stat.st_size, derivatives.get((path.parent, stem), []))
+    return files
+
+
+def _trash(directory: Path, trash: Path, path: Path, derivatives, cutoff: float) -> list:
+    """Move `path` and its derivatives to `trash`; [] if it was re-uploaded since the scan"""
+    try:
+        if path.stat().st_mtime >= cutoff:
+            return []
+    except FileNotFoundError:
+        return []
+    moved = []
+    for p in [path, *derivatives]:
+        target = trash / p.relative_to(directory)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.replace(p, target)
+        except FileNotFoundError:
+            continue
+        moved.append((p, target))
+    return moved
+
+
+def _restore(moved: list):
+    """Put trashed files back, unless an upload already wrote them again"""
+    for original, trashed in moved:
+        if original.exists():
+            _discard(trashed)
+        else:
+            original.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(trashed, original)
+
+
+def _purge(directory: Path, moved: list) -> int:
+    freed = 0
+    for original, trashed in moved:
+        try:
+            freed += trashed.stat().st_size
+            trashed.unlink()
+        except FileNotFoundError:
+            pass
+    # Drop shard directories left empty
+    parent = moved[0][0].parent if moved else directory
+    while parent != directory:
+        try:
+            parent.rmdir()
+        except OSError:
+            break
+        parent = parent.parent
+    return freed
+
+
+def _empty_trash(trash: Path):
+    shutil.rmtree(trash, ignore_errors=True)
+    try:
+        trash.parent.rmdir()
+    except OSError:
+        pass  # another collection's trash is still in use
+
+
+async def _claim(db, name: str, claim: str, cutoff: datetime) -> bool:
+    """Mark `name` as being collected, unless it was uploaded after `cutoff`"""
+    try:
+        # An upload since the cutoff makes the upsert collide on the unique id
+        await db.uploads.update_one(
+            {"id": name, "$nor": [{"last_uploaded_at": {"$gte": cutoff}}]},
+            {"$set": {"gc_claim": claim}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+async def collect_garbage(db, directory: Path, grace_seconds: float = GC_GRACE_SECONDS, dry_run: bool = False) -> dict:
+    """Delete unreferenced files past the grace period and index the rest"""
+    refs = await count_references(db)
+    files = await run_in_threadpool(_stored_files, directory)
+    cutoff = time.time() - grace_seconds
+    candidates = [name for name, (mtime, _, _) in files.items() if refs[name] == 0 and mtime < cutoff]
+
+    deleted, freed = [], 0
+    if dry_run:
+        deleted = candidates
+    elif candidates:
+        claim = uuid.uuid4().hex
+        claimed = [name for name in candidates if await _claim(db, name, claim, datetime.utcfromtimestamp(cutoff))]
+        # Anything saved to point at a candidate while the first count ran keeps it
+        refs = await count_references(db)
+        released = [name for name in claimed if refs[name]]
+        if released:
+            await db.uploads.update_many({"id": {"$in": released}, "gc_claim": claim}, {"$unset": {"gc_claim": ""}})
+        trash = directory / ".trash" / claim
+        for name in claimed:
+            if refs[name]:
+                continue
+            moved = await run_in_threadpool(_trash, directory, trash, directory / name, files[name][2], cutoff)
+            if not moved:
+                await db.uploads.update_one({"id": name, "gc_claim": claim}, {"$unset": {"gc_claim": ""}})
+                continue
+            result = await db.uploads.delete_one({"id": name, "gc_claim": claim})
+            if result.deleted_count:
+                deleted.append(name)
+                freed += await run_in_threadpool(_purge, directory, moved)
+            else:
+                # Uploaded again while it was being moved
+                await run_in_threadpool(_restore, moved)
+        await run_in_threadpool(_empty_trash, trash)
+
+    kept = [UpdateOne({"id": name}, {"$set": {"size": size}, "$unset": {"refs": ""}}, upsert=True)
+            for name, (_, size, _) in files.items() if name not in deleted]
+    if kept and not dry_run:
+        await db.uploads.bulk_write(kept, ordered=False)
+    return {
+        "files": len(files),
+        "referenced": sum(1 for name in files if refs[name]),
+        "deleted": deleted,
+        "freed_bytes": freed,
+        "missing": sorted(name for name in refs if name not in files),
+        "dry_run": dry_run,
+    }
+
+
+def uploads_dir() -> Path:
+    """Where uploads are stored: UPLOADS_DIR, or `uploads` next to this file"""
+    return Path(os.environ.get("UPLOADS_DIR") or DEFAULT_UPLOADS_DIR)
+
+
+class UploadSizeLimit:
+    """ASGI middleware answering 413 for oversized bodies sent to `paths`"""
+
+    def __init__(self, app, paths, max_size: int):
+        self.app = app
+        self.paths = set(paths)
+        self.max_size = max_size
+        self.max_body = max_size + MULTIPART_OVERHEAD
+        self.detail = f"File too large. Max {max_size // (1024 * 1024)}MB allowed."
+
+    async def _reject(self, scope, receive, send):
+        await JSONResponse(status_code=413, content={"detail": self.detail})(scope, receive, send)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        length = dict(scope["headers"]).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > self.max_body:
+            await self._reject(scope, receive, send)
+            return
+
+        received = 0
+        response_started = False
+
+        async def receive_counted():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body:
+                    # Raised inside the handler's body parsing, so FastAPI turns it into the 413
+                    raise HTTPException(status_code=413, detail=self.detail)
+            return message
+
+        async def send_tracked(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive_counted, send_tracked)
+        except HTTPException as error:
+            # Only reaches here when the body was read outside a route
+            if error.status_code != 413 or response_started:
+                raise
+            await self._reject(scope, receive, send)
+
+
+async def _main(args):
+    from dotenv import load_dotenv
+    from database import create_client, database_name
+
+    root_dir = Path(__file__).parent
+    load_dotenv(root_dir / '.env')
+    client = create_client()
+    db = client[database_name()]
+    try:
+        result = await collect_garbage(db, uploads_dir(), args.grace_hours * 3600, args.dry_run)
+    finally:
+        client.close()
+    action = "Would delete" if args.dry_run else "Deleted"
+    for name in result["deleted"]:
+        print(f"{action} {name}")
+    print(f"{action} {len(result['deleted'])} of {result['files']} files, freed {result['freed_bytes']} bytes")
+    for name in result["missing"]:
+        print(f"Referenced but missing: {name}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Upload storage maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    gc = commands.add_parser("gc", help="delete uploads nothing references any more")
+    gc.add_argument("--dry-run", action="store_true", help="only list what would be deleted")
+    gc.add_argument("--grace-hours", type=float, default=GC_GRACE_SECONDS / 3600)
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,161 @@
+"""Durable queue for payment provider webhooks.
+
+The webhook endpoint only verifies the event and inserts it into the
+`webhook_events` collection, keyed by the provider's event id, so a redelivered
+event is a duplicate-key no-op. A pool of background workers claims pending
+events in batches, hands each batch to a handler and marks it done. A claim is
+a lease: events from a worker that died mid-batch become claimable again after
+`lease` seconds. Failed batches are retried with backoff up to `max_attempts`.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List
+
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+PROCESSING = "processing"
+DONE = "done"
+FAILED = "failed"
+
+
+class WebhookQueue:
+    def __init__(
+        self,
+        db,
+        handler: Callable[[List[dict]], Awaitable[None]],
+        workers: int = 2,
+        batch_size: int = 100,
+        poll_interval: float = 1.0,
+        lease: float = 60.0,
+        max_attempts: int = 5,
+    ):
+        self.collection = db.webhook_events
+        self.handler = handler
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self.enqueued = 0
+        self.duplicates = 0
+        self.processed = 0
+        self.retried = 0
+        self.failed = 0
+        self.batches = 0
+
+    async def enqueue(self, event_id: str, event: dict) -> bool:
+        """Store an event for processing; False if it was already received"""
+        now = datetime.utcnow()
+        try:
+            await self.collection.insert_one({
+                "id": event_id,
+                "event": event,
+                "status": PENDING,
+                "attempts": 0,
+                "available_at": now,
+                "created_at": now,
+            })
+        except DuplicateKeyError:
+            self.duplicates += 1
+            return False
+        self.enqueued += 1
+        self._wakeup.set()
+        return True
+
+    async def _claim(self) -> List[dict]:
+        now = datetime.utcnow()
+        claimable = {"status": {"$in": [PENDING, PROCESSING]}, "available_at": {"$lte": now}}
+        candidates = await self.collection.find(claimable, {"_id": 0, "id": 1}).sort("available_at", 1).limit(self.batch_size).to_list(self.batch_size)
+        if not candidates:
+            return []
+
+        # Another worker may claim some of the candidates first; the token
+        # picks out exactly the ones this worker won
+        token = uuid.uuid4().hex
+        await self.collection.update_many(
+            {"id": {"$in": [c["id"] for c in candidates]}, **claimable},
+            {"$set": {"status": PROCESSING, "claim": token, "available_at": now + timedelta(seconds=self.lease)},
+             "$inc": {"attempts": 1}}
+        )
+        return await self.collection.find({"claim": token}, {"_id": 0}).to_list(self.batch_size)
+
+    async def _complete(self, events: List[dict]):
+        await self.collection.update_many(
+            {"id": {"$in": [e["id"] for e in events]}, "claim": events[0]["claim"]},
+            {"$set": {"status": DONE, "processed_at": datetime.utcnow()}, "$unset": {"claim": ""}}
+        )
+        self.processed += len(events)
+
+    async def _fail(self, events: List[dict], error: Exception):
+        now = datetime.utcnow()
+        for event in events:
+            attempts = event["attempts"]
+            if attempts >= self.max_attempts:
+                update = {"status": FAILED, "error": str(error)}
+                self.failed += 1
+            else:
+                backoff = min(self.poll_interval * 2 ** attempts, 300)
+                update = {"status": PENDING, "error": str(error), "available_at": now + timedelta(seconds=backoff)}
+                self.retried += 1
+            await self.collection.update_one({"id": event["id"], "claim": event["claim"]}, {"$set": update, "$unset": {"claim": ""}})
+
+    async def process_batch(self) -> int:
+        """Claim and handle one batch; returns how many events it contained"""
+        events = await self._claim()
+        if not events:
+            return 0
+        self.batches += 1
+        try:
+            await self.handler([e["event"] for e in events])
+        except Exception as e:
+            logger.error(f"Webhook batch of {len(events)} failed: {e}")
+            await self._fail(events, e)
+        else:
+            await self._complete(events)
+        return len(events)
+
+    async def _worker(self, number: int):
+        while True:
+            self._wakeup.clear()
+            try:
+                if await self.process_batch():
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Webhook worker {number} error: {e}")
+
+            # Idle: woken by a local enqueue, or poll for events received by other processes
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "batch_size": self.batch_size,
+            "enqueued": self.enqueued,
+            "duplicates": self.duplicates,
+            "processed": self.processed,
+            "retried": self.retried,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
@@ -3,19 +3,19 @@
 Debug MongoDB ObjectId serialization issue
 """
 import asyncio
-import os
-from motor.motor_asyncio import AsyncIOMotorClient
+import sys
 from dotenv import load_dotenv
 from pathlib import Path
 
 ROOT_DIR = Path(__file__).parent / "backend"
 load_dotenv(ROOT_DIR / '.env')
+sys.path.insert(0, str(ROOT_DIR))
+from database import create_client, database_name
 
 async def debug_mongo():
     # MongoDB connection
-    mongo_url = os.environ['MONGO_URL']
-    client = AsyncIOMotorClient(mongo_url)
-    db = client[os.environ.get('DB_NAME', 'ddebuut')]
+    client = create_client()
+    db = client[database_name()]
     
     print("🔍 Checking MongoDB data...")
     
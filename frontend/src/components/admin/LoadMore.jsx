@@ -0,0 +1,18 @@
+import React from 'react';
+
+const LoadMore = ({ hasMore, loading, onClick }) => {
+  if (!hasMore) return null;
+  return (
+    <div className="flex justify-center">
+      <button
+        onClick={onClick}
+        disabled={loading}
+        className="px-4 py-2 border rounded hover:bg-gray-50 disabled:opacity-50"
+      >
+        {loading ? 'Loading...' : 'Load more'}
+      </button>
+    </div>
+  );
+};
+
+export default LoadMore;
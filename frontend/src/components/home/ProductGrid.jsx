@@ -4,6 +4,7 @@ import { Search, ShoppingBag } from 'lucide-react';
 import { productsAPI } from '../../services/api';
 import { useCart } from '../../context/CartContext';
 import QuickViewModal from '../product/QuickViewModal';
+import { uploadSrcSet } from '../../lib/images';
 
 const ProductGrid = ({ title, category, limit }) => {
   const { addToCart } = useCart();
@@ -18,7 +19,7 @@ const ProductGrid = ({ title, category, limit }) => {
 
   const loadProducts = async () => {
     try {
-      const params = {};
+      const params = { with_total: false };
       if (category) params.category = category;
       if (limit) params.limit = limit;
       
@@ -75,6 +76,8 @@ const ProductGrid = ({ title, category, limit }) => {
               <div className="aspect-[4/5] bg-gray-50 overflow-hidden relative">
                 <img
                   src={hoveredProduct === product.id && product.images?.[1] ? product.images[1] : product.images?.[0]}
+                  srcSet={uploadSrcSet(hoveredProduct === product.id && product.images?.[1] ? product.images[1] : product.images?.[0], product.image_widths)}
+                  sizes="(min-width: 1280px) 17vw, (min-width: 1024px) 25vw, (min-width: 768px) 33vw, 50vw"
                   alt={product.name}
                   className="w-full h-full object-cover transition-all duration-500"
                 />
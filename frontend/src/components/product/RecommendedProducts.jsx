@@ -14,7 +14,7 @@ const RecommendedProducts = ({ currentProductId }) => {
 
   const loadRecommendations = async () => {
     try {
-      const response = await productsAPI.getAll({ limit: 10 });
+      const response = await productsAPI.getAll({ limit: 10, with_total: false });
       // Filter out current product
       const filtered = (response.data.products || [])
         .filter(p => p.id !== currentProductId);
@@ -17,7 +17,7 @@ const SearchModal = ({ isOpen, onClose }) => {
       
       setLoading(true);
       try {
-        const response = await productsAPI.getAll({ search: query, limit: 12 });
+        const response = await productsAPI.getAll({ search: query, limit: 12, with_total: false });
         setResults(response.data.products || []);
       } catch (error) {
         console.error('Search failed:', error);
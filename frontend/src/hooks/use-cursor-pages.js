@@ -0,0 +1,31 @@
+import { useCallback, useState } from 'react';
+
+// Keyset-paged admin lists: `fetchPage(params)` returns one page of rows and
+// the cursor of the next one in the X-Next-Cursor header.
+export function useCursorPages(fetchPage) {
+  const [items, setItems] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+
+  const reload = useCallback(async () => {
+    const response = await fetchPage();
+    setItems(response.data || []);
+    setNextCursor(response.headers['x-next-cursor'] || null);
+  }, [fetchPage]);
+
+  const loadMore = useCallback(async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const response = await fetchPage({ cursor: nextCursor });
+      setItems((current) => [...current, ...(response.data || [])]);
+      setNextCursor(response.headers['x-next-cursor'] || null);
+    } catch (error) {
+      console.error('Failed to load more:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  }, [fetchPage, nextCursor]);
+
+  return { items, hasMore: Boolean(nextCursor), loadingMore, reload, loadMore };
+}
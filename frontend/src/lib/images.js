@@ -0,0 +1,13 @@
+const UPLOADS_PATH = '/api/uploads/';
+
+// srcset of the resized WebP copies of an uploaded image, from the widths the
+// API lists in `imageWidths` ({stored filename: widths}) once they exist.
+// undefined for external URLs and uploads whose copies are pending or failed,
+// so the browser uses `src`
+export const uploadSrcSet = (url, imageWidths) => {
+  if (!url || !url.includes(UPLOADS_PATH)) return undefined;
+  const widths = imageWidths?.[url.split(UPLOADS_PATH)[1].split(/[?#]/)[0]];
+  if (!widths?.length) return undefined;
+  const stem = url.replace(/\.[^./]+$/, '');
+  return widths.map((width) => `${stem}-${width}w.webp ${width}w`).join(', ');
+};
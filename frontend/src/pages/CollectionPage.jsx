@@ -6,6 +6,7 @@ import AuthModal from '../components/auth/AuthModal';
 import QuickViewModal from '../components/product/QuickViewModal';
 import { productsAPI, categoriesAPI } from '../services/api';
 import { useCart } from '../context/CartContext';
+import { uploadSrcSet } from '../lib/images';
 import { Link } from 'react-router-dom';
 
 const CollectionPage = () => {
@@ -257,6 +258,13 @@ const CollectionPage = () => {
                           ? product.images[1]
                           : product.images?.[0]
                       }
+                      srcSet={uploadSrcSet(
+                        hoveredProduct === product.id && product.images?.[1]
+                          ? product.images[1]
+                          : product.images?.[0],
+                        product.image_widths
+                      )}
+                      sizes="(min-width: 1024px) 25vw, (min-width: 768px) 33vw, 50vw"
                       alt={product.name}
                       className="w-full h-full object-cover transition-all duration-500"
                     />
@@ -9,6 +9,7 @@ import ProductReviews from '../components/product/ProductReviews';
 import SizeChart from '../components/product/SizeChart';
 import PromoPopup from '../components/product/PromoPopup';
 import { productsAPI } from '../services/api';
+import { uploadSrcSet } from '../lib/images';
 import { useCart } from '../context/CartContext';
 
 const ProductPage = () => {
@@ -111,6 +112,8 @@ const ProductPage = () => {
             <div className="aspect-[4/5] bg-gray-50 mb-4 overflow-hidden">
               <img
                 src={product.images?.[currentImageIndex]}
+                srcSet={uploadSrcSet(product.images?.[currentImageIndex], product.image_widths)}
+                sizes="(min-width: 1024px) 50vw, 100vw"
                 alt={product.name}
                 className="w-full h-full object-cover"
               />
@@ -128,6 +131,8 @@ const ProductPage = () => {
                 >
                   <img
                     src={img}
+                    srcSet={uploadSrcSet(img, product.image_widths)}
+                    sizes="80px"
                     alt=""
                     className="w-full h-full object-cover"
                   />
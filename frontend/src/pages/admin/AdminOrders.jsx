@@ -1,10 +1,12 @@
 import React, { useState, useEffect } from 'react';
 import { Eye, ChevronDown } from 'lucide-react';
 import AdminLayout from '../../components/admin/AdminLayout';
+import LoadMore from '../../components/admin/LoadMore';
 import { adminAPI } from '../../services/api';
+import { useCursorPages } from '../../hooks/use-cursor-pages';
 
 const AdminOrders = () => {
-  const [orders, setOrders] = useState([]);
+  const { items: orders, hasMore, loadingMore, reload, loadMore } = useCursorPages(adminAPI.getOrders);
   const [loading, setLoading] = useState(true);
   const [selectedOrder, setSelectedOrder] = useState(null);
 
@@ -14,8 +16,7 @@ const AdminOrders = () => {
 
   const loadOrders = async () => {
     try {
-      const response = await adminAPI.getOrders();
-      setOrders(response.data);
+      await reload();
     } catch (error) {
       console.error('Failed to load orders:', error);
     } finally {
@@ -53,7 +54,7 @@ const AdminOrders = () => {
   return (
     <AdminLayout activeTab="orders">
       <div className="space-y-6">
-        <h1 className="text-2xl font-bold">Orders ({orders.length})</h1>
+        <h1 className="text-2xl font-bold">Orders ({orders.length}{hasMore ? '+' : ''})</h1>
 
         {/* Orders Table */}
         <div className="bg-white rounded-lg shadow overflow-hidden">
@@ -116,6 +117,8 @@ const AdminOrders = () => {
           </table>
         </div>
 
+        <LoadMore hasMore={hasMore} loading={loadingMore} onClick={loadMore} />
+
         {orders.length === 0 && (
           <div className="text-center py-12 text-gray-500">
             No orders yet
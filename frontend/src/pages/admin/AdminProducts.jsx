@@ -1,10 +1,12 @@
 import React, { useState, useEffect, useRef } from 'react';
 import { Plus, Edit, Trash2, X, Save, Upload, Link, Image } from 'lucide-react';
 import AdminLayout from '../../components/admin/AdminLayout';
+import LoadMore from '../../components/admin/LoadMore';
 import { adminAPI } from '../../services/api';
+import { useCursorPages } from '../../hooks/use-cursor-pages';
 
 const AdminProducts = () => {
-  const [products, setProducts] = useState([]);
+  const { items: products, hasMore, loadingMore, reload, loadMore } = useCursorPages(adminAPI.getProducts);
   const [categories, setCategories] = useState([]);
   const [loading, setLoading] = useState(true);
   const [showModal, setShowModal] = useState(false);
@@ -31,11 +33,10 @@ const AdminProducts = () => {
 
   const loadData = async () => {
     try {
-      const [productsRes, categoriesRes] = await Promise.all([
-        adminAPI.getProducts(),
+      const [, categoriesRes] = await Promise.all([
+        reload(),
         adminAPI.getCategories(),
       ]);
-      setProducts(productsRes.data);
       setCategories(categoriesRes.data);
     } catch (error) {
       console.error('Failed to load data:', error);
@@ -186,7 +187,7 @@ const AdminProducts = () => {
     <AdminLayout activeTab="products">
       <div className="space-y-6">
         <div className="flex items-center justify-between">
-          <h1 className="text-2xl font-bold">Products ({products.length})</h1>
+          <h1 className="text-2xl font-bold">Products ({products.length}{hasMore ? '+' : ''})</h1>
           <button
             onClick={handleCreate}
             className="flex items-center gap-2 px-4 py-2 bg-black text-white rounded hover:bg-gray-800 transition-colors"
@@ -251,6 +252,8 @@ const AdminProducts = () => {
             </tbody>
           </table>
         </div>
+
+        <LoadMore hasMore={hasMore} loading={loadingMore} onClick={loadMore} />
       </div>
 
       {/* Modal */}
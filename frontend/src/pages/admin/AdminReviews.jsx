@@ -1,10 +1,12 @@
 import React, { useState, useEffect } from 'react';
 import { Plus, Edit, Trash2, X, Save, Star, Upload, Image } from 'lucide-react';
 import AdminLayout from '../../components/admin/AdminLayout';
+import LoadMore from '../../components/admin/LoadMore';
 import { adminAPI } from '../../services/api';
+import { useCursorPages } from '../../hooks/use-cursor-pages';
 
 const AdminReviews = () => {
-  const [reviews, setReviews] = useState([]);
+  const { items: reviews, hasMore, loadingMore, reload, loadMore } = useCursorPages(adminAPI.getReviews);
   const [products, setProducts] = useState([]);
   const [loading, setLoading] = useState(true);
   const [showModal, setShowModal] = useState(false);
@@ -26,11 +28,10 @@ const AdminReviews = () => {
 
   const loadData = async () => {
     try {
-      const [reviewsRes, productsRes] = await Promise.all([
-        adminAPI.getReviews(),
-        adminAPI.getProducts()
+      const [, productsRes] = await Promise.all([
+        reload(),
+        adminAPI.getAllProducts()
       ]);
-      setReviews(reviewsRes.data || []);
       setProducts(productsRes.data || []);
     } catch (error) {
       console.error('Failed to load data:', error);
@@ -148,7 +149,7 @@ const AdminReviews = () => {
       <div className="space-y-6">
         <div className="flex items-center justify-between">
           <div>
-            <h1 className="text-2xl font-bold">Reviews ({reviews.length})</h1>
+            <h1 className="text-2xl font-bold">Reviews ({reviews.length}{hasMore ? '+' : ''})</h1>
             <p className="text-gray-500 text-sm mt-1">Manage product reviews</p>
           </div>
           <button
@@ -228,6 +229,8 @@ const AdminReviews = () => {
             </tbody>
           </table>
         </div>
+
+        <LoadMore hasMore={hasMore} loading={loadingMore} onClick={loadMore} />
       </div>
 
       {/* Modal */}
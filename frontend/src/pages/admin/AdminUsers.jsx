@@ -1,10 +1,12 @@
 import React, { useState, useEffect } from 'react';
 import { Shield, ShieldOff } from 'lucide-react';
 import AdminLayout from '../../components/admin/AdminLayout';
+import LoadMore from '../../components/admin/LoadMore';
 import { adminAPI } from '../../services/api';
+import { useCursorPages } from '../../hooks/use-cursor-pages';
 
 const AdminUsers = () => {
-  const [users, setUsers] = useState([]);
+  const { items: users, hasMore, loadingMore, reload, loadMore } = useCursorPages(adminAPI.getUsers);
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
@@ -13,8 +15,7 @@ const AdminUsers = () => {
 
   const loadUsers = async () => {
     try {
-      const response = await adminAPI.getUsers();
-      setUsers(response.data);
+      await reload();
     } catch (error) {
       console.error('Failed to load users:', error);
     } finally {
@@ -44,7 +45,7 @@ const AdminUsers = () => {
   return (
     <AdminLayout activeTab="users">
       <div className="space-y-6">
-        <h1 className="text-2xl font-bold">Users ({users.length})</h1>
+        <h1 className="text-2xl font-bold">Users ({users.length}{hasMore ? '+' : ''})</h1>
 
         {/* Users Table */}
         <div className="bg-white rounded-lg shadow overflow-hidden">
@@ -94,6 +95,8 @@ const AdminUsers = () => {
             </tbody>
           </table>
         </div>
+
+        <LoadMore hasMore={hasMore} loading={loadingMore} onClick={loadMore} />
       </div>
     </AdminLayout>
   );
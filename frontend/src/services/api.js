@@ -59,7 +59,18 @@ export const reviewsAPI = {
 // Admin API
 export const adminAPI = {
   // Products
-  getProducts: () => api.get('/admin/products'),
+  getProducts: (params) => api.get('/admin/products', { params }),
+  // Every product, following X-Next-Cursor (for pickers, not for tables)
+  getAllProducts: async () => {
+    const products = [];
+    let cursor;
+    do {
+      const response = await api.get('/admin/products', { params: { limit: 1000, cursor } });
+      products.push(...response.data);
+      cursor = response.headers['x-next-cursor'];
+    } while (cursor);
+    return { data: products };
+  },
   createProduct: (data) => api.post('/admin/products', data),
   updateProduct: (id, data) => api.put(`/admin/products/${id}`, data),
   deleteProduct: (id) => api.delete(`/admin/products/${id}`),
@@ -86,17 +97,17 @@ export const adminAPI = {
   deleteCategory: (id) => api.delete(`/admin/categories/${id}`),
   
   // Reviews (Fake Reviews Management)
-  getReviews: () => api.get('/admin/reviews'),
+  getReviews: (params) => api.get('/admin/reviews', { params }),
   createReview: (data) => api.post('/admin/reviews', data),
   updateReview: (id, data) => api.put(`/admin/reviews/${id}`, data),
   deleteReview: (id) => api.delete(`/admin/reviews/${id}`),
   
   // Orders
-  getOrders: () => api.get('/admin/orders'),
+  getOrders: (params) => api.get('/admin/orders', { params }),
   updateOrderStatus: (id, status) => api.put(`/admin/orders/${id}/status`, { status }),
   
   // Users
-  getUsers: () => api.get('/admin/users'),
+  getUsers: (params) => api.get('/admin/users', { params }),
   toggleAdmin: (id) => api.put(`/admin/users/${id}/admin`),
   
   // Stats
@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import bootstrap
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_waiting_worker_takes_over_an_expired_lease(db, monkeypatch):
+    runs = []
+
+    async def fake_bootstrap(db):
+        runs.append(await db.meta.find_one({"_id": bootstrap.LOCK_ID}))
+
+    monkeypatch.setattr(bootstrap, "bootstrap", fake_bootstrap)
+    # Left behind by a worker that died mid-bootstrap; expires while we wait
+    await db.meta.insert_one({
+        "_id": bootstrap.LOCK_ID,
+        "owner": "dead",
+        "expires_at": datetime.utcnow() + timedelta(milliseconds=50),
+    })
+
+    await bootstrap.ensure_schema(db, poll_interval=0.02)
+
+    assert len(runs) == 1 and runs[0]["owner"] != "dead"
+    assert await db.meta.find_one({"_id": bootstrap.LOCK_ID}) is None
+
+
+async def test_failed_indexes_keep_the_marker_stale(db, monkeypatch):
+    async def noop(db):
+        pass
+
+    monkeypatch.setattr(bootstrap, "MIGRATIONS", [(bootstrap.SCHEMA_VERSION, "noop", noop)])
+    await db.users.insert_many([{"id": "u1", "email": "a@test"}, {"id": "u2", "email": "a@test"}])
+
+    marker = await bootstrap.bootstrap(db)
+    assert not bootstrap.is_current(marker)
+    assert "indexes" not in marker
+    assert "users.email_1" in bootstrap.describe(marker)
+
+    await db.users.delete_one({"id": "u2"})
+    marker = await bootstrap.bootstrap(db)
+    assert bootstrap.is_current(marker)
+    assert "index_problems" not in marker
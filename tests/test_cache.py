@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from cache import TTLCache
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_concurrent_misses_share_one_load():
+    cache = TTLCache("test")
+    calls = 0
+
+    async def load():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "value"
+
+    results = await asyncio.gather(*[cache.get_or_load("key", load) for _ in range(10)])
+    assert results == ["value"] * 10
+    assert calls == 1
+    assert await cache.get_or_load("key", load) == "value" and calls == 1
+
+
+async def test_load_racing_an_invalidate_is_not_stored():
+    cache = TTLCache("test")
+    loading = asyncio.Event()
+
+    async def load():
+        loading.set()
+        await asyncio.sleep(0.01)
+        return "stale"
+
+    task = asyncio.create_task(cache.get_or_load("key", load))
+    await loading.wait()
+    cache.invalidate("key")
+    assert await task == "stale"
+    assert cache.get("key") is None
+
+
+async def test_failed_load_reaches_every_waiter_and_is_retried():
+    cache = TTLCache("test")
+    calls = 0
+
+    async def load():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        if calls == 1:
+            raise RuntimeError("mongo down")
+        return "value"
+
+    results = await asyncio.gather(*[cache.get_or_load("key", load) for _ in range(3)], return_exceptions=True)
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert await cache.get_or_load("key", load) == "value"
+    assert calls == 2
+
+
+def test_entries_expire_and_the_least_recently_used_is_evicted():
+    cache = TTLCache("test", maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+    assert cache.evictions == 1
+
+    cache.set("d", 4, ttl=-1)
+    assert cache.get("d") is None
+
+
+def test_invalidate_by_prefix():
+    cache = TTLCache("test")
+    cache.set("category:a", 1)
+    cache.set("category:b", 2)
+    cache.set("categories", 3)
+    cache.invalidate("categories", prefix="category:")
+    assert len(cache) == 0
@@ -0,0 +1,130 @@
+import pytest
+
+from http_cache import CHANGE_LOG_SIZE, CatalogCacheMiddleware, CollectionVersions
+from search import ProductSearchIndex
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_new_version_waits_for_the_search_index(db):
+    await db.products.insert_one({"id": "p1", "name": "Denim jacket"})
+    index = ProductSearchIndex()
+    await index.rebuild(db)
+    versions = CollectionVersions(db, ["products"])
+    await versions.start()
+    before = versions.get("products")
+    seen = []
+
+    def on_change(collection, ids):
+        seen.append((collection, ids, versions.get(collection), index.search("hoodie")))
+        return index.maybe_refresh(db, force=True)
+
+    versions.on_change(on_change)
+    # Another worker adds a product and bumps the counter
+    await db.products.insert_one({"id": "p2", "name": "Black hoodie"})
+    await db.cache_versions.update_one({"_id": "products"}, {"$inc": {"version": 1}})
+    await versions.sync()
+
+    # A bump without a change log entry can't say what changed
+    assert seen == [("products", None, before, [])]
+    assert versions.get("products") == before + 1
+    assert index.search("hoodie") == ["p2"]
+
+
+async def test_other_workers_apply_just_the_logged_changes(db):
+    await db.categories.insert_one({"id": "c1", "name": "Tops"})
+    await db.products.insert_many([
+        {"id": "p1", "name": "Denim jacket", "category_id": "c1"},
+        {"id": "p2", "name": "Black hoodie", "category_id": "c1"},
+    ])
+    index = ProductSearchIndex()
+    await index.rebuild(db)
+    built_at = index.built_at
+    versions = CollectionVersions(db, ["products", "categories"])
+    await versions.start()
+    seen = []
+
+    def on_change(collection, ids):
+        seen.append((collection, ids))
+        if collection == "products":
+            return index.apply_product_changes(db, ids)
+        return index.apply_category_changes(db, ids)
+
+    versions.on_change(on_change)
+    # Another worker's writes
+    writer = CollectionVersions(db, ["products", "categories"])
+    await db.products.insert_one({"id": "p3", "name": "Cream tee", "category_id": "c1"})
+    await writer.bump("products", ["p3"])
+    await db.products.delete_one({"id": "p2"})
+    await writer.bump("products", ["p2"])
+    await db.categories.update_one({"id": "c1"}, {"$set": {"name": "Outerwear"}})
+    await writer.bump("categories", ["c1"])
+    await versions.sync()
+
+    assert seen == [("products", ["p3", "p2"]), ("categories", ["c1"])]
+    assert index.built_at == built_at
+    assert index.search("tee") == ["p3"]
+    assert index.search("hoodie") == []
+    assert sorted(index.search("outerwear")) == ["p1", "p3"]
+
+
+async def test_changes_older_than_the_log_mean_unknown(db):
+    versions = CollectionVersions(db, ["products"])
+    await versions.start()
+    writer = CollectionVersions(db, ["products"])
+    for n in range(CHANGE_LOG_SIZE + 1):
+        await writer.bump("products", [f"p{n}"])
+    seen = []
+    versions.on_change(lambda collection, ids: seen.append(ids))
+    await versions.sync()
+    assert seen == [None]
+    assert len((await db.cache_versions.find_one({"_id": "products"}))["changes"]) == CHANGE_LOG_SIZE
+
+    await writer.bump("products", [])
+    await versions.sync()
+    assert seen == [None, []]
+
+
+async def test_forced_refresh_queues_behind_a_running_rebuild(db):
+    await db.products.insert_one({"id": "p1", "name": "Denim jacket"})
+    index = ProductSearchIndex()
+    running = index.maybe_refresh(db, force=True)
+    # Written after the running rebuild may have read the collection
+    await db.products.insert_one({"id": "p2", "name": "Black hoodie"})
+    assert index.maybe_refresh(db, force=True) is running
+    await running
+    assert index.search("hoodie") == ["p2"]
+
+
+def test_etag_includes_the_build():
+    versions = CollectionVersions(None, ["products", "categories"])
+    middleware = CatalogCacheMiddleware(None, versions, [(r"/api/products", ["products", "categories"])], "public", build="abc123")
+    assert middleware._etag("/api/products") == 'W/"abc123-p0-c0"'
+    assert middleware._etag("/api/orders") is None
+
+
+async def test_no_store_responses_are_not_tagged():
+    async def app(scope, receive, send):
+        headers = [(b"cache-control", b"no-store")] if scope["path"] == "/api/products" else []
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        await send({"type": "http.response.body", "body": b"[]"})
+
+    versions = CollectionVersions(None, ["products"])
+    middleware = CatalogCacheMiddleware(app, versions, [(r"/api/.*", ["products"])], "public", build="abc123")
+    for path, etag in [("/api/products", None), ("/api/categories", b'W/"abc123-p0"')]:
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        await middleware({"type": "http", "method": "GET", "path": path, "headers": []}, None, send)
+        assert dict(sent[0]["headers"]).get(b"etag") == etag
+
+
+async def test_index_is_ready_after_the_background_build(db):
+    await db.products.insert_one({"id": "p1", "name": "Denim jacket"})
+    index = ProductSearchIndex()
+    task = index.maybe_refresh(db)
+    assert not index.ready
+    await task
+    assert index.ready and index.search("denim") == ["p1"]
@@ -0,0 +1,75 @@
+import pytest
+from PIL import Image
+
+from http_cache import CollectionVersions
+from images import ImageDerivativePipeline
+from uploads import attach_image_widths
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_only_generated_derivatives_are_advertised(db, tmp_path):
+    Image.new("RGB", (800, 600), "red").save(tmp_path / "good.jpg")
+    (tmp_path / "broken.jpg").write_bytes(b"\xff\xd8\xffnot really a jpeg")
+    pipeline = ImageDerivativePipeline(db, tmp_path, workers=1, widths=(320, 640))
+    try:
+        await pipeline.schedule("good.jpg")
+        await pipeline.schedule("broken.jpg")
+    finally:
+        pipeline.shutdown()
+
+    assert (tmp_path / "good-320w.webp").exists()
+    assert (await db.uploads.find_one({"id": "good.jpg"}))["derivatives"]["webp"] == [320, 640]
+    assert "derivatives_error" in await db.uploads.find_one({"id": "broken.jpg"})
+
+    products = [
+        {"id": "p1", "images": ["https://shop.test/api/uploads/good.jpg", "https://shop.test/api/uploads/broken.jpg"]},
+        {"id": "p2", "images": ["https://cdn.test/pending.jpg"]},
+    ]
+    await attach_image_widths(db, products)
+    assert products[0]["image_widths"] == {"good.jpg": [320, 640]}
+    assert "image_widths" not in products[1]
+
+
+async def test_backfill_records_existing_and_skips_earlier_failures(db, tmp_path):
+    Image.new("RGB", (400, 300), "blue").save(tmp_path / "old.jpg")
+    Image.new("RGB", (400, 300), "green").save(tmp_path / "done.jpg")
+    (tmp_path / "bad.jpg").write_bytes(b"\xff\xd8\xffnot really a jpeg")
+    pipeline = ImageDerivativePipeline(db, tmp_path, workers=1, widths=(320,))
+    try:
+        await pipeline.schedule("done.jpg")
+        await db.uploads.delete_many({})  # generated before derivatives were recorded
+        await pipeline.schedule("bad.jpg")
+
+        result = await pipeline.backfill()
+        assert result == {"generated": 1, "failed": 0, "recorded": 1, "skipped_failed": 1}
+        expected = {fmt: [320] for fmt in pipeline.formats}
+        assert (await db.uploads.find_one({"id": "old.jpg"}))["derivatives"] == expected
+        assert (await db.uploads.find_one({"id": "done.jpg"}))["derivatives"] == expected
+
+        assert (await pipeline.backfill(retry_failed=True))["failed"] == 1
+    finally:
+        pipeline.shutdown()
+    assert not list(tmp_path.glob(".*.tmp"))
+
+
+async def test_recorded_derivatives_move_the_product_etags_on(db, tmp_path):
+    Image.new("RGB", (400, 300), "red").save(tmp_path / "new.jpg")
+    Image.new("RGB", (400, 300), "blue").save(tmp_path / "old1.jpg")
+    Image.new("RGB", (400, 300), "blue").save(tmp_path / "old2.jpg")
+    (tmp_path / "broken.jpg").write_bytes(b"\xff\xd8\xffnot really a jpeg")
+    versions = CollectionVersions(db, ["products"])
+    pipeline = ImageDerivativePipeline(db, tmp_path, workers=1, widths=(320,), versions=versions)
+    try:
+        await pipeline.schedule("new.jpg")
+        assert versions.get("products") == 1
+        await pipeline.schedule("broken.jpg")
+        assert versions.get("products") == 1
+
+        await pipeline.backfill(retry_failed=True)
+        # One bump for the whole backfill, not one per upload
+        assert versions.get("products") == 2
+        await pipeline.backfill()
+        assert versions.get("products") == 2
+    finally:
+        pipeline.shutdown()
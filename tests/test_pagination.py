@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+
+from pagination import decode_cursor, encode_cursor, fetch_page
+
+pytestmark = pytest.mark.anyio
+
+START = datetime(2024, 1, 1)
+
+
+async def insert(db, count: int, first: int = 0):
+    # Pairs of documents share a created_at, so the id tie-break matters
+    await db.orders.insert_many([
+        {"id": f"o{n:03d}", "created_at": START + timedelta(minutes=n // 2)}
+        for n in range(first, first + count)
+    ])
+
+
+async def walk(db, limit: int, **kwargs) -> list:
+    ids, cursor = [], None
+    while True:
+        page, cursor = await fetch_page(db.orders, {}, {"_id": 0}, limit, cursor, **kwargs)
+        ids += [doc["id"] for doc in page]
+        if cursor is None:
+            return ids
+
+
+async def test_pages_cover_every_document_once_in_order(db):
+    await insert(db, 25)
+    expected = [f"o{n:03d}" for n in reversed(range(25))]
+    assert await walk(db, 4) == expected
+    assert await walk(db, 25) == expected
+    assert await walk(db, 7, sort_field="id", sort_order=1) == sorted(expected)
+
+
+async def test_pages_stay_stable_when_newer_documents_arrive(db):
+    await insert(db, 10)
+    first, cursor = await fetch_page(db.orders, {}, {"_id": 0}, 4)
+    await insert(db, 5, first=10)
+    rest, _ = await fetch_page(db.orders, {}, {"_id": 0}, 10, cursor)
+    assert [doc["id"] for doc in first + rest] == [f"o{n:03d}" for n in reversed(range(10))]
+
+
+async def test_documents_without_a_sort_key_are_paged_too(db):
+    await insert(db, 5)
+    # Legacy rows: no created_at, or an explicit null
+    await db.orders.insert_many([{"id": "legacy1"}, {"id": "legacy0", "created_at": None}, {"id": "legacy2"}])
+    newest_first = [f"o{n:03d}" for n in reversed(range(5))] + ["legacy2", "legacy1", "legacy0"]
+    for limit in (1, 2, 3, 5, 8):
+        assert await walk(db, limit) == newest_first
+        assert await walk(db, limit, sort_order=1) == ["legacy0", "legacy1", "legacy2"] + [f"o{n:03d}" for n in range(5)]
+
+
+def test_cursor_round_trips_datetimes():
+    cursor = encode_cursor({"id": "o1", "created_at": START}, "created_at", -1)
+    assert decode_cursor(cursor, "created_at", -1) == (START, "o1")
+
+
+@pytest.mark.parametrize("cursor", ["garbage", "e30", encode_cursor({"id": "o1", "price": 5}, "price", 1)])
+def test_bad_or_foreign_cursors_are_rejected(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor, "created_at", -1)
+    assert error.value.status_code == 400
@@ -0,0 +1,40 @@
+from search import ProductSearchIndex
+
+
+def build(*names: str) -> ProductSearchIndex:
+    index = ProductSearchIndex()
+    for n, name in enumerate(names):
+        index.add({"id": f"p{n}", "name": name, "price": 10 + n, "in_stock": True})
+    return index
+
+
+def test_limit_keeps_the_full_ranking_order():
+    index = build(*[f"Denim jacket {n}" for n in range(50)], "Jacket", "Black denim")
+    full = index.search("denim")
+    assert len(full) == 51
+    assert index.search("denim", limit=10) == full[:10]
+    assert index.search("jac", limit=3) == index.search("jac")[:3]
+
+
+def test_total_counts_matches_past_the_limit():
+    index = build(*[f"Denim jacket {n}" for n in range(50)], "Black tee")
+    ranked, total = index.search_with_total("denim", limit=10)
+    assert len(ranked) == 10
+    assert total == 50
+    assert index.search_with_total("hoodie", limit=10) == ([], 0)
+
+
+def test_short_prefixes_rank_exact_tokens_first():
+    index = build("Jam jar", "Jacket", "Ja tee")
+    assert index.search("ja") == ["p2", "p1", "p0"]
+    assert index.search("jam") == ["p0"]
+    assert index.search("jac") == ["p1"]
+
+
+def test_removed_products_leave_the_short_prefix_postings():
+    index = build("Jacket", "Jade tee")
+    index.remove("p0")
+    assert index.search("ja") == ["p1"]
+    index.remove("p1")
+    assert index.search("ja") == []
+    assert index.stats()["short_prefixes"] == 0
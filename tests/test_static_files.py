@@ -0,0 +1,107 @@
+import hashlib
+
+import httpx
+import pytest
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.routing import Mount
+
+from static_files import FileRangeResponse, ImmutableStaticFiles, parse_range
+
+pytestmark = pytest.mark.anyio
+
+BODY = bytes(range(256)) * 4
+NAME = hashlib.sha256(BODY).hexdigest() + ".jpg"
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 1023)),
+    ("bytes=-100", (924, 1023)),
+    ("bytes=-5000", (0, 1023)),
+    ("bytes=1000-5000", (1000, 1023)),
+    ("bytes=0-9,20-29", None),
+    ("bytes=-", None),
+    ("items=0-9", None),
+    ("bytes=a-b", None),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, len(BODY)) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=1024-", "bytes=10-5", "bytes=-0"])
+def test_unsatisfiable_ranges_are_416(header):
+    with pytest.raises(HTTPException) as raised:
+        parse_range(header, len(BODY))
+    assert raised.value.status_code == 416
+    assert raised.value.headers == {"Content-Range": "bytes */1024"}
+
+
+@pytest.fixture
+async def client(tmp_path):
+    (tmp_path / NAME).write_bytes(BODY)
+    app = Starlette(routes=[Mount("/uploads", app=ImmutableStaticFiles(directory=tmp_path))])
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
+
+async def test_full_and_ranged_responses(client):
+    full = await client.get(f"/uploads/{NAME}")
+    assert full.status_code == 200
+    assert full.content == BODY
+    assert full.headers["etag"] == f'"{NAME[:64]}"'
+    assert full.headers["cache-control"] == "public, max-age=31536000, immutable"
+    assert full.headers["accept-ranges"] == "bytes"
+
+    part = await client.get(f"/uploads/{NAME}", headers={"Range": "bytes=100-299"})
+    assert part.status_code == 206
+    assert part.content == BODY[100:300]
+    assert part.headers["content-range"] == "bytes 100-299/1024"
+    assert part.headers["content-length"] == "200"
+
+    head = await client.head(f"/uploads/{NAME}", headers={"Range": "bytes=-24"})
+    assert head.status_code == 206
+    assert head.headers["content-range"] == "bytes 1000-1023/1024"
+    assert head.content == b""
+
+    # Several ranges at once are answered with the whole file
+    multi = await client.get(f"/uploads/{NAME}", headers={"Range": "bytes=0-9,20-29"})
+    assert multi.status_code == 200
+    assert multi.content == BODY
+
+    past_end = await client.get(f"/uploads/{NAME}", headers={"Range": "bytes=2000-"})
+    assert past_end.status_code == 416
+    assert past_end.headers["content-range"] == "bytes */1024"
+
+
+async def test_if_range_and_revalidation(client):
+    etag = (await client.get(f"/uploads/{NAME}")).headers["etag"]
+
+    matching = await client.get(f"/uploads/{NAME}", headers={"Range": "bytes=0-9", "If-Range": etag})
+    assert matching.status_code == 206
+    assert matching.content == BODY[:10]
+
+    stale = await client.get(f"/uploads/{NAME}", headers={"Range": "bytes=0-9", "If-Range": '"something-else"'})
+    assert stale.status_code == 200
+    assert stale.content == BODY
+
+    assert (await client.get(f"/uploads/{NAME}", headers={"If-None-Match": etag})).status_code == 304
+    assert (await client.get("/uploads/missing.jpg")).status_code == 404
+
+
+async def test_range_response_uses_zero_copy_when_offered(tmp_path):
+    path = tmp_path / NAME
+    path.write_bytes(BODY)
+    sent = []
+
+    async def send(message):
+        if message["type"] == "http.response.zerocopy":
+            message["file"].seek(message["offset"])
+            message = {**message, "body": message["file"].read(message["count"])}
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "extensions": {"http.response.zerocopy": {}}}
+    await FileRangeResponse(str(path), 10, 19, len(BODY), {}, "image/jpeg")(scope, None, send)
+    assert sent[0]["status"] == 206
+    assert sent[1]["type"] == "http.response.zerocopy"
+    assert sent[1]["body"] == BODY[10:20]
@@ -0,0 +1,113 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from stats import REBUILD_ID, TOTALS_ID, RebuildInProgress, StatsEngine
+
+pytestmark = pytest.mark.anyio
+
+
+def make_order(total: int, days_ago: int = 0, **fields) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "total": total,
+        "status": "pending",
+        "paid": False,
+        "created_at": datetime.utcnow() - timedelta(days=days_ago),
+        **fields,
+    }
+
+
+# The same steps the order handlers in server.py take
+async def create_order(engine: StatsEngine, db, order: dict):
+    token = await engine.rebuild_token()
+    await db.orders.insert_one({**order, **engine.new_order_fields(token, order)})
+    await engine.record_order_created(order, token)
+
+
+async def change_status(engine: StatsEngine, db, order_id: str, status: str):
+    token = await engine.track_change(order_id)
+    previous = await db.orders.find_one_and_update(
+        {"id": order_id}, {"$set": {"status": status, **engine.tracked_fields(token, status=status)}}
+    )
+    await engine.record_status_change(previous, previous["status"], status, token)
+
+
+async def mark_paid(engine: StatsEngine, db, order_id: str):
+    token = await engine.track_change(order_id)
+    previous = await db.orders.find_one_and_update(
+        {"id": order_id, "paid": {"$ne": True}},
+        {"$set": {"status": "processing", "paid": True, **engine.tracked_fields(token, status="processing", paid=True)}}
+    )
+    if previous:
+        await engine.record_paid(previous, "processing", token)
+
+
+async def materialized(db) -> tuple:
+    totals = await db.stats.find_one({"_id": TOTALS_ID}, {"_id": 0})
+    days = await db.stats_daily.find().sort("_id", 1).to_list(None)
+    # Counters that went up and back down again are left at zero
+    strip = lambda doc: {
+        **{k: v for k, v in doc.items() if k != "by_status" and v},
+        "by_status": {s: v for s, v in doc.get("by_status", {}).items() if v["count"]},
+    }
+    return strip(totals), [strip(day) for day in days]
+
+
+async def test_incremental_updates_match_rebuild(db):
+    engine = StatsEngine(db, settle_seconds=0)
+    await engine.rebuild()
+    orders = [make_order(10 * i, days_ago=i % 3) for i in range(1, 7)]
+    for order in orders:
+        await create_order(engine, db, order)
+    await change_status(engine, db, orders[0]["id"], "shipped")
+    await mark_paid(engine, db, orders[1]["id"])
+    await mark_paid(engine, db, orders[1]["id"])
+
+    incremental = await materialized(db)
+    await engine.rebuild()
+    assert await materialized(db) == incremental
+    assert incremental[0]["orders"] == 6
+    assert incremental[0]["paid_revenue"] == 20
+
+
+async def test_rebuild_while_orders_are_written(db):
+    engine = StatsEngine(db, settle_seconds=0.02)
+    existing = [make_order(5 * i, days_ago=i % 2) for i in range(1, 21)]
+    for order in existing:
+        await create_order(engine, db, order)
+    # Today's stats_daily document already exists, which used to break insert_many
+
+    async def writer(n: int):
+        for i in range(15):
+            order = make_order(n * 100 + i)
+            await create_order(engine, db, order)
+            await asyncio.sleep(0.002)
+            await change_status(engine, db, existing[(n + i) % len(existing)]["id"], ["processing", "shipped"][i % 2])
+            await mark_paid(engine, db, order["id"] if i % 3 else existing[i]["id"])
+            await asyncio.sleep(0.002)
+
+    await asyncio.gather(engine.rebuild(), *(writer(n) for n in range(1, 5)))
+
+    during = await materialized(db)
+    assert during[0]["orders"] == 20 + 4 * 15
+    assert await db.meta.find_one({"_id": REBUILD_ID}) is None
+    assert await db.orders.count_documents({REBUILD_ID: {"$exists": True}}) == 0
+    assert "stats_daily_rebuild" not in " ".join(await db.list_collection_names())
+
+    # A rebuild with nothing else going on agrees with the result
+    await engine.rebuild()
+    assert await materialized(db) == during
+
+
+async def test_only_one_rebuild_at_a_time(db):
+    engine = StatsEngine(db, settle_seconds=0.05)
+    await create_order(engine, db, make_order(10))
+    first = asyncio.ensure_future(engine.rebuild())
+    await asyncio.sleep(0.01)
+    with pytest.raises(RebuildInProgress):
+        await engine.rebuild()
+    await first
+    assert (await db.stats.find_one({"_id": TOTALS_ID}))["orders"] == 1
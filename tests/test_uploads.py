@@ -0,0 +1,108 @@
+import os
+import time
+
+import httpx
+import pytest
+from fastapi import FastAPI, File, UploadFile
+
+import uploads
+from uploads import MULTIPART_OVERHEAD, UploadSizeLimit, collect_garbage, record_upload
+
+pytestmark = pytest.mark.anyio
+
+MAX_SIZE = 1024 * 1024
+
+
+def make_app():
+    app = FastAPI()
+
+    @app.post("/upload")
+    async def upload(file: UploadFile = File(...)):
+        return {"size": len(await file.read())}
+
+    app.add_middleware(UploadSizeLimit, paths=["/upload"], max_size=MAX_SIZE)
+    return app
+
+
+def multipart(size: int, chunk: int = 64 * 1024):
+    """A multipart body streamed in chunks, without a Content-Length"""
+    head = b'--b\r\nContent-Disposition: form-data; name="file"; filename="a.jpg"\r\n\r\n'
+
+    async def body():
+        yield head
+        for start in range(0, size, chunk):
+            yield b"x" * min(chunk, size - start)
+        yield b"\r\n--b--\r\n"
+
+    return {"content": body(), "headers": {"Content-Type": "multipart/form-data; boundary=b"}}
+
+
+async def post(app, **request):
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://t") as client:
+        return await client.post("/upload", **request)
+
+
+async def test_streamed_body_over_the_limit_is_rejected():
+    response = await post(make_app(), **multipart(MAX_SIZE + MULTIPART_OVERHEAD + 1))
+    assert response.status_code == 413
+    assert response.json()["detail"] == "File too large. Max 1MB allowed."
+
+
+async def test_streamed_body_under_the_limit_is_accepted():
+    response = await post(make_app(), **multipart(MAX_SIZE))
+    assert response.status_code == 200
+    assert response.json() == {"size": MAX_SIZE}
+
+
+async def test_declared_length_over_the_limit_is_rejected_up_front():
+    response = await post(make_app(), content=b"x" * (MAX_SIZE + MULTIPART_OVERHEAD + 1))
+    assert response.status_code == 413
+
+
+def store(directory, name: str, age_hours: float = 0) -> str:
+    path = directory / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"\xff\xd8\xff" + name.encode())
+    stamp = time.time() - age_hours * 3600
+    os.utime(path, (stamp, stamp))
+    return name
+
+
+async def test_gc_deletes_only_old_unreferenced_files(db, tmp_path):
+    old = store(tmp_path, "aa/bb/old.jpg", age_hours=48)
+    store(tmp_path, "aa/bb/old-320w.webp", age_hours=48)
+    fresh = store(tmp_path, "aa/cc/fresh.jpg", age_hours=1)
+    used = store(tmp_path, "aa/dd/used.jpg", age_hours=48)
+    await db.products.insert_one({"id": "p1", "images": [f"https://shop.test/api/uploads/{used}"]})
+
+    preview = await collect_garbage(db, tmp_path, dry_run=True)
+    assert preview["deleted"] == [old] and (tmp_path / old).exists()
+
+    result = await collect_garbage(db, tmp_path)
+    assert result["deleted"] == [old]
+    assert not (tmp_path / old).exists() and not (tmp_path / "aa/bb").exists()
+    assert (tmp_path / fresh).exists() and (tmp_path / used).exists()
+    assert await db.uploads.find_one({"id": old}) is None
+    assert {doc["id"] async for doc in db.uploads.find()} == {fresh, used}
+    assert not (tmp_path / ".trash").exists()
+
+
+async def test_gc_backs_off_from_a_file_uploaded_again_mid_run(db, tmp_path, monkeypatch):
+    name = store(tmp_path, "aa/bb/again.jpg", age_hours=48)
+    count_references = uploads.count_references
+    calls = 0
+
+    async def reupload_after_the_claim(db):
+        nonlocal calls
+        calls += 1
+        if calls == 2:
+            # What save_upload does for identical bytes: record, then touch the file
+            await record_upload(db, name, "sha", 10, "jpeg")
+            os.utime(tmp_path / name)
+        return await count_references(db)
+
+    monkeypatch.setattr(uploads, "count_references", reupload_after_the_claim)
+    result = await collect_garbage(db, tmp_path)
+    assert result["deleted"] == []
+    assert (tmp_path / name).exists()
+    assert "gc_claim" not in await db.uploads.find_one({"id": name})
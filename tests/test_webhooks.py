@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from indexes import INDEXES, WEBHOOK_EVENT_RETENTION_SECONDS
+from webhooks import DONE, FAILED, PENDING, PROCESSING, WebhookQueue
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def events(db):
+    await db.webhook_events.create_indexes(INDEXES["webhook_events"])
+    return db.webhook_events
+
+
+def recording_queue(db, **kwargs):
+    handled = []
+
+    async def handler(batch):
+        handled.append([event["n"] for event in batch])
+
+    return WebhookQueue(db, handler, **kwargs), handled
+
+
+async def test_redelivered_events_are_stored_once(db, events):
+    queue, handled = recording_queue(db)
+    assert await queue.enqueue("evt1", {"n": 1})
+    assert not await queue.enqueue("evt1", {"n": 1})
+    assert await events.count_documents({}) == 1
+
+    assert await queue.process_batch() == 1
+    assert await queue.process_batch() == 0
+    assert handled == [[1]]
+    event = await events.find_one({"id": "evt1"})
+    assert event["status"] == DONE and "claim" not in event and event["processed_at"] is not None
+    assert queue.stats()["duplicates"] == 1
+
+
+async def test_expired_lease_is_claimed_again(db, events):
+    queue, handled = recording_queue(db, lease=60)
+    await queue.enqueue("evt1", {"n": 1})
+    # A worker claims the event and dies before completing it
+    stale = await queue._claim()
+    assert [e["id"] for e in stale] == ["evt1"]
+    assert await queue._claim() == []
+
+    await events.update_one({"id": "evt1"}, {"$set": {"available_at": datetime.utcnow() - timedelta(seconds=1)}})
+    assert await queue.process_batch() == 1
+    assert handled == [[1]]
+
+    # The dead worker's late completion no longer owns the event
+    await events.update_one({"id": "evt1"}, {"$set": {"status": PROCESSING, "claim": "newer"}})
+    await queue._complete(stale)
+    assert (await events.find_one({"id": "evt1"}))["claim"] == "newer"
+
+
+async def test_failed_batches_back_off_then_give_up(db, events):
+    async def handler(batch):
+        raise RuntimeError("boom")
+
+    queue = WebhookQueue(db, handler, max_attempts=2)
+    await queue.enqueue("evt1", {"n": 1})
+
+    assert await queue.process_batch() == 1
+    event = await events.find_one({"id": "evt1"})
+    assert event["status"] == PENDING and event["error"] == "boom"
+    assert event["available_at"] > datetime.utcnow()
+
+    await events.update_one({"id": "evt1"}, {"$set": {"available_at": datetime.utcnow()}})
+    assert await queue.process_batch() == 1
+    event = await events.find_one({"id": "evt1"})
+    assert event["status"] == FAILED and event["attempts"] == 2
+    assert queue.stats()["retried"] == 1 and queue.stats()["failed"] == 1
+
+
+async def test_processed_events_expire(events):
+    ttl = [index for index in (await events.index_information()).values() if "expireAfterSeconds" in index]
+    assert [(list(index["key"]), index["expireAfterSeconds"]) for index in ttl] == [
+        ([("processed_at", 1)], WEBHOOK_EVENT_RETENTION_SECONDS)
+    ]